@@ -2,8 +2,9 @@ from flask import redirect, request, session, jsonify
 from spotipy.oauth2 import SpotifyOAuth
 import spotipy
 
-from app.utils.utils import *
 from app.config import Config
+from app.database import db_session
+from app.models import User
 from . import auth_bp
 
 scope = "user-library-read user-read-email user-read-recently-played user-top-read"
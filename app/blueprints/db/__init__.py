@@ -1,7 +1,12 @@
 from flask import Blueprint
 
 db_bp = Blueprint('database', __name__, url_prefix='/db')
-# TODO: rethink database logic. Not store everything in one table, split it up by years?, or half years?
-# Queries on specific dates take too long
+# History can be stored split by year, see app/partitions.py (Config.HISTORY_PARTITIONED)
+
+from app.shards import route_history_shard, release_history_shard
+
+# every request reads the history of its account's own database, see app/shards.py
+db_bp.before_request(route_history_shard)
+db_bp.teardown_request(release_history_shard)
 
 from . import routes, utils
\ No newline at end of file
@@ -1,17 +1,29 @@
-from flask import jsonify, session, current_app, request
-from sqlalchemy import func, desc, extract
-import pandas as pd
-
-from app.blueprints.auth.routes import get_spotify_client
-from app.utils.utils import *
+from flask import jsonify, session, request, url_for
+from sqlalchemy import func, select
+from datetime import datetime
+import os
+import zipfile
+
+from app.config import Config
+from app.models import Artist, Track, DailyArtistPlays
+from app.partitions import history_source
+from app.shards import current_history_account, history_session, resolve_account
+from app.snapshots import history_snapshot
+from app.utils import analytics_utils as analytics
+from app.utils.period_utils import ALL_TIME, in_period, request_period
+from app.prefix_sums import top_in_window
+from app.database import get_user_engine
+from app.utils.job_utils import create_import_job, discard_import_job, get_import_job, start_import_job
 from . import db_bp
 
 
 @db_bp.route('/check_history')
 def check_history():
-    account_id = request.args.get('account_id')
+    account = current_history_account() # resolved from account_id by the shard routing
 
-    if not os.path.exists(f"app/data/{account_id}"):
+    # plays in the history the account reads: its own database, or the shared one before its first import
+    history = history_source('id')
+    if not account or history_session.query(history.id).first() is None:
         return jsonify({'error': 'No history found for this account'}), 404
     else:
         return jsonify({'message': 'History found for this account'})
@@ -25,212 +37,294 @@ def check_history():
 
 
 MS_IN_HOUR = 1000 * 60 * 60
+UPLOAD_BLOCK_SIZE = 1024 * 1024
 
-# NOW it is route for importing json files from pc, and storing them in sqllite db
-# Ideally, it should be a route to accept json files from the frontend, and store them in the db
-# @db_bp.route('/upload_history', methods=['POST'])
-@db_bp.route('/upload_history')
+@db_bp.route('/upload_history', methods=['POST'])
 def upload_history():
-    # if not request.is_json:
-    #     return jsonify({'error': 'Invalid input, expected JSON'}), 400
-    # data = request.get_json()
-    # try:
-    #     tmp = read_json_and_store_data(json_data=data)
-    # except Exception as e:
-    #     return jsonify({'error': f'Failed to process data: {str(e)}'}), 500
-    
-    tmp = read_json_and_store_data(json_directory='./app/data/dionisiy')
+    '''
+    Accept a Spotify extended streaming history export (the ZIP as downloaded) and import it in the background.
+    The body is either the raw ZIP (Content-Type: application/zip) or a multipart form with a 'file' field;
+    either way it is spooled to disk block by block, never held in memory.
+    Returns the job id right away, poll /db/upload_history/<job_id> for progress.
+    The export is imported into the database of the logged in account (see app/shards.py),
+    never the one of an account_id argument.
+    '''
+    account = resolve_account(session['account_id']) if session.get('account_id') else None
+    if not account:
+        return jsonify({'error': 'Log in to upload a streaming history'}), 401
+
+    job = create_import_job()
+    zip_path = os.path.join(job.directory, 'export.zip')
+
+    if 'file' in request.files: # multipart: werkzeug already spooled it to a temporary file
+        request.files['file'].save(zip_path)
+    else:
+        with open(zip_path, 'wb') as f:
+            while block := request.stream.read(UPLOAD_BLOCK_SIZE):
+                f.write(block)
 
-    return jsonify(tmp.to_dict())
+    if not zipfile.is_zipfile(zip_path):
+        discard_import_job(job)
+        return jsonify({'error': 'Invalid input, expected the Spotify export ZIP'}), 400
 
-@db_bp.route('/history/track/<track_id>/stats', methods=['GET'])
-def get_track_stats(track_id):
-    # Strip the "spotify:track:" prefix from the URI for both queries
-    track_uri = f"spotify:track:{track_id}"
-    
-    # Query to get play count and total playtime (ms_played) per day for the track
-        
-    play_counts = (
-        db_session.query(
-            func.date(StreamingHistory.ts).label('date'), 
-            func.count(StreamingHistory.ts).label('play_count'),
-            func.sum(StreamingHistory.ms_played).label('total_ms_played')  # Adding total playtime per day
-        )
-        .filter(StreamingHistory.spotify_track_uri == track_uri)
-        .group_by(func.date(StreamingHistory.ts))
-        .order_by(func.date(StreamingHistory.ts))
-        .all()
-        # db_session.query(
-        #     func.date(StreamingHistory.ts).label('date'), 
-        #     func.count(StreamingHistory.ts).label('play_count'),
-        #     func.sum(StreamingHistory.ms_played).label('total_ms_played')  # Adding total playtime per day
-        # )
-        # .filter(StreamingHistory.master_metadata_track_name.ilike(f'%{track_id}%'))
-        # .group_by(func.date(StreamingHistory.ts))
-        # .order_by(func.date(StreamingHistory.ts))
-        # .all()
-    )
-
-    # Query to get total playtime (ms_played) and other interesting stats
-    track_stats = (
-        db_session.query(
-            func.sum(StreamingHistory.ms_played).label('total_ms_played'),
-            func.count(StreamingHistory.ts).label('total_plays'),
-            func.min(StreamingHistory.ts).label('first_played'),
-            func.max(StreamingHistory.ts).label('last_played'),
-            func.count(func.distinct(func.date(StreamingHistory.ts))).label('distinct_days_played')
-        )
-        .filter(StreamingHistory.spotify_track_uri == track_uri)
-        .one()
-    )
-    
-    # Error handling: If the track was never played, return an error response
-    if not track_stats.total_plays:
-        return jsonify({'error': 'No stats available for this track'}), 404
-
-    # Convert 'first_played' and 'last_played' to datetime objects if they are strings
-    first_played = (
-        datetime.strptime(track_stats.first_played, '%Y-%m-%dT%H:%M:%SZ')
-        if isinstance(track_stats.first_played, str) else track_stats.first_played
-    )
-    last_played = (
-        datetime.strptime(track_stats.last_played, '%Y-%m-%dT%H:%M:%SZ')
-        if isinstance(track_stats.last_played, str) else track_stats.last_played
-    )
-    
-    # Calculate additional stats
-    avg_playtime = track_stats.total_ms_played / track_stats.total_plays if track_stats.total_plays > 0 else 0
-    total_days_played = (last_played - first_played).days if first_played and last_played else 0
-    
-    # Query to get most frequent playtime (hour)
-    most_frequent_playtime = (
-        db_session.query(
-            extract('hour', StreamingHistory.ts).label('hour'),
-            func.count(StreamingHistory.ts).label('play_count')
+    start_import_job(job, zip_path, get_user_engine(account))
+    return jsonify({
+        'job_id': job.id,
+        'status_url': url_for('database.upload_status', job_id=job.id),
+    }), 202
+
+@db_bp.route('/upload_history/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    ''' Progress of a background import: state, files done, rows inserted and throughput '''
+    job = get_import_job(job_id)
+    if not job:
+        return jsonify({'error': f'Import job {job_id} not found'}), 404
+    return jsonify(job.to_dict())
+
+STATS_BATCH_MAX = 500 # tracks/artists per batch stats request
+TRACK_URI_PREFIX = 'spotify:track:'
+
+def _played_at(ts):
+    '''A play's timestamp (ISO string or datetime) as a datetime.'''
+    return datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ') if isinstance(ts, str) else ts
+
+def play_stats(column, keys, period=ALL_TIME):
+    '''
+    Statistics of several tracks or artists in one grouped scan of their plays, instead of a
+    timeline query, a first/last play query and a most frequent hour query for each of them.
+    The plays are grouped by (track/artist, day, hour); the timeline, totals and hours are
+    folded from those groups.
+
+    Args:
+        column (str): 'track_id' or 'artist_id'.
+        keys (list): Ids of the tracks/artists.
+        period (Period): Only the plays of the period, all of them by default.
+
+    Returns:
+        dict: {id: stats} with the fields of get_track_stats, for the ids played in the period.
+    '''
+    if not keys:
+        return {}
+    history = history_source('id', 'ts', 'ms_played', column, 'play_date', 'play_hour', start=period.start, end=period.end)
+    key = getattr(history, column)
+    rows = history_session.execute(
+        select(
+            key, history.play_date, history.play_hour,
+            func.count(history.id), func.sum(history.ms_played), func.min(history.ts), func.max(history.ts),
         )
-        .filter(StreamingHistory.spotify_track_uri == track_uri)
-        .group_by(extract('hour', StreamingHistory.ts))
-        .order_by(func.count(StreamingHistory.ts).desc())
-        .limit(1)
-        .one()
+        .where(key.in_(keys), *in_period(history.play_date, period))
+        .group_by(key, history.play_date, history.play_hour)
+        .order_by(key, history.play_date, history.play_hour)
     )
 
-    # Convert play_counts to a list of dictionaries with both play count and total playtime
-    timeline_data = [
-        {"date": str(play_count[0]), "play_count": play_count[1], "total_ms_played": play_count[2]}
-        for play_count in play_counts
-    ]
+    groups = {}
+    for key_id, play_date, play_hour, plays, ms_played, first, last in rows:
+        group = groups.setdefault(key_id, {'days': {}, 'hours': {}, 'first': first, 'last': last})
+        day = group['days'].setdefault(play_date, [0, 0])
+        day[0] += plays
+        day[1] += ms_played
+        group['hours'][play_hour] = group['hours'].get(play_hour, 0) + plays
+        group['first'] = min(group['first'], first)
+        group['last'] = max(group['last'], last)
+
+    stats = {}
+    for key_id, group in groups.items():
+        total_plays = sum(plays for plays, _ in group['days'].values())
+        total_ms_played = sum(ms_played for _, ms_played in group['days'].values())
+        first_played, last_played = _played_at(group['first']), _played_at(group['last'])
+        # the earliest hour of the busiest ones
+        hour, hour_plays = max(group['hours'].items(), key=lambda item: (item[1], -item[0]))
+        stats[key_id] = {
+            'timeline_data': [
+                {"date": str(play_date), "play_count": plays, "total_ms_played": ms_played}
+                for play_date, (plays, ms_played) in group['days'].items()
+            ],
+            'total_ms_played': total_ms_played,
+            'total_plays': total_plays,
+            'distinct_days_played': len(group['days']),
+            'first_played': first_played.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_played': last_played.strftime('%Y-%m-%d %H:%M:%S'),
+            'avg_playtime_per_play': total_ms_played / total_plays,
+            'total_days_played': (last_played - first_played).days,
+            'most_frequent_play_hour': hour,
+            'most_frequent_play_count': hour_plays,
+        }
+    return stats
+
+def _artist_fields(stats):
+    '''The stats of play_stats an artist's stats have (no play hours).'''
+    return {field: value for field, value in stats.items() if not field.startswith('most_frequent_play')}
+
+def _batch_names(field):
+    '''
+    The list of names in the JSON body's field of a batch request.
+
+    Raises:
+        ValueError: on a missing or invalid list, with the message for the client.
+    '''
+    names = (request.get_json(silent=True) or {}).get(field)
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError(f'Invalid input, expected a JSON body with a list of strings in "{field}"')
+    if len(names) > STATS_BATCH_MAX:
+        raise ValueError(f'Too many {field}, at most {STATS_BATCH_MAX} per request')
+    return list(dict.fromkeys(names))
 
-    # Convert date times to ISO format strings for JSON output
-    first_played_str = first_played.strftime('%Y-%m-%d %H:%M:%S') if first_played else None
-    last_played_str = last_played.strftime('%Y-%m-%d %H:%M:%S') if last_played else None
+@db_bp.route('/history/track/<track_id>/stats', methods=['GET'])
+def get_track_stats(track_id):
+    '''
+    Get the statistics and daily timeline of a track\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    '''
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    # looked up first: a subquery in the filter would keep SQLite from pushing it into the year partitions
+    track_key = history_session.query(Track.id).filter(Track.uri == f"{TRACK_URI_PREFIX}{track_id}").scalar()
+    stats = play_stats('track_id', [track_key], period).get(track_key) if track_key is not None else None
 
-    return jsonify({
-        'track_id': track_id,
-        'timeline_data': timeline_data,
-        'total_ms_played': track_stats.total_ms_played,
-        'total_plays': track_stats.total_plays,
-        'distinct_days_played': track_stats.distinct_days_played,
-        'first_played': first_played_str,
-        'last_played': last_played_str,
-        'avg_playtime_per_play': avg_playtime,
-        'total_days_played': total_days_played,
-        'most_frequent_play_hour': most_frequent_playtime.hour if most_frequent_playtime else None,
-        'most_frequent_play_count': most_frequent_playtime.play_count if most_frequent_playtime else 0
-    })
+    # Error handling: If the track was never played, return an error response
+    if not stats:
+        return jsonify({'error': 'No stats available for this track'}), 404
+    return jsonify({'track_id': track_id, **stats})
 
 # Route to get statistics for a specific artist including timeline data
 @db_bp.route('/history/artist/<artist_name>/stats', methods=['GET'])
 def get_artist_stats(artist_name):
-    # Query to get daily play counts and total playtime per day for the artist
-    play_counts = (
-        db_session.query(
-            func.date(StreamingHistory.ts).label('date'),
-            func.count(StreamingHistory.ts).label('play_count'),
-            func.sum(StreamingHistory.ms_played).label('total_ms_played')
-        )
-        .filter(StreamingHistory.master_metadata_album_artist_name == artist_name)
-        .group_by(func.date(StreamingHistory.ts))
-        .order_by(func.date(StreamingHistory.ts))
-        .all()
-    )
+    '''
+    Get the statistics and daily timeline of an artist\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    '''
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    artist_key = history_session.query(Artist.id).filter(Artist.name == artist_name).scalar()
+    stats = play_stats('artist_id', [artist_key], period).get(artist_key) if artist_key is not None else None
 
-    # Query to get overall playtime and stats for the artist
-    artist_stats = (
-        db_session.query(
-            func.sum(StreamingHistory.ms_played).label('total_ms_played'),
-            func.count(StreamingHistory.ts).label('total_plays'),
-            func.min(StreamingHistory.ts).label('first_played'),
-            func.max(StreamingHistory.ts).label('last_played'),
-            func.count(func.distinct(func.date(StreamingHistory.ts))).label('distinct_days_played')
-        )
-        .filter(StreamingHistory.master_metadata_album_artist_name == artist_name)
-        .one()
-    )
-    
     # Error handling: If the artist has no plays, return an error response
-    if not artist_stats.total_plays:
+    if not stats:
         return jsonify({'error': f'No stats available for artist: {artist_name}'}), 404
-
-    # Convert 'first_played' and 'last_played' to datetime objects
-    first_played = (
-        datetime.strptime(artist_stats.first_played, '%Y-%m-%dT%H:%M:%SZ')
-        if isinstance(artist_stats.first_played, str) else artist_stats.first_played
+    return jsonify({'artist_name': artist_name, **_artist_fields(stats)})
+
+@db_bp.route('/history/tracks/stats', methods=['POST'])
+def get_tracks_stats():
+    '''
+    Get the statistics of several tracks at once, in one scan of their plays\n
+    body: {"tracks": [track URIs or ids]}, at most STATS_BATCH_MAX\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    returns:
+        tracks: the stats of get_track_stats of every played track, in the order asked for
+        not_found: the tracks without plays in the period
+    '''
+    try:
+        tracks = _batch_names('tracks')
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    track_ids = [track.removeprefix(TRACK_URI_PREFIX) for track in tracks]
+    track_keys = dict(
+        history_session.query(Track.uri, Track.id).filter(Track.uri.in_([f'{TRACK_URI_PREFIX}{track_id}' for track_id in track_ids]))
     )
-    last_played = (
-        datetime.strptime(artist_stats.last_played, '%Y-%m-%dT%H:%M:%SZ')
-        if isinstance(artist_stats.last_played, str) else artist_stats.last_played
-    )
-
-    # Calculate additional stats
-    avg_playtime = artist_stats.total_ms_played / artist_stats.total_plays if artist_stats.total_plays > 0 else 0
-    total_days_played = (last_played - first_played).days if first_played and last_played else 0
-
-    # Convert daily play counts to a timeline list
-    timeline_data = [
-        {"date": str(play_count[0]), "play_count": play_count[1], "total_ms_played": play_count[2]}
-        for play_count in play_counts
-    ]
-
-    # Convert date times to ISO format strings for JSON output
-    first_played_str = first_played.strftime('%Y-%m-%d %H:%M:%S') if first_played else None
-    last_played_str = last_played.strftime('%Y-%m-%d %H:%M:%S') if last_played else None
+    keys = {track: track_keys.get(f'{TRACK_URI_PREFIX}{track_id}') for track, track_id in zip(tracks, track_ids)}
+    stats = play_stats('track_id', [key for key in keys.values() if key is not None], period)
+    return jsonify({
+        'tracks': [{'track_id': track_id, **stats[keys[track]]} for track, track_id in zip(tracks, track_ids) if keys[track] in stats],
+        'not_found': [track for track in tracks if keys[track] not in stats],
+    })
 
+@db_bp.route('/history/artists/stats', methods=['POST'])
+def get_artists_stats():
+    '''
+    Get the statistics of several artists at once, in one scan of their plays\n
+    body: {"artists": [artist names]}, at most STATS_BATCH_MAX\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    returns:
+        artists: the stats of get_artist_stats of every played artist, in the order asked for
+        not_found: the artists without plays in the period
+    '''
+    try:
+        artists = _batch_names('artists')
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    keys = dict(history_session.query(Artist.name, Artist.id).filter(Artist.name.in_(artists)))
+    stats = play_stats('artist_id', list(keys.values()), period)
     return jsonify({
-        'artist_name': artist_name,
-        'timeline_data': timeline_data,
-        'total_ms_played': artist_stats.total_ms_played,
-        'total_plays': artist_stats.total_plays,
-        'distinct_days_played': artist_stats.distinct_days_played,
-        'first_played': first_played_str,
-        'last_played': last_played_str,
-        'avg_playtime_per_play': avg_playtime,
-        'total_days_played': total_days_played
+        'artists': [{'artist_name': artist, **_artist_fields(stats[keys[artist]])} for artist in artists if keys.get(artist) in stats],
+        'not_found': [artist for artist in artists if keys.get(artist) not in stats],
     })
 
+def artist_timelines(artist_ids, period=ALL_TIME):
+    '''
+    Daily timelines of several artists in one query over the daily rollup, instead of one query per artist.
+    Only the days of the period, all of them by default.
+
+    Returns:
+        dict: {artist_id: [(date, play_count, total_ms_played), ...]} by date, an empty list for artists without plays.
+    '''
+    timelines = {artist_id: [] for artist_id in artist_ids}
+    rows = history_session.execute(
+        select(DailyArtistPlays.artist_id, DailyArtistPlays.play_date, DailyArtistPlays.play_count, DailyArtistPlays.ms_played)
+        .where(DailyArtistPlays.artist_id.in_(artist_ids), *in_period(DailyArtistPlays.play_date, period))
+        .order_by(DailyArtistPlays.artist_id, DailyArtistPlays.play_date)
+    )
+    for artist_id, play_date, play_count, ms_played in rows:
+        timelines[artist_id].append((play_date, play_count, ms_played))
+    return timelines
+
 # Route to get the top N artists by playtime with optional timeline data
 @db_bp.route('/history/artists/top', methods=['GET'])
 def get_top_artists():
+    '''
+    Get the top N artists by playtime with their daily timelines\n
+    args:
+        limit: number of artists, default - 10
+        min_playtime: minimum playtime in hours, default - 1
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    '''
     # Get parameters from request (default to top 10 and minimum 1 hour playtime)
     top_n = int(request.args.get('limit', 10))
     min_playtime_hours = float(request.args.get('min_playtime', 1))
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
     
     # Convert minimum playtime to milliseconds
     min_playtime_ms = min_playtime_hours * 60 * 60 * 1000
 
-    # Query to get the top N artists by total playtime, filtered by minimum playtime
-    top_artists = (
-        db_session.query(
-            StreamingHistory.master_metadata_album_artist_name.label('artist_name'),
-            func.sum(StreamingHistory.ms_played).label('total_ms_played'),
-            func.count(StreamingHistory.ts).label('total_plays')
+    if Config.ANALYTICS_BACKEND == 'columnar':
+        snapshot = history_snapshot()
+        top = analytics.top_artists(snapshot, top_n, min_playtime_ms, period)
+        timelines = analytics.artist_timelines(snapshot, [artist.artist_id for artist in top], period)
+    elif Config.PREFIX_SUMS:
+        # Summed up over the window from the prefix-sum index, one vectorized pass over the artists
+        top = top_in_window(history_session, 'artist', 'total_ms_played', top_n, period, min_ms_played=min_playtime_ms)
+        timelines = artist_timelines([artist.artist_id for artist in top], period)
+    else:
+        # Query to get the top N artists by total playtime, filtered by minimum playtime (daily rollup)
+        top = (
+            history_session.query(
+                DailyArtistPlays.artist_id,
+                func.sum(DailyArtistPlays.ms_played).label('total_ms_played'),
+                func.sum(DailyArtistPlays.play_count).label('total_plays')
+            )
+            .filter(*in_period(DailyArtistPlays.play_date, period))
+            .group_by(DailyArtistPlays.artist_id)
+            .having(func.sum(DailyArtistPlays.ms_played) >= min_playtime_ms)
+            .order_by(func.sum(DailyArtistPlays.ms_played).desc())
+            .limit(top_n)
+            .all()
         )
-        .group_by(StreamingHistory.master_metadata_album_artist_name)
-        .having(func.sum(StreamingHistory.ms_played) >= min_playtime_ms)
-        .order_by(func.sum(StreamingHistory.ms_played).desc())
-        .limit(top_n)
-        .all()
-    )
+        timelines = artist_timelines([artist.artist_id for artist in top], period)
+    # Join the names in for the top rows only
+    names = dict(history_session.query(Artist.id, Artist.name).filter(Artist.id.in_([artist.artist_id for artist in top])))
+    top_artists = [(artist, names.get(artist.artist_id)) for artist in top]
 
     # If no artists found, return an empty list
     if not top_artists:
@@ -239,19 +333,8 @@ def get_top_artists():
     # Collect the artist data with optional daily timeline
     top_artists_data = []
     
-    for artist in top_artists:
-        # Query to get daily play counts and total playtime for this artist (for each day)
-        play_counts = (
-            db_session.query(
-                func.date(StreamingHistory.ts).label('date'),
-                func.count(StreamingHistory.ts).label('play_count'),
-                func.sum(StreamingHistory.ms_played).label('total_ms_played')
-            )
-            .filter(StreamingHistory.master_metadata_album_artist_name == artist.artist_name)
-            .group_by(func.date(StreamingHistory.ts))
-            .order_by(func.date(StreamingHistory.ts))
-            .all()
-        )
+    for artist, artist_name in top_artists:
+        play_counts = timelines[artist.artist_id]
 
         # Convert daily play counts to a timeline list
         timeline_data = [
@@ -261,7 +344,7 @@ def get_top_artists():
 
         # Add artist data and timeline to the result
         top_artists_data.append({
-            'artist_name': artist.artist_name,
+            'artist_name': artist_name,
             'total_ms_played': artist.total_ms_played,
             'total_plays': artist.total_plays,
             'timeline_data': timeline_data  # Add the timeline here
@@ -282,26 +365,39 @@ def fetch_played_tracks():
 
     Example: /played-tracks?limit_count=5&limit_play=100000
     """
+    history = history_source('id', 'track_id', 'ms_played')
     limit_count = request.args.get('limit_count', 0, type=int)  # Default to 0 if not provided
     limit_play = request.args.get('limit_play', 0, type=int)  # Default to 0 if not provided
     
     # Fetch tracks from StreamingHistory model where play count or total playtime exceeds the given limits
-    play_counts = (
-        db_session.query(
-            StreamingHistory.master_metadata_track_name.label('track_name'),
-            StreamingHistory.master_metadata_album_artist_name.label('artist_name'),
-            StreamingHistory.spotify_track_uri.label('spotify_track_uri'),
-            func.count(StreamingHistory.ts).label('play_count'),
-            func.sum(StreamingHistory.ms_played).label('total_ms_played')
+    played = (
+        history_session.query(
+            history.track_id,
+            func.count(history.id).label('play_count'),
+            func.sum(history.ms_played).label('total_ms_played')
         )
-        .filter(StreamingHistory.spotify_track_uri != None)
-        .group_by(StreamingHistory.spotify_track_uri, StreamingHistory.master_metadata_track_name)
+        .filter(history.track_id != None)
+        .group_by(history.track_id)
         .having(
-            func.count(StreamingHistory.ts) > limit_count
+            func.count(history.id) > limit_count
         )
         .having(
-            func.sum(StreamingHistory.ms_played) > limit_play
+            func.sum(history.ms_played) > limit_play
+        )
+        .subquery()
+    )
+    play_counts = (
+        history_session.query(
+            Track.name.label('track_name'),
+            Artist.name.label('artist_name'),
+            Track.uri.label('spotify_track_uri'),
+            played.c.play_count,
+            played.c.total_ms_played
         )
+        .select_from(played)
+        .join(Track, Track.id == played.c.track_id)
+        .outerjoin(Artist, Artist.id == Track.artist_id)
+        .order_by(Track.uri)
         .all()
     )
     
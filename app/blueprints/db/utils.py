@@ -1,15 +1,29 @@
 from flask import jsonify, session, current_app, request
-from sqlalchemy import func, desc, extract, case, distinct
-from datetime import datetime
-import pandas as pd
+from sqlalchemy import func, desc, extract, case, distinct, select
+from datetime import datetime, timezone
+from itertools import chain
+import numpy as np
 
 from app.blueprints.auth.routes import get_spotify_client
-from app.utils.utils import *
+from app.config import Config
+from app.models import StreamingHistory, Artist, Album, Track, DailyPlays, DailyTrackPlays
+from app.partitions import history_source
+from app.prefix_sums import top_in_window
+from app.queries import parse_query, run_query
+from app.shards import history_session
+from app.snapshots import history_snapshot
+from app.summaries import history_summary
+from app.utils import analytics_utils as analytics
+from app.utils.spotify_utils import get_track_metadata
+from app.utils.period_utils import ALL_TIME, in_period, period_ms, request_period
+from app.utils.search_utils import SEARCH_DIMENSIONS, matching_ids, name_matches, search_names
+from app.utils.stream_utils import json_response, json_rows_response, ndjson_response, ndjson_rows_response, wants_ndjson
 from . import db_bp
 
 MS_IN_DAY = 1000 * 60 * 60 * 24
 MS_IN_HOUR = 1000 * 60 * 60
 MS_IN_MINUTE = 1000 * 60
+DAYS_OF_WEEK = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
 
 # TODO: spotify uri to url util function
 
@@ -17,82 +31,246 @@ MS_IN_MINUTE = 1000 * 60
 # fetch records
 # region 
 
+RECORD_FETCH_CHUNK = 1000 # plays fetched (and encoded) at a time while a page of records is streamed
+RECORD_PAGE_LIMIT = 1000 # default page size of the artist/album records
+RECORD_PAGE_MAX = 10_000
+
+def record_args():
+    '''
+    The fields and cursor arguments of the record endpoints.
+        fields: optional, comma separated fields of the records (all of StreamingHistory.RECORD_FIELDS by default)
+        cursor: optional, next_cursor of the previous page
+
+    Returns:
+        tuple: (list of fields, cursor as int or None)
+
+    Raises:
+        ValueError: on an unknown field or an invalid cursor, with the message for the client.
+    '''
+    fields = request.args.get('fields', type=str)
+    fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else list(StreamingHistory.RECORD_FIELDS)
+    unknown = [field for field in fields if field not in StreamingHistory.RECORD_FIELDS]
+    if unknown or not fields:
+        raise ValueError(f'Invalid fields {", ".join(unknown)}, expected some of {", ".join(StreamingHistory.RECORD_FIELDS)}')
+    cursor = request.args.get('cursor', type=str)
+    if cursor is not None and not cursor.isdigit():
+        raise ValueError('Invalid cursor')
+    return fields, int(cursor) if cursor else None
+
+def play_columns(fields):
+    '''Columns of the plays behind the record fields: the dimension key for a name or the track uri.'''
+    dimensions = StreamingHistory.DIMENSION_FIELDS
+    return [dimensions[field][2] if field in dimensions else field for field in fields]
+
+def record_select(history, fields):
+    '''
+    Select of the record fields from a history source: play columns straight from the plays, names
+    and the track uri from the dimension tables, each joined once by id if a field needs it.
+    '''
+    columns, joins = [], {}
+    for field in fields:
+        if field in StreamingHistory.DIMENSION_FIELDS:
+            dimension, column, key = StreamingHistory.DIMENSION_FIELDS[field]
+            joins[dimension] = getattr(history, key)
+            columns.append(getattr(dimension, column))
+        else:
+            columns.append(getattr(history, field))
+    statement = select(*columns).select_from(history)
+    for dimension, key in joins.items():
+        statement = statement.outerjoin(dimension, dimension.id == key)
+    return statement
+
+def record_page(history, fields, *filters, limit, cursor):
+    '''
+    One page of plays in id order, with keyset pagination: the plays with an id above the cursor.
+    The page is bounded on the id index alone first, so the cursor of the next page is known before
+    the response starts; then only the requested columns are read, as plain rows, in chunks while
+    the response is streamed.
+
+    Args:
+        history: History source (see app.partitions.history_source).
+        fields (list): Columns of the records.
+        *filters: Conditions on the plays.
+        limit (int): Number of plays in the page.
+        cursor (int): Id of the last play of the previous page, None for the first page.
+
+    Returns:
+        tuple: (iterator of chunks of row tuples or None if the page is empty, id of the page's last play
+                if another page follows or None)
+    '''
+    after = [history.id > cursor] if cursor else []
+    # the last id of the page and the first one of the next page, if any
+    bounds = history_session.scalars(
+        select(history.id).where(*filters, *after).order_by(history.id).offset(limit - 1).limit(2)
+    ).all()
+    next_cursor = bounds[0] if len(bounds) == 2 else None
+    until = [history.id <= next_cursor] if next_cursor else []
+
+    chunks = history_session.execute(
+        record_select(history, fields).where(*filters, *after, *until).order_by(history.id)
+        .execution_options(yield_per=RECORD_FETCH_CHUNK)
+    ).partitions()
+    first = next(chunks, None)
+    if first is None:
+        return None, None
+    return chain([first], chunks), next_cursor
+
+def records_response(chunks, fields, next_cursor):
+    '''Stream a page of plays, as {"records": [...], "next_cursor": ...} or NDJSON, see get_all_records.'''
+    next_cursor = str(next_cursor) if next_cursor is not None else None
+    headers = {'X-Next-Cursor': next_cursor or 'null'}
+    if wants_ndjson():
+        return ndjson_rows_response(chunks or (), fields, headers=headers)
+    return json_rows_response(chunks or (), fields, 'records', headers=headers, next_cursor=next_cursor)
+
 @db_bp.route('/history/<int:limit>', methods=['GET']) # limit is the number of records to return, in url for dumbcheck purposes 
 def get_all_records(limit: int):
     ''' 
-    Retrieve the listening history from head
-        limit: number of records to return
+    Retrieve the listening history from head, a page at a time, streamed
+        limit: number of records per page
+        fields: optional, comma separated fields of the records, e.g. fields=ts,master_metadata_track_name (all by default)
+        cursor: optional, next_cursor of the previous page, to get the page after it
+        format: optional, 'json' (default, {"records": [...], "next_cursor": ...}) or 'ndjson' (one record per line)
+    The cursor of the next page is also sent in the X-Next-Cursor header, it is null on the last page.
     '''
-    records = db_session.query(StreamingHistory).limit(limit).all()
-    return jsonify([record.to_dict() for record in records])
+    try:
+        fields, cursor = record_args()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    history = history_source('id', *play_columns(fields))
+    chunks, next_cursor = record_page(history, fields, limit=max(1, limit), cursor=cursor)
+    return records_response(chunks, fields, next_cursor)
 
 @db_bp.route('/history/record/<int:id>', methods=['GET'])
 def get_streaming_record(id: int):
     '''
     Get specific record from listening history
         id: id of the record to return
+        fields: optional, comma separated fields of the record (all by default)
     '''
-    record = db_session.query(StreamingHistory).get(id)
+    try:
+        fields, _ = record_args()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    history = history_source('id', *play_columns(fields))
+    record = history_session.execute(record_select(history, fields).where(history.id == id)).first()
     if not record:
         return jsonify({'error': f'Record with id {id} not found'}), 404
     
-    return jsonify(record.to_dict())
+    return jsonify(dict(zip(fields, record)))
 
 @db_bp.route('/history/artist/<string:artist_name>', methods=['GET'])
 def get_by_artist(artist_name: str):
     '''
-    Retrieve all records filtered by artist name
+    Retrieve the records filtered by artist name, a page at a time, streamed like /history/<limit>
         artist_name: name of the artist to search for
+        limit: optional, number of records per page (default 1000, at most 10000)
+        fields: optional, comma separated fields of the records (all by default)
+        cursor: optional, next_cursor of the previous page
+        format: optional, 'json' (default) or 'ndjson'
     '''
-    records = db_session.query(StreamingHistory).filter(
-        StreamingHistory.master_metadata_album_artist_name.ilike(f'%{artist_name}%')
-    ).all()
-    if not records:
+    limit = max(1, min(request.args.get('limit', RECORD_PAGE_LIMIT, type=int), RECORD_PAGE_MAX))
+    try:
+        fields, cursor = record_args()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    history = history_source('id', 'artist_id', *play_columns(fields))
+    chunks, next_cursor = record_page(
+        history, fields, history.artist_id.in_(matching_ids(Artist, artist_name)), limit=limit, cursor=cursor
+    )
+    if chunks is None and cursor is None:
         return jsonify({'error': f'Records with artist name "{artist_name}" not found'}), 404
     
-    return jsonify([record.to_dict() for record in records])
+    return records_response(chunks, fields, next_cursor)
 
 @db_bp.route('/history/album/<string:album_name>', methods=['GET'])
 def get_by_album(album_name):
     '''
-    Retrieve all records filtered by album name
+    Retrieve the records filtered by album name, a page at a time, streamed like /history/<limit>
         album_name: name of the album to search for
+        limit: optional, number of records per page (default 1000, at most 10000)
+        fields: optional, comma separated fields of the records (all by default)
+        cursor: optional, next_cursor of the previous page
+        format: optional, 'json' (default) or 'ndjson'
     '''
-    records = db_session.query(StreamingHistory).filter(
-        StreamingHistory.master_metadata_album_album_name.ilike(f'%{album_name}%')
-    ).all()
-    if not records:
+    limit = max(1, min(request.args.get('limit', RECORD_PAGE_LIMIT, type=int), RECORD_PAGE_MAX))
+    try:
+        fields, cursor = record_args()
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    history = history_source('id', 'album_id', *play_columns(fields))
+    chunks, next_cursor = record_page(
+        history, fields, history.album_id.in_(matching_ids(Album, album_name)), limit=limit, cursor=cursor
+    )
+    if chunks is None and cursor is None:
         return jsonify({'error': f'Records with album name "{album_name}" not found'}), 404
-    return jsonify([record.to_dict() for record in records])
+    return records_response(chunks, fields, next_cursor)
+
+@db_bp.route('/search', methods=['GET'])
+def search_history():
+    '''
+    Search the artists, albums or tracks of the history by name, best matches first
+        q: text to search for, matched anywhere in the name
+        type: optional, artist (default), album or track
+        limit: optional, page size (default 20, at most 50)
+        offset: optional, number of matches to skip
+    '''
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('type', 'artist')
+    limit = max(1, min(request.args.get('limit', 20, type=int), 50))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    if not query:
+        return jsonify({'error': 'Missing search query q'}), 400
+    if kind not in SEARCH_DIMENSIONS:
+        return jsonify({'error': f'Invalid type "{kind}", expected one of {", ".join(SEARCH_DIMENSIONS)}'}), 400
+
+    total, matches = search_names(history_session, SEARCH_DIMENSIONS[kind], query, limit, offset)
+
+    # play counts of the page only, from the <kind>_id index
+    history = history_source('id', f'{kind}_id')
+    key = getattr(history, f'{kind}_id')
+    plays = dict(
+        history_session.query(key, func.count(history.id))
+        .filter(key.in_([id for id, _ in matches]))
+        .group_by(key)
+        .all()
+    )
+    return jsonify({
+        'items': [{'id': id, 'name': name, 'plays': plays.get(id, 0)} for id, name in matches],
+        'total': total,
+        'limit': limit,
+        'offset': offset,
+    })
 
 # endregion
 
 # analyze data
 # region
 
-@db_bp.route('/history/total-listening-time', methods=['GET'])
-def get_total_listening_time():
-    ''' Display the total listening time in ms/min/hour/day '''
-    total_ms = db_session.query(func.sum(StreamingHistory.ms_played)).scalar()
+# Panels of the overview: each one formats its part of the history summary (app/summaries.py),
+# served by its own endpoint and, several at once, by /history/dashboard
+
+def total_listening_time_panel(summary):
+    ''' The total listening time in ms/min/hour/day '''
+    total_ms = summary['total_ms_played']
     total_minutes = total_ms / MS_IN_MINUTE
     total_hours = total_ms / MS_IN_HOUR
     total_days = total_ms / MS_IN_DAY
     
-    return jsonify({
+    return {
         'total_listening_ms': total_ms,
         'total_listening_minutes': total_minutes,
         'total_listening_hours': total_hours,
         'total_listening_days': total_days,
-        })
+        }
 
-@db_bp.route('/history/platform-stats', methods=['GET'])
-def get_platform_stats():
-    ''' Display the total listening time and number of plays for each platform '''
-    platform_stats = db_session.query(
-        StreamingHistory.platform,
-        func.count(StreamingHistory.platform).label('play_count'),
-        func.sum(StreamingHistory.ms_played).label('total_ms_played'),
-    ).group_by(StreamingHistory.platform).all()
+def platform_stats_panel(summary):
+    ''' The total listening time and number of plays for each platform '''
+    platform_stats = summary['platforms'] # (platform, play_count, total_ms_played)
 
     grouped_stats = {
         'Linux': {'play_count': 0, 'total_ms_played': 0},
@@ -119,24 +297,106 @@ def get_platform_stats():
             grouped_stats['Other']['total_ms_played'] += platform[2]
 
     # Prepare the response in the desired format
-    return jsonify([{
+    return [{
         'platform': platform,
         'play_count': stats['play_count'],
         'total_ms_played': stats['total_ms_played']
-    } for platform, stats in grouped_stats.items()])
+    } for platform, stats in grouped_stats.items()]
+
+def skip_stats_panel(summary):
+    ''' The total number of plays and the number of skipped tracks + skip rate '''
+    total_plays, skipped_tracks = summary['total_plays'], summary['skipped_plays']
+    return {
+        'total_plays': total_plays,
+        'skipped_tracks': skipped_tracks,
+        'skip_rate': skipped_tracks / total_plays if total_plays > 0 else 0,
+        'skip_percentage': skipped_tracks / total_plays * 100 if total_plays > 0 else 0
+    }
+
+def end_reasons_panel(summary):
+    ''' The number of times each end reason occurred '''
+    return [{
+        'reason_end': reason[0],
+        'count': reason[1]
+    } for reason in summary['end_reasons']] # (reason_end, count)
+
+def unique_tracks_count_panel(summary):
+    ''' The number of unique tracks listened to '''
+    return {'unique_tracks_count': summary['unique_tracks']}
+
+def hourly_trends_panel(summary):
+    ''' Plays and listening time per hour of the day, as /history/hourly-trends '''
+    return [{'hour': hour, 'play_count': play_count, 'total_ms_played': total_ms_played}
+            for hour, play_count, total_ms_played in summary['hourly']]
+
+def weekly_trends_panel(summary):
+    ''' Plays and listening time per day of the week, as /history/weekly-trends '''
+    return [{'day_of_week': DAYS_OF_WEEK[weekday], 'play_count': play_count, 'total_ms_played': total_ms_played}
+            for weekday, play_count, total_ms_played in summary['weekly']]
+
+DASHBOARD_PANELS = {
+    'total-listening-time': total_listening_time_panel,
+    'platform-stats': platform_stats_panel,
+    'skip-stats': skip_stats_panel,
+    'end-reasons': end_reasons_panel,
+    'unique-tracks-count': unique_tracks_count_panel,
+    'hourly-trends': hourly_trends_panel,
+    'weekly-trends': weekly_trends_panel,
+}
+
+@db_bp.route('/history/dashboard', methods=['GET'])
+def get_dashboard():
+    '''
+    Get several overview panels at once, all computed from one scan of the history\n
+    args:
+        panels: comma separated, any of total-listening-time, platform-stats, skip-stats, end-reasons,
+                unique-tracks-count, hourly-trends, weekly-trends; all of them by default
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    Each panel is keyed by its name and has the same content as the endpoint of that name.
+    '''
+    panels = request.args.get('panels', type=str)
+    panels = [panel.strip() for panel in panels.split(',') if panel.strip()] if panels else list(DASHBOARD_PANELS)
+    unknown = [panel for panel in panels if panel not in DASHBOARD_PANELS]
+    if unknown:
+        return jsonify({"error": f'Invalid panels {", ".join(unknown)}, expected some of {", ".join(DASHBOARD_PANELS)}'}), 400
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    summary = history_summary(period)
+    return jsonify({panel: DASHBOARD_PANELS[panel](summary) for panel in panels})
+
+@db_bp.route('/history/total-listening-time', methods=['GET'])
+def get_total_listening_time():
+    ''' Display the total listening time in ms/min/hour/day '''
+    return jsonify(total_listening_time_panel(history_summary()))
+
+@db_bp.route('/history/platform-stats', methods=['GET'])
+def get_platform_stats():
+    ''' Display the total listening time and number of plays for each platform '''
+    return jsonify(platform_stats_panel(history_summary()))
 
 @db_bp.route('/history/most-skipped-tracks', methods=['GET'])
 def get_most_skipped_tracks():
     ''' Get the most skipped tracks '''
+    history = history_source('id', 'skipped', 'track_id')
     limit = request.args.get('limit', 10, type=int)
-    skipped_tracks = db_session.query(
-        StreamingHistory.master_metadata_track_name,
-        StreamingHistory.master_metadata_album_artist_name,
-        func.count(StreamingHistory.id).label('skip_count') # first applies the filter, then counts the number of rows by id
-    ).filter_by(skipped=True).group_by(
-        StreamingHistory.master_metadata_track_name,
-        StreamingHistory.master_metadata_album_artist_name
-    ).order_by(desc('skip_count')).limit(limit).all()
+    top_skipped = history_session.query(
+        history.track_id,
+        func.count(history.id).label('skip_count') # first applies the filter, then counts the number of rows by id
+    ).filter(history.skipped == True).group_by(
+        history.track_id
+    ).order_by(desc('skip_count')).limit(limit).subquery()
+
+    # names are joined in only for the top rows
+    skipped_tracks = history_session.query(
+        Track.name, Artist.name, top_skipped.c.skip_count
+    ).select_from(top_skipped).outerjoin(
+        Track, Track.id == top_skipped.c.track_id
+    ).outerjoin(
+        Artist, Artist.id == Track.artist_id
+    ).order_by(top_skipped.c.skip_count.desc()).all()
 
     return jsonify([{
         'track_name': track[0],
@@ -147,114 +407,173 @@ def get_most_skipped_tracks():
 @db_bp.route('/history/skip-stats', methods=['GET'])
 def get_skip_stats():
     ''' Get the total number of plays and the number of skipped tracks + skip rate '''
-    total_plays = db_session.query(func.count(StreamingHistory.id)).scalar()
-    skipped_tracks = db_session.query(func.count(StreamingHistory.id)).filter_by(skipped=True).scalar()
-    return jsonify({
-        'total_plays': total_plays,
-        'skipped_tracks': skipped_tracks,
-        'skip_rate': skipped_tracks / total_plays if total_plays > 0 else 0,
-        'skip_percentage': skipped_tracks / total_plays * 100 if total_plays > 0 else 0
-    })
+    return jsonify(skip_stats_panel(history_summary()))
 
 @db_bp.route('/history/end-reasons', methods=['GET'])
 def get_end_reasons():
     ''' Get the number of times each end reason occurred '''
-    end_reasons = db_session.query(
-        StreamingHistory.reason_end, 
-        func.count(StreamingHistory.reason_end).label('count')
-    ).group_by(StreamingHistory.reason_end).all()
-    
-    return jsonify([{
-        'reason_end': reason[0],
-        'count': reason[1]
-    } for reason in end_reasons])
+    return jsonify(end_reasons_panel(history_summary()))
 
 @db_bp.route('/history/unique-tracks-count', methods=['GET'])
 def get_unique_tracks_count():
     ''' Get the number of unique tracks listened to '''
-    unique_tracks = db_session.query(
-        func.count(distinct(StreamingHistory.spotify_track_uri)).label('unique_tracks_count')
-    ).scalar()
-    return jsonify({'unique_tracks_count': unique_tracks})
+    return jsonify(unique_tracks_count_panel(history_summary()))
+
+SESSION_SCAN_CHUNK = 10_000 # play timestamps read (and gap-checked) at a time by get_listening_sessions
+
+def session_bounds(ts_chunks, gap_ms, limit):
+    '''
+    Find the first `limit` listening sessions in time ordered play timestamps, with vectorized
+    gap detection: a session starts where the gap to the previous play exceeds gap_ms.
+    Stops reading as soon as the session after the last one is found.
+
+    Args:
+        ts_chunks: Iterable of lists of ts_ms values, ascending across chunks.
+        gap_ms (int): Largest gap within a session, in ms.
+        limit (int): Number of sessions to find.
+
+    Returns:
+        tuple: ([(first ts_ms, last ts_ms) per session], ts_ms of the next session's first play or None)
+    '''
+    starts, ends = [], []
+    previous = None
+    for chunk in ts_chunks:
+        ts = np.fromiter(chunk, dtype=np.int64, count=len(chunk))
+        is_start = np.diff(ts, prepend=ts[0] if previous is None else previous) > gap_ms
+        if previous is None:
+            is_start[0] = True
+        for index in np.flatnonzero(is_start).tolist(): # only the session starts are looped over
+            if starts:
+                ends.append(int(ts[index - 1]) if index else previous)
+            if len(starts) == limit:
+                return list(zip(starts, ends)), int(ts[index])
+            starts.append(int(ts[index]))
+        previous = int(ts[-1])
+    if starts:
+        ends.append(previous)
+    return list(zip(starts, ends)), None
 
 @db_bp.route('/history/sessions', methods=['GET'])
 def get_listening_sessions():
-    ''' Get listening sessions and their statistics '''
+    '''
+    Get listening sessions and their statistics, a page at a time, streamed\n
+    args:
+        gap: gap in minutes that separates two sessions, default - 30
+        start: first day to include (format: YYYY-MM-DD), optional
+        end: last day to include (format: YYYY-MM-DD), optional
+        year, month, date: optional, narrow the period down, see app.utils.period_utils.request_period
+        limit: sessions per page, default - 100 (at most 1000)
+        cursor: next_cursor of the previous page, to get the page after it
+        format: 'json' (default, {"sessions": [...], "next_cursor": ...}) or 'ndjson' (one session per line)
+    The cursor of the next page is also sent in the X-Next-Cursor header, it is null on the last page.
+    '''
     time_gap = request.args.get('gap', 30, type=int)  # Gap in minutes to separate sessions
     time_gap_ms = time_gap * 60000
-
-    # Query to get tracks in order of timestamps
-    sessions = db_session.query(
-        StreamingHistory.id,
-        StreamingHistory.master_metadata_track_name,
-        StreamingHistory.master_metadata_album_artist_name,
-        StreamingHistory.spotify_track_uri,
-        StreamingHistory.ms_played,  # Add ms_played for session duration
-        StreamingHistory.ts
-    ).order_by(StreamingHistory.ts).all()
-
-    result = []
-    session = []
-    previous_ts = None
-    session_start_time = None
-    total_ms_played = 0  # Track total playtime for each session
-
-    for record in sessions:
-        current_ts = record.ts
-
-        # Convert current timestamp to datetime if it's a string
-        if isinstance(current_ts, str):
-            current_ts = datetime.strptime(current_ts, '%Y-%m-%dT%H:%M:%SZ')
-
-        if previous_ts:
-            # Calculate time difference in milliseconds between consecutive tracks
-            time_diff_ms = (current_ts - previous_ts).total_seconds() * 1000
-
-            # If time difference is greater than the specified gap, end the current session
-            if time_diff_ms > time_gap_ms:
-                if session:
-                    # Append session details to the result before starting a new session
-                    result.append({
-                        'session_start': session_start_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                        'session_end': previous_ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
-                        'total_tracks': len(session),
-                        'total_ms_played': total_ms_played,
-                        'tracks': session
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    cursor = request.args.get('cursor', type=str)
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({"error": "Invalid cursor"}), 400
+
+    # Period as a ts_ms range; the cursor is the ts_ms of the first play of the page
+    start_ms, end_ms = period_ms(period)
+    first_ms = max(start_ms or 0, int(cursor) if cursor else 0)
+    period_start = datetime.fromtimestamp(first_ms / 1000, timezone.utc).strftime('%Y-%m-%d') if first_ms else None
+    period_end = period.end
+    history = history_source('ts_ms', start=period_start, end=period_end)
+    timestamps = select(history.ts_ms).where(history.ts_ms >= first_ms).order_by(history.ts_ms)
+    if end_ms:
+        timestamps = timestamps.where(history.ts_ms < end_ms)
+    # read lazily off the ts_ms index, chunk by chunk, until the page is complete
+    result = history_session.execute(timestamps)
+    sessions, next_cursor = session_bounds(result.scalars().partitions(SESSION_SCAN_CHUNK), time_gap_ms, limit)
+    result.close()
+
+    def session_records():
+        '''The sessions of the page with their tracks, reading the plays in one ordered pass.'''
+        if not sessions:
+            return
+        history = history_source('ts', 'ts_ms', 'ms_played', 'track_id', 'artist_id', start=period_start, end=period_end)
+        plays = iter(history_session.execute(
+            select(
+                Track.name.label('track_name'),
+                Artist.name.label('artist_name'),
+                Track.uri.label('track_uri'),
+                history.ms_played,
+                history.ts,
+                history.ts_ms
+            )
+            .select_from(history)
+            .outerjoin(Track, Track.id == history.track_id)
+            .outerjoin(Artist, Artist.id == history.artist_id)
+            .where(history.ts_ms >= sessions[0][0], history.ts_ms <= sessions[-1][1])
+            .order_by(history.ts_ms)
+            .execution_options(yield_per=SESSION_SCAN_CHUNK)
+        ))
+        record = next(plays, None)
+        for first, last in sessions:
+            session = []
+            total_ms_played = 0  # Track total playtime for each session
+            while record is not None and record.ts_ms <= last:
+                if record.ts_ms >= first:
+                    session.append({
+                        'track_name': record.track_name,
+                        'track_artist': record.artist_name,
+                        'track_uri': record.track_uri,
+                        'timestamp': record.ts,
+                        'ms_played': record.ms_played
                     })
-                # Reset session info for a new session
-                session = []
-                total_ms_played = 0
-
-        # If starting a new session, set the session start time
-        if not session:
-            session_start_time = current_ts
-
-        # Add the current track to the session
-        session.append({
-            'track_name': record.master_metadata_track_name,
-            'track_artist': record.master_metadata_album_artist_name,
-            'track_uri': record.spotify_track_uri,
-            'timestamp': current_ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            'ms_played': record.ms_played
-        })
-
-        # Increment total ms played for the session
-        total_ms_played += record.ms_played
-
-        # Update previous timestamp
-        previous_ts = current_ts
-
-    # Append the last session if it exists
-    if session:
-        result.append({
-            'session_start': session_start_time.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            'session_end': previous_ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
-            'total_tracks': len(session),
-            'total_ms_played': total_ms_played,
-            'tracks': session
-        })
-
-    return jsonify(result)
+                    total_ms_played += record.ms_played
+                record = next(plays, None)
+            if session:
+                yield {
+                    'session_start': session[0]['timestamp'],
+                    'session_end': session[-1]['timestamp'],
+                    'total_tracks': len(session),
+                    'total_ms_played': total_ms_played,
+                    'tracks': session
+                }
+
+    next_cursor = str(next_cursor) if next_cursor is not None else None
+    headers = {'X-Next-Cursor': next_cursor or 'null'}
+    if wants_ndjson():
+        return ndjson_response(session_records(), headers=headers)
+    return json_response(session_records(), 'sessions', headers=headers, next_cursor=next_cursor)
+
+# endregion
+
+# Declarative query
+# region
+
+@db_bp.route('/history/query', methods=['GET'])
+def get_history_query():
+    '''
+    Aggregate the history along any dimensions, compiled into one SQL statement (see app/queries.py)\n
+    args:
+        dimensions: comma separated, any of hour, weekday, day, month, year, artist, track, platform, reason_end;
+                    none for the totals
+        metrics: comma separated, any of plays, ms_played, skips, distinct_tracks, default - plays,ms_played
+        sort: metric to rank the rows by, descending (top-K with limit); by the dimensions otherwise
+        limit: number of rows, default - 1000 (at most 10000)
+        artist, track: only the plays of the artists/tracks whose name contains this
+        platform, reason_end: only the plays with this platform/end reason
+        skipped: 'true' or 'false', only the skipped/not skipped plays
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    Example: /history/query?dimensions=weekday,hour&metrics=plays&year=2021
+    '''
+    try:
+        query = parse_query(request.args, request_period())
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    return jsonify({
+        'dimensions': query['dimensions'],
+        'metrics': query['metrics'],
+        'rows': run_query(query),
+    })
 
 # endregion
 
@@ -263,12 +582,28 @@ def get_listening_sessions():
 
 @db_bp.route('/history/hourly-trends', methods=['GET'])
 def get_hourly_trends():
-    ''' Get hourly listening statistics '''
-    hourly_trends = db_session.query(
-        func.extract('hour', StreamingHistory.ts).label('hour'),
-        func.count(StreamingHistory.id).label('play_count'),
-        func.sum(StreamingHistory.ms_played).label('total_ms_played')
-    ).group_by('hour').order_by('hour').all()
+    '''
+    Get hourly listening statistics\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    '''
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if Config.ANALYTICS_BACKEND == 'columnar':
+        hourly_trends = analytics.hourly_trends(history_snapshot(), period)
+    else:
+        # play_date only for a period: without it, each year partition answers from its covering play_hour index
+        dated = ['play_date'] if period != ALL_TIME else []
+        history = history_source('id', 'play_hour', 'ms_played', *dated, start=period.start, end=period.end)
+        hourly_trends = history_session.query(
+            history.play_hour.label('hour'),
+            func.count(history.id).label('play_count'),
+            func.sum(history.ms_played).label('total_ms_played')
+        ).filter(*in_period(history.play_date, period)
+        ).group_by(history.play_hour).order_by(history.play_hour).all()
 
     return jsonify([{
         'hour': int(trend.hour),
@@ -278,33 +613,61 @@ def get_hourly_trends():
 
 @db_bp.route('/history/weekly-trends', methods=['GET'])
 def get_weekly_trends():
-    ''' Get weekly listening statistics '''
-    daily_trends = db_session.query(
-        func.strftime('%w', StreamingHistory.ts).label('day_of_week'),  # Get day of the week (0 = Sunday, ..., 6 = Saturday)
-        func.count(StreamingHistory.id).label('play_count'),
-        func.sum(StreamingHistory.ms_played).label('total_ms_played')
-    ).group_by(func.strftime('%w', StreamingHistory.ts)
-    ).order_by(func.strftime('%w', StreamingHistory.ts)
-    ).all()
-
-    days_of_week = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+    '''
+    Get weekly listening statistics\n
+    args:
+        start, end, year, month, date: optional period, see app.utils.period_utils.request_period
+    '''
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if Config.ANALYTICS_BACKEND == 'columnar':
+        daily_trends = analytics.weekly_trends(history_snapshot(), period)
+    else:
+        # play_date only for a period: without it, each year partition answers from its covering play_weekday index
+        dated = ['play_date'] if period != ALL_TIME else []
+        history = history_source('id', 'play_weekday', 'ms_played', *dated, start=period.start, end=period.end)
+        daily_trends = history_session.query(
+            history.play_weekday.label('day_of_week'),  # Day of the week (0 = Sunday, ..., 6 = Saturday)
+            func.count(history.id).label('play_count'),
+            func.sum(history.ms_played).label('total_ms_played')
+        ).filter(*in_period(history.play_date, period)
+        ).group_by(history.play_weekday
+        ).order_by(history.play_weekday
+        ).all()
 
     return jsonify([{
-        'day_of_week': days_of_week[int(trend.day_of_week)],  # Convert day number to a readable day name
+        'day_of_week': DAYS_OF_WEEK[int(trend.day_of_week)],  # Convert day number to a readable day name
         'play_count': trend.play_count,
         'total_ms_played': trend.total_ms_played
     } for trend in daily_trends])
 
 @db_bp.route('/history/daily-trends', methods=['GET'])
 def get_daily_trends():
-    ''' Get daily listening statistics '''
-    daily_trends = db_session.query(
-        func.strftime('%Y-%m-%d', StreamingHistory.ts).label('day'),  # Use strftime for SQLite date formatting
-        func.count(StreamingHistory.id).label('play_count'),
-        func.sum(StreamingHistory.ms_played).label('total_ms_played')
-    ).group_by(func.strftime('%Y-%m-%d', StreamingHistory.ts)
-    ).order_by(func.strftime('%Y-%m-%d', StreamingHistory.ts)
-    ).all()
+    '''
+    Get daily listening statistics\n
+    args:
+        start: first day to include (format: YYYY-MM-DD), optional
+        end: last day to include (format: YYYY-MM-DD), optional
+        year, month, date: optional, narrow the period down, see app.utils.period_utils.request_period
+    '''
+    try:
+        period = request_period()
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if Config.ANALYTICS_BACKEND == 'columnar':
+        daily_trends = analytics.daily_trends(history_snapshot(), period)
+    else:
+        # One row per day in the daily rollup, nothing left to group
+        daily_trends = history_session.query(
+            DailyPlays.play_date.label('day'),  # Already stored as 'YYYY-MM-DD'
+            DailyPlays.play_count,
+            DailyPlays.ms_played.label('total_ms_played')
+        ).filter(*in_period(DailyPlays.play_date, period)
+        ).order_by(DailyPlays.play_date).all()
 
     return jsonify([{
         'day': trend.day,  # The day is already formatted as a string
@@ -323,8 +686,10 @@ def get_top_tracks():
     args:
         limit: number of records to return, default - 10
         sort_by: field to sort by, either 'play_count' or default 'total_ms_played'
+        start: filter tracks played from this day on (format: YYYY-MM-DD)
+        end: filter tracks played until this day, included (format: YYYY-MM-DD)
         year: filter tracks by a specific year
-        month: filter tracks by a specific month (1-12)
+        month: filter tracks by a specific month (1-12), of the year if given, of every year otherwise
         date: filter tracks by a specific date (format: YYYY-MM-DD)
         artist: filter tracks by a specific artist name
     '''
@@ -332,59 +697,69 @@ def get_top_tracks():
     sort_by = request.args.get('sort_by', 'total_ms_played', type=str)
     year    = request.args.get('year', type=int)
     month   = request.args.get('month', type=int)
-    date    = request.args.get('date', type=str)
     artist  = request.args.get('artist', type=str)
 
-    sp = get_spotify_client()
-    
+    # year, month of a year, date and start/end are one range of days; only a month of every year is not
+    try:
+        period = request_period(month_of_every_year=True)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    month = month if month and not year else None
+
     # Sort by total listening time or play count
     sort_by = 'total_ms_played' if sort_by == 'total_ms_played' else 'play_count'
 
-    # Base query
-    query = db_session.query(
-        StreamingHistory.master_metadata_track_name,
-        StreamingHistory.master_metadata_album_artist_name,
-        func.count(StreamingHistory.master_metadata_track_name).label('play_count'),
-        func.sum(StreamingHistory.ms_played).label('total_ms_played'),
-        StreamingHistory.spotify_track_uri,
-    ).filter(
-        StreamingHistory.master_metadata_track_name.isnot(None)
-    )
-
-    # Apply filters
-    if year:
-        query = query.filter(extract('year', StreamingHistory.ts) == year)
-
-    if month:
-        query = query.filter(extract('month', StreamingHistory.ts) == month)
-
-    if date:
-        try:
-            date_obj = datetime.strptime(date, '%Y-%m-%d')
-            query = query.filter(extract('year', StreamingHistory.ts) == date_obj.year,
-                                 extract('month', StreamingHistory.ts) == date_obj.month,
-                                 extract('day', StreamingHistory.ts) == date_obj.day)
-        except ValueError:
-            return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
-
-    if artist:
-        query = query.filter(StreamingHistory.master_metadata_album_artist_name.ilike(f"%{artist}%"))
-
-    # Group, order, and limit the query
-    top_tracks = query.group_by(
-        StreamingHistory.master_metadata_track_name, 
-        StreamingHistory.master_metadata_album_artist_name
-    ).order_by(desc(sort_by)).limit(limit).all()
+    # tracks of the artist filter: by the track's artist on every backend, not the artist of each play
+    artist_tracks = select(Track.id).where(Track.artist_id.in_(name_matches(Artist, artist))) if artist else None
+
+    if Config.ANALYTICS_BACKEND == 'columnar':
+        track_ids = history_session.scalars(artist_tracks).all() if artist else None
+        top = analytics.top_tracks(history_snapshot(), sort_by, limit, period, month, track_ids)
+    elif Config.PREFIX_SUMS and not month:
+        # Summed up over the window from the prefix-sum index, one vectorized pass over the tracks
+        track_ids = history_session.scalars(artist_tracks).all() if artist else None
+        top = top_in_window(history_session, 'track', sort_by, limit, period, track_ids)
+    else:
+        # Summed up from the daily track rollup, the period is a range on its play_date
+        rollup = DailyTrackPlays
+        query = history_session.query(
+            rollup.track_id,
+            func.sum(rollup.play_count).label('play_count'),
+            func.sum(rollup.ms_played).label('total_ms_played'),
+        ).filter(*in_period(rollup.play_date, period))
+
+        # Apply filters
+        if month:
+            query = query.filter(func.substr(rollup.play_date, 6, 2) == f'{month:02d}')
+
+        if artist:
+            query = query.filter(rollup.track_id.in_(artist_tracks))
+
+        # Group, order, and limit the query
+        top = query.group_by(rollup.track_id).order_by(desc(sort_by)).limit(limit).all()
+
+    # Names of the top tracks, in the order of the ranking
+    names = {
+        track_id: (track_name, artist_name, uri) for track_id, track_name, artist_name, uri in
+        history_session.query(Track.id, Track.name, Artist.name, Track.uri)
+        .outerjoin(Artist, Artist.id == Track.artist_id)
+        .filter(Track.id.in_([row.track_id for row in top]))
+    }
+    top_tracks = []
+    for row in top:
+        track_name, artist_name, uri = names[row.track_id]
+        top_tracks.append((track_name, artist_name, row.play_count, row.total_ms_played, uri))
 
-    # Fetch album image from Spotify API and prepare the response
+    # Album images and urls from the track metadata table, only tracks not seen before are fetched from Spotify (in one batch)
+    metadata = get_track_metadata([track[4] for track in top_tracks], get_spotify_client)
     return jsonify([{
         'index': index,
         'track_name': track[0],
         'artist': track[1],
         'play_count': track[2],
         'total_ms_played': track[3],
-        'album_image_url': sp.track(track_id=track[4].replace("spotify:track:", ""))['album']['images'][0]['url'],
-        'spotify_url': sp.track(track_id=track[4].replace("spotify:track:", ""))['album']['external_urls']['spotify']
+        'album_image_url': metadata[track[4]]['album_image_url'],
+        'spotify_url': metadata[track[4]]['spotify_url']
     } for index, track in enumerate(top_tracks)])
 
 
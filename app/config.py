@@ -9,7 +9,28 @@ class Config:
     SPOTIPY_CLIENT_ID = os.getenv('SPOTIPY_CLIENT_ID')
     SPOTIPY_CLIENT_SECRET = os.getenv('SPOTIPY_CLIENT_SECRET')
     SPOTIPY_REDIRECT_URI = os.getenv('SPOTIPY_REDIRECT_URI')
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///app/data/streaming_history.db'
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', 'sqlite:///app/data/streaming_history.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     CACHE_DEFAULT_TIMEOUT = 1200  # 20 minutes
     str_datetime_format = '%Y-%m-%dT%H:%M:%S.%fZ'
+    INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', 5000))  # rows per executemany batch on import
+    INGEST_STREAM_JSON = os.getenv('INGEST_STREAM_JSON', 'true').lower() == 'true'  # parse export files incrementally instead of json.load
+    INGEST_READ_BUFFER = 64 * 1024  # characters read at a time by the incremental parser
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 1))  # parse processes for multi-file imports, 1 = serial, 0 = one per core
+    INGEST_QUEUE_SIZE = 4  # parsed chunks a worker may get ahead of the database writer, per file
+    IMPORT_UPLOAD_DIR = os.getenv('IMPORT_UPLOAD_DIR', 'app/data/uploads')  # uploaded export ZIPs are spooled here until imported
+    IMPORT_JOBS_KEPT = 100  # finished import jobs whose status can still be polled
+    HISTORY_PARTITIONED = os.getenv('HISTORY_PARTITIONED', 'false').lower() == 'true'  # store plays in one table per year, see app/partitions.py
+    ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'sql')  # 'sql', or 'columnar' to answer the trend endpoints from the Arrow snapshot (app/snapshots.py)
+    PREFIX_SUMS = os.getenv('PREFIX_SUMS', 'true').lower() == 'true'  # top tracks/artists of a window from the prefix-sum index (app/prefix_sums.py), with the 'sql' backend
+    USER_DATA_DIRS = os.getenv('USER_DATA_DIR', 'app/data').split(os.pathsep)  # per-user databases (<dir>/<spotify_user_id>/listening_history.db), several dirs separated by os.pathsep
+    USER_DB_MAX_OPEN = int(os.getenv('USER_DB_MAX_OPEN', 64))  # user engines kept open, the least recently used one is disposed beyond that
+    USER_DB_POOL_SIZE = 2  # connections kept open per user engine
+    USER_DB_MAX_OVERFLOW = 4  # extra connections per user engine under load, closed when returned
+    USER_DB_PRAGMAS = {  # applied to every connection of a user database
+        'journal_mode': 'WAL',  # readers don't block the writer (and vice versa)
+        'synchronous': 'NORMAL',  # safe with WAL, fsync only at checkpoints
+        'busy_timeout': 5000,  # ms to wait for a lock instead of failing right away
+        'cache_size': -8192,  # 8 MiB page cache per connection
+        'temp_store': 'MEMORY',
+    }
@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.orm import scoped_session, sessionmaker, declarative_base
+from collections import OrderedDict
 import os
+import logging
+import threading
+import zlib
 
 from app.config import Config
 
@@ -12,9 +16,16 @@ Base = declarative_base()
 Base.query = db_session.query_property()
 
 
-def init_db():
+def init_db(bind=None):
     import app.models
-    Base.metadata.create_all(bind=engine)
+    from app.migrations import migrate_db
+    bind = bind or engine
+    fresh = not inspect(bind).has_table('streaming_history')
+    Base.metadata.create_all(bind=bind)
+    migrate_db(bind, fresh)
+    if Config.HISTORY_PARTITIONED:
+        from app.partitions import partition_history
+        partition_history(bind)
     
     # manually drop table User
     # app.models.User.__table__.drop(bind=engine) 
@@ -25,14 +36,106 @@ def init_db():
     #     first_entry.custom_id = 'dionisiy'
     #     db_session.commit()
     
-# Initialize user-specific DBs
+### Per-user databases ###
+# region
+
+# One engine and session registry per user database, least recently used first. Opening an engine
+# costs a schema check and fresh connections, so they are kept warm and only the least recently
+# used one is disposed once more than Config.USER_DB_MAX_OPEN are open (each holds file descriptors).
+_user_dbs = OrderedDict()
+_user_dbs_lock = threading.Lock()
+# Held while a user database is opened (schema check, migrations), one per user: a slow open
+# holds up the requests of that user only, and the database is opened once
+_opening_locks = {}
+
+
+def _set_user_db_pragmas(dbapi_connection, connection_record):
+    '''Pragmas for every new connection to a user database (WAL: readers don't block the importing writer).'''
+    cursor = dbapi_connection.cursor()
+    for name, value in Config.USER_DB_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+def user_db_path(spotify_user_id):
+    '''
+    Path of a user's history database, `<data dir>/<spotify_user_id>/listening_history.db`.
+    With several Config.USER_DATA_DIRS (other disks or mounts) new users are spread over them
+    by a stable hash of their id; an existing database is used wherever it is.
+    '''
+    paths = [os.path.join(root, spotify_user_id, "listening_history.db") for root in Config.USER_DATA_DIRS]
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return paths[zlib.crc32(spotify_user_id.encode()) % len(paths)]
+
+def _open_user_db(spotify_user_id):
+    '''Create the engine and session registry of a user database, creating the database if needed.'''
+    path = user_db_path(spotify_user_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    user_engine = create_engine(
+        f"sqlite:///{path}",
+        pool_size=Config.USER_DB_POOL_SIZE,
+        max_overflow=Config.USER_DB_MAX_OVERFLOW,
+    )
+    event.listen(user_engine, 'connect', _set_user_db_pragmas)
+    init_db(user_engine)
+    return user_engine, scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=user_engine))
+
+def _close_user_db(spotify_user_id, user_engine, user_db_session):
+    '''Dispose an evicted engine. Connections still checked out are closed when they are returned.'''
+    user_db_session.remove()
+    user_engine.dispose()
+    logging.info(f'Closed the database of {spotify_user_id}')
+
+def get_user_engine(spotify_user_id):
+    '''Return the cached engine of a user database, opening it (and evicting the LRU one) if needed.'''
+    return _get_user_db(spotify_user_id)[0]
+
 def get_user_db(spotify_user_id):
-    # Generate user-specific folder and database path
-    user_folder = os.path.join("data", spotify_user_id)
-    os.makedirs(user_folder, exist_ok=True)
-    user_db_path = os.path.join(user_folder, "listening_history.db")
-    
-    # Create engine and session for the specific user
-    user_engine = create_engine(f"sqlite:///{user_db_path}")
-    user_db_session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=user_engine))
-    return user_db_session
\ No newline at end of file
+    '''Return the cached scoped session of a user database, opening it (and evicting the LRU one) if needed.'''
+    return _get_user_db(spotify_user_id)[1]
+
+def _cached_user_db(spotify_user_id):
+    '''The open entry of a user database, marked as the most recently used, None if it isn't open. Needs _user_dbs_lock.'''
+    entry = _user_dbs.get(spotify_user_id)
+    if entry:
+        _user_dbs.move_to_end(spotify_user_id)
+    return entry
+
+def _get_user_db(spotify_user_id):
+    with _user_dbs_lock:
+        entry = _cached_user_db(spotify_user_id)
+        if entry:
+            return entry
+        opening = _opening_locks.setdefault(spotify_user_id, threading.Lock())
+
+    evicted = []
+    with opening: # the registry itself stays free while the database is opened
+        with _user_dbs_lock:
+            entry = _cached_user_db(spotify_user_id) # opened by another request in the meantime
+        if entry:
+            return entry
+        try:
+            entry = _open_user_db(spotify_user_id)
+        except BaseException:
+            with _user_dbs_lock:
+                _opening_locks.pop(spotify_user_id, None)
+            raise
+        with _user_dbs_lock: # cached before the lock is dropped, so nobody opens it a second time
+            _user_dbs[spotify_user_id] = entry
+            _opening_locks.pop(spotify_user_id, None)
+            while len(_user_dbs) > Config.USER_DB_MAX_OPEN:
+                evicted.append(_user_dbs.popitem(last=False))
+    for evicted_id, (user_engine, user_db_session) in evicted:
+        _close_user_db(evicted_id, user_engine, user_db_session)
+    return entry
+
+def close_user_dbs():
+    '''Dispose every cached user engine, e.g. on shutdown.'''
+    with _user_dbs_lock:
+        entries = list(_user_dbs.items())
+        _user_dbs.clear()
+    for spotify_user_id, (user_engine, user_db_session) in entries:
+        _close_user_db(spotify_user_id, user_engine, user_db_session)
+
+# endregion
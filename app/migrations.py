@@ -0,0 +1,191 @@
+'''
+Schema migrations for databases created by an older version of the app.
+
+create_all only creates missing tables, so changes to existing tables live here.
+The number of applied steps is kept in SQLite's `PRAGMA user_version`; a brand new
+database already has the current schema and is stamped with the latest version.
+'''
+import logging
+
+from sqlalchemy import text
+
+from app.models import StreamingHistory, Artist, Album, Track, HISTORY_INDEXES, name_search_ddl
+from app.partitions import partition_table, partition_years
+from app.rollups import update_rollups
+
+
+# Columns of the export that plays kept next to their dimension ids until _drop_dimension_names
+DIMENSION_NAME_COLUMNS = ('master_metadata_track_name', 'master_metadata_album_artist_name',
+                          'master_metadata_album_album_name', 'spotify_track_uri')
+
+
+def _create_indexes(connection, table, *names):
+    '''Create the named indexes of a model table. Named explicitly so an old migration never builds a newer index.'''
+    # looked up in sqlite_master: reflecting the table's indexes warns about the expression based ones
+    existing = set(connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'").scalars())
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(connection)
+
+def _dedupe_streaming_history(connection):
+    '''Drop plays stored more than once (double imports) and add the natural key index.'''
+    removed = connection.execute(text('''
+        DELETE FROM streaming_history WHERE id NOT IN (
+            SELECT min(id) FROM streaming_history
+            GROUP BY ts, coalesce(spotify_track_uri, spotify_episode_uri, ''), ms_played
+        )
+    ''')).rowcount
+    logging.info(f'Removed {removed} duplicated plays from streaming_history.')
+    # the key as it was then, on the track uri; _drop_dimension_names moves it to the track id
+    connection.exec_driver_sql('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_streaming_history_play
+        ON streaming_history (ts, coalesce(spotify_track_uri, spotify_episode_uri, ''), ms_played)
+    ''')
+
+def _add_time_columns(connection):
+    '''Add the epoch/date/hour/... columns derived from ts and fill them for the stored plays.'''
+    for column, column_type in [('ts_ms', 'BIGINT'), ('play_date', 'VARCHAR(10)'), ('play_year', 'INTEGER'),
+                                ('play_month', 'INTEGER'), ('play_hour', 'INTEGER'), ('play_weekday', 'INTEGER')]:
+        connection.exec_driver_sql(f'ALTER TABLE streaming_history ADD COLUMN {column} {column_type}')
+    connection.exec_driver_sql('''
+        UPDATE streaming_history SET
+            ts_ms = CAST(strftime('%s', ts) AS INTEGER) * 1000,
+            play_date = date(ts),
+            play_year = CAST(strftime('%Y', ts) AS INTEGER),
+            play_month = CAST(strftime('%m', ts) AS INTEGER),
+            play_hour = CAST(strftime('%H', ts) AS INTEGER),
+            play_weekday = CAST(strftime('%w', ts) AS INTEGER)
+    ''')
+    # the play_date ones are part of the query index set, see _add_query_indexes
+    _create_indexes(connection, StreamingHistory.__table__, 'ix_streaming_history_ts_ms')
+
+def _add_dimension_keys(connection):
+    '''
+    Fill the artists/albums/tracks tables from the stored plays and point every play at its rows.
+    The ids are indexed by the query index set, see _add_query_indexes.
+    '''
+    for column in ('artist_id', 'album_id', 'track_id'):
+        connection.exec_driver_sql(f'ALTER TABLE streaming_history ADD COLUMN {column} INTEGER')
+    connection.exec_driver_sql('''
+        INSERT OR IGNORE INTO artists (name)
+        SELECT DISTINCT master_metadata_album_artist_name FROM streaming_history
+        WHERE master_metadata_album_artist_name IS NOT NULL
+    ''')
+    connection.exec_driver_sql('''
+        UPDATE streaming_history SET artist_id = (
+            SELECT id FROM artists WHERE name = streaming_history.master_metadata_album_artist_name
+        )
+    ''')
+    connection.exec_driver_sql('''
+        INSERT OR IGNORE INTO albums (artist_id, name)
+        SELECT DISTINCT artist_id, master_metadata_album_album_name FROM streaming_history
+        WHERE artist_id IS NOT NULL AND master_metadata_album_album_name IS NOT NULL
+    ''')
+    connection.exec_driver_sql('''
+        UPDATE streaming_history SET album_id = (
+            SELECT id FROM albums
+            WHERE artist_id = streaming_history.artist_id AND name = streaming_history.master_metadata_album_album_name
+        )
+    ''')
+    connection.exec_driver_sql('''
+        INSERT OR IGNORE INTO tracks (uri, name, artist_id, album_id)
+        SELECT spotify_track_uri, master_metadata_track_name, artist_id, album_id FROM streaming_history
+        WHERE spotify_track_uri IS NOT NULL ORDER BY id
+    ''')
+    connection.exec_driver_sql('''
+        UPDATE streaming_history SET track_id = (SELECT id FROM tracks WHERE uri = streaming_history.spotify_track_uri)
+    ''')
+
+def _add_query_indexes(connection):
+    '''Replace the single column indexes with the composite/covering set the endpoints are planned on.'''
+    # single column indexes the two steps before used to create, still in databases they migrated
+    for name in ('ix_streaming_history_play_date', 'ix_streaming_history_artist_id', 'ix_streaming_history_track_id'):
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}') # prefixes of the new composite indexes
+    _create_indexes(connection, StreamingHistory.__table__, *[index.name for index in HISTORY_INDEXES])
+    connection.exec_driver_sql('ANALYZE')
+
+def _add_name_search(connection):
+    '''Create the trigram search index of the artist/album/track names and index the stored ones.'''
+    for dimension in (Artist, Album, Track):
+        table_name = dimension.__tablename__
+        for statement in name_search_ddl(table_name):
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(f"INSERT INTO {table_name}_fts ({table_name}_fts) VALUES ('rebuild')")
+
+def _fill_daily_rollups(connection):
+    '''Count the stored plays into the (new, empty) daily rollup tables.'''
+    update_rollups(connection)
+
+def _drop_platform_indexes(connection):
+    '''
+    Drop the platform and end reason indexes, partitions included: no query uses them since the history
+    summary, which reads the overview index of _add_overview_index. This step used to create the summary
+    index the overview index replaced.
+    '''
+    tables = [StreamingHistory.__table__] + [partition_table(year) for year in partition_years(connection)]
+    for table in tables:
+        for name in ('platform', 'reason_end'):
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS ix_{table.name}_{name}')
+
+def _add_overview_index(connection):
+    '''
+    Create the overview index, which covers the history summary and the hourly/weekly breakdowns of the
+    dashboard, in place of the summary index databases migrated before may still have.
+    '''
+    tables = [StreamingHistory.__table__] + [partition_table(year) for year in partition_years(connection)]
+    for table in tables:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS ix_{table.name}_summary')
+        _create_indexes(connection, table, f'ix_{table.name}_overview')
+    connection.exec_driver_sql('ANALYZE')
+
+def _drop_dimension_names(connection):
+    '''
+    Drop the artist/album/track names and the track uri from the plays, partitions included: the
+    dimension tables hold them and the plays their ids. The natural key moves to the track id.
+    '''
+    tables = [StreamingHistory.__table__] + [partition_table(year) for year in partition_years(connection)]
+    for table in tables:
+        connection.exec_driver_sql(f'DROP INDEX IF EXISTS uq_{table.name}_play')
+        for column in DIMENSION_NAME_COLUMNS:
+            connection.exec_driver_sql(f'ALTER TABLE {table.name} DROP COLUMN {column}')
+        _create_indexes(connection, table, f'uq_{table.name}_play_key')
+
+
+# Applied in order, each one runs in its own transaction. Only ever append to this list.
+MIGRATIONS = [
+    _dedupe_streaming_history,
+    _add_time_columns,
+    _add_dimension_keys,
+    _add_query_indexes,
+    _add_name_search,
+    _fill_daily_rollups,
+    _drop_platform_indexes,
+    _add_overview_index,
+    _drop_dimension_names,
+]
+# Migrations that free a good part of the file, which is given back to the file system by a VACUUM after them
+VACUUM_AFTER = {_drop_dimension_names}
+
+def migrate_db(bind, fresh=False):
+    '''
+    Apply the migrations a database hasn't seen yet.
+
+    Args:
+        bind: Engine of the database to migrate.
+        fresh (bool): True if the schema was just created by create_all, nothing to migrate then.
+    '''
+    with bind.connect() as connection:
+        version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+        connection.commit()
+        if fresh:
+            with connection.begin():
+                connection.exec_driver_sql(f'PRAGMA user_version = {len(MIGRATIONS)}')
+            return
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            logging.info(f'Applying migration {number}: {migration.__name__}')
+            with connection.begin():
+                migration(connection)
+                connection.exec_driver_sql(f'PRAGMA user_version = {number}')
+        if VACUUM_AFTER.intersection(MIGRATIONS[version:]):
+            connection.exec_driver_sql('VACUUM') # outside of any transaction
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Boolean, Integer, String
+from sqlalchemy import Column, BigInteger, Boolean, DateTime, Integer, String, ForeignKey, Index, UniqueConstraint, event, func
+from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 import pytz
 
@@ -17,22 +18,90 @@ class User(Base):
     def __repr__(self) -> str:
         return f'<User {self.spotify_user_id} - {self.display_name}>'
 
+# Dimension tables: every distinct artist/album/track is stored once and plays refer to it by integer id,
+# so aggregations group by small integers and names are joined back only for the rows returned.
+class Artist(Base):
+    __tablename__ = 'artists'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False, unique=True)
+
+    def __repr__(self) -> str:
+        return f'<Artist {self.id} - {self.name}>'
+
+class Album(Base):
+    __tablename__ = 'albums'
+    __table_args__ = (UniqueConstraint('artist_id', 'name'),)
+
+    id = Column(Integer, primary_key=True)
+    artist_id = Column(Integer, ForeignKey('artists.id'), nullable=False)
+    name = Column(String(255), nullable=False)
+
+    def __repr__(self) -> str:
+        return f'<Album {self.id} - {self.name}>'
+
+class Track(Base):
+    __tablename__ = 'tracks'
+
+    id = Column(Integer, primary_key=True)
+    uri = Column(String(255), nullable=False, unique=True)
+    name = Column(String(255), nullable=True)
+    artist_id = Column(Integer, ForeignKey('artists.id'), nullable=True)
+    album_id = Column(Integer, ForeignKey('albums.id'), nullable=True)
+
+    def __repr__(self) -> str:
+        return f'<Track {self.id} - {self.name} ({self.uri})>'
+
+# Trigram full-text index over the name of every dimension table, <table>_fts. It is an external content
+# FTS5 table (the names are only stored in the dimension table) kept in sync by triggers, so rows
+# added at ingest, with INSERT OR IGNORE or by the ORM, are searchable right away. See app.search.
+def name_search_ddl(table_name):
+    '''Statements creating the FTS5 index over <table_name>.name and the triggers maintaining it.'''
+    fts = f'{table_name}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(name, content='{table_name}', content_rowid='id', tokenize='trigram')",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table_name} BEGIN
+            INSERT INTO {fts} (rowid, name) VALUES (new.id, new.name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table_name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, name) VALUES ('delete', old.id, old.name);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF name ON {table_name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO {fts} (rowid, name) VALUES (new.id, new.name);
+        END""",
+    ]
+
+def _create_name_search(table, connection, **kw):
+    for statement in name_search_ddl(table.name):
+        connection.exec_driver_sql(statement)
+
+for _dimension in (Artist, Album, Track):
+    event.listen(_dimension.__table__, 'after_create', _create_name_search)
+
 class StreamingHistory(Base):
     __tablename__ = 'streaming_history'
-    # TODO: timestamp should be a datetime object
     
     id = Column(Integer, primary_key=True)
-    ts = Column(String(50), nullable=False)
+    ts = Column(String(50), nullable=False) # as exported, e.g. '2021-03-04T12:34:56Z' (UTC)
+    # ts parsed once at import, so queries group and filter on plain indexed columns instead of calling strftime per row
+    ts_ms = Column(BigInteger, index=True) # epoch milliseconds
+    play_date = Column(String(10)) # 'YYYY-MM-DD'
+    play_year = Column(Integer)
+    play_month = Column(Integer) # 1-12
+    play_hour = Column(Integer) # 0-23
+    play_weekday = Column(Integer) # 0 = Sunday ... 6 = Saturday, same as strftime('%w')
+    # keys into the dimension tables, resolved at import (NULL for podcasts and plays without metadata).
+    # The artist, album and track names and the track uri of the export are only stored there.
+    artist_id = Column(Integer, ForeignKey('artists.id'))
+    album_id = Column(Integer, ForeignKey('albums.id'))
+    track_id = Column(Integer, ForeignKey('tracks.id'))
     username = Column(String(255), nullable=False)
     platform = Column(String(50), nullable=True)
     ms_played = Column(Integer, nullable=False)
     conn_country = Column(String(5), nullable=True)
     ip_addr_decrypted = Column(String(50), nullable=True)
     user_agent_decrypted = Column(String(255), nullable=True)
-    master_metadata_track_name = Column(String(255), nullable=True)
-    master_metadata_album_artist_name = Column(String(255), nullable=True)
-    master_metadata_album_album_name = Column(String(255), nullable=True)
-    spotify_track_uri = Column(String(255), nullable=True)
     episode_name = Column(String(255), nullable=True)
     episode_show_name = Column(String(255), nullable=True)
     spotify_episode_uri = Column(String(255), nullable=True)
@@ -43,32 +112,138 @@ class StreamingHistory(Base):
     offline = Column(Boolean, nullable=False, default=False)
     offline_timestamp = Column(Integer, nullable=True)
     incognito_mode = Column(Boolean, nullable=False, default=False)
+
+    artist = relationship(Artist)
+    album = relationship(Album)
+    track = relationship(Track)
     
+    # Fields of a play record in the API, in order. The record endpoints select just the ones asked for with ?fields=
+    RECORD_FIELDS = (
+        'id', 'ts', 'username', 'platform', 'ms_played', 'conn_country', 'ip_addr_decrypted', 'user_agent_decrypted',
+        'master_metadata_track_name', 'master_metadata_album_artist_name', 'master_metadata_album_album_name',
+        'spotify_track_uri', 'episode_name', 'episode_show_name', 'spotify_episode_uri',
+        'reason_start', 'reason_end', 'shuffle', 'skipped', 'offline', 'offline_timestamp', 'incognito_mode',
+    )
+    # Record fields stored in the dimension tables: (dimension, its column, key of the play)
+    DIMENSION_FIELDS = {
+        'master_metadata_track_name': (Track, 'name', 'track_id'),
+        'master_metadata_album_artist_name': (Artist, 'name', 'artist_id'),
+        'master_metadata_album_album_name': (Album, 'name', 'album_id'),
+        'spotify_track_uri': (Track, 'uri', 'track_id'),
+    }
+
     def to_dict(self) -> dict:
-        return {
-            'id': self.id,
-            'ts': self.ts,
-            'username': self.username,
-            'platform': self.platform,
-            'ms_played': self.ms_played,
-            'conn_country': self.conn_country,
-            'ip_addr_decrypted': self.ip_addr_decrypted,
-            'user_agent_decrypted': self.user_agent_decrypted,
-            'master_metadata_track_name': self.master_metadata_track_name,
-            'master_metadata_album_artist_name': self.master_metadata_album_artist_name,
-            'master_metadata_album_album_name': self.master_metadata_album_album_name,
-            'spotify_track_uri': self.spotify_track_uri,
-            'episode_name': self.episode_name,
-            'episode_show_name': self.episode_show_name,
-            'spotify_episode_uri': self.spotify_episode_uri,
-            'reason_start': self.reason_start,
-            'reason_end': self.reason_end,
-            'shuffle': self.shuffle,
-            'skipped': self.skipped,
-            'offline': self.offline,
-            'offline_timestamp': self.offline_timestamp,
-            'incognito_mode': self.incognito_mode
+        names = {
+            'master_metadata_track_name': self.track.name if self.track else None,
+            'master_metadata_album_artist_name': self.artist.name if self.artist else None,
+            'master_metadata_album_album_name': self.album.name if self.album else None,
+            'spotify_track_uri': self.track.uri if self.track else None,
         }
-    
+        return {field: names[field] if field in names else getattr(self, field) for field in self.RECORD_FIELDS}
+
+    def __repr__(self) -> str:
+        return f"<StreamingHistory(ts={self.ts}, username={self.username}, platform={self.platform}, ms_played={self.ms_played}, conn_country={self.conn_country}, ip_addr_decrypted={self.ip_addr_decrypted}, user_agent_decrypted={self.user_agent_decrypted}, artist_id={self.artist_id}, album_id={self.album_id}, track_id={self.track_id}, episode_name={self.episode_name}, episode_show_name={self.episode_show_name}, spotify_episode_uri={self.spotify_episode_uri}, reason_start={self.reason_start}, reason_end={self.reason_end}, shuffle={self.shuffle}, skipped={self.skipped}, offline={self.offline}, offline_timestamp={self.offline_timestamp}, incognito_mode={self.incognito_mode})>"
+
+# Natural key of a play. Re-importing an export inserts with ON CONFLICT DO NOTHING, so only plays that aren't stored yet are added.
+# Track id and episode uri are folded into one expression because NULLs never collide in a unique index.
+Index(
+    'uq_streaming_history_play_key',
+    StreamingHistory.ts,
+    func.coalesce(StreamingHistory.track_id, StreamingHistory.spotify_episode_uri, ''),
+    StreamingHistory.ms_played,
+    unique=True,
+)
+
+# Secondary indexes, one per access path of the /db endpoints. Columns after the filter/group-by key
+# make the index covering, so those aggregations never read the (wide) table rows.
+# tests/test_query_plans.py fails if an endpoint query falls back to a table scan.
+HISTORY_INDEXES = [
+    Index('ix_streaming_history_track_day', StreamingHistory.track_id, StreamingHistory.play_date, StreamingHistory.ms_played),
+    Index('ix_streaming_history_artist_day', StreamingHistory.artist_id, StreamingHistory.play_date, StreamingHistory.ms_played),
+    Index('ix_streaming_history_album', StreamingHistory.album_id),
+    Index('ix_streaming_history_day', StreamingHistory.play_date, StreamingHistory.ms_played),
+    Index('ix_streaming_history_year_month', StreamingHistory.play_year, StreamingHistory.play_month, StreamingHistory.track_id, StreamingHistory.ms_played),
+    Index('ix_streaming_history_hour', StreamingHistory.play_hour, StreamingHistory.ms_played),
+    Index('ix_streaming_history_weekday', StreamingHistory.play_weekday, StreamingHistory.ms_played),
+    Index('ix_streaming_history_skipped', StreamingHistory.skipped, StreamingHistory.track_id),
+    # the whole-history summary and dashboard (app/summaries.py): platform, end reason, hour and weekday
+    # breakdowns, skips and totals, all from one scan of this index
+    Index(
+        'ix_streaming_history_overview',
+        StreamingHistory.platform, StreamingHistory.reason_end, StreamingHistory.play_hour, StreamingHistory.play_weekday,
+        StreamingHistory.skipped, StreamingHistory.ms_played,
+    ),
+]
+
+# Daily rollups of the history, maintained incrementally at import (app/rollups.py). Timelines, trends
+# and top-N rankings read these, so their cost grows with days x entities instead of with plays.
+class DailyPlays(Base):
+    '''Plays and listening time per day.'''
+    __tablename__ = 'daily_plays'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    play_date = Column(String(10), primary_key=True)
+    play_count = Column(Integer, nullable=False)
+    ms_played = Column(BigInteger, nullable=False)
+
+class DailyTrackPlays(Base):
+    '''Plays and listening time per track and day, plays without a track (episodes) aren't counted.'''
+    __tablename__ = 'daily_track_plays'
+    __table_args__ = (
+        Index('ix_daily_track_plays_day', 'play_date', 'track_id', 'play_count', 'ms_played'),
+        {'sqlite_with_rowid': False},
+    )
+
+    track_id = Column(Integer, ForeignKey('tracks.id'), primary_key=True)
+    play_date = Column(String(10), primary_key=True)
+    play_count = Column(Integer, nullable=False)
+    ms_played = Column(BigInteger, nullable=False)
+
+class DailyArtistPlays(Base):
+    '''Plays and listening time per artist and day, plays without an artist (episodes) aren't counted.'''
+    __tablename__ = 'daily_artist_plays'
+    __table_args__ = {'sqlite_with_rowid': False}
+
+    artist_id = Column(Integer, ForeignKey('artists.id'), primary_key=True)
+    play_date = Column(String(10), primary_key=True)
+    play_count = Column(Integer, nullable=False)
+    ms_played = Column(BigInteger, nullable=False)
+
+class RollupState(Base):
+    '''Single row: id of the last play counted into the daily rollups.'''
+    __tablename__ = 'rollup_state'
+
+    id = Column(Integer, primary_key=True)
+    last_history_id = Column(Integer, nullable=False, default=0)
+
+class DataGeneration(Base):
+    '''Single row: counter bumped by every import, cached summaries of the history are keyed by it.'''
+    __tablename__ = 'data_generation'
+
+    id = Column(Integer, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+class TrackMetadata(Base):
+    '''Spotify metadata of a track, fetched once with the batch tracks endpoint and kept (see spotify_utils.get_track_metadata).'''
+    __tablename__ = 'track_metadata'
+
+    uri = Column(String(255), primary_key=True)
+    album_image_url = Column(String(255), nullable=True) # None for a track Spotify doesn't know (any more)
+    spotify_url = Column(String(255), nullable=True)
+    fetched_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+class ImportedFile(Base):
+    '''Manifest of imported export files, unchanged files are skipped on the next import.'''
+    __tablename__ = 'imported_file'
+    __table_args__ = (UniqueConstraint('file_name', 'size', 'sha256'),)
+
+    id = Column(Integer, primary_key=True)
+    file_name = Column(String(255), nullable=False)
+    size = Column(Integer, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    rows_read = Column(Integer, nullable=False)
+    rows_inserted = Column(Integer, nullable=False)
+    imported_at = Column(DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
     def __repr__(self) -> str:
-        return f"<StreamingHistory(ts={self.ts}, username={self.username}, platform={self.platform}, ms_played={self.ms_played}, conn_country={self.conn_country}, ip_addr_decrypted={self.ip_addr_decrypted}, user_agent_decrypted={self.user_agent_decrypted}, master_metadata_track_name={self.master_metadata_track_name}, master_metadata_album_artist_name={self.master_metadata_album_artist_name}, master_metadata_album_album_name={self.master_metadata_album_album_name}, spotify_track_uri={self.spotify_track_uri}, episode_name={self.episode_name}, episode_show_name={self.episode_show_name}, spotify_episode_uri={self.spotify_episode_uri}, reason_start={self.reason_start}, reason_end={self.reason_end}, shuffle={self.shuffle}, skipped={self.skipped}, offline={self.offline}, offline_timestamp={self.offline_timestamp}, incognito_mode={self.incognito_mode})>"
\ No newline at end of file
+        return f'<ImportedFile {self.file_name} ({self.size} bytes) - {self.rows_inserted}/{self.rows_read} rows>'
@@ -0,0 +1,122 @@
+'''
+Year partitioned storage of the streaming history, enabled with Config.HISTORY_PARTITIONED.
+
+Plays are stored in one table per year, streaming_history_<year>, with the columns and
+indexes of streaming_history. Queries get their table from history_source, which only
+touches the partitions of the requested period:
+    - one year         -> that partition alone, nothing else is read
+    - a date range     -> UNION ALL over the partitions the range overlaps
+    - no period        -> UNION ALL over every partition
+With the mode off history_source is just StreamingHistory, so the endpoints are written once.
+In partitioned mode streaming_history itself only keeps plays without a year.
+'''
+import re
+import logging
+
+from sqlalchemy import MetaData, select, union_all
+from sqlalchemy.orm import aliased
+
+from app.config import Config
+from app.models import StreamingHistory, Artist, Album, Track
+from app.shards import history_session
+
+PARTITION_NAME = re.compile(r'^streaming_history_(\d{4})$')
+
+# Partition tables live in their own metadata so create_all never sees them.
+# The dimension tables are copied in so the foreign keys of the copies resolve.
+_metadata = MetaData()
+for _dimension in (Artist, Album, Track):
+    _dimension.__table__.to_metadata(_metadata)
+_partitions = {}
+
+
+def partition_table(year):
+    '''
+    Table of one year of plays, a copy of streaming_history. Index names are prefixed
+    with the table name, SQLite keeps them in one namespace per database.
+    '''
+    year = int(year)
+    if year not in _partitions:
+        name = f'streaming_history_{year}'
+        table = StreamingHistory.__table__.to_metadata(_metadata, name=name)
+        for index in table.indexes:
+            if not index.name.startswith(('ix_' + name, 'uq_' + name)): # column indexes are named after the copy already
+                index.name = index.name.replace('streaming_history', name, 1)
+        _partitions[year] = table
+    return _partitions[year]
+
+def partition_years(connection):
+    '''Years that have a partition in the database, ascending.'''
+    names = connection.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'streaming_history_%'"
+    ).scalars()
+    return sorted(int(match.group(1)) for name in names if (match := PARTITION_NAME.match(name)))
+
+def history_source(*columns, year=None, start=None, end=None, session=None):
+    '''
+    The streaming history to query for a period, see the module docstring.
+    Use it in place of StreamingHistory: `history = history_source('track_id', 'ms_played', year=2021)`,
+    then `history.ms_played` etc. The period only picks partitions, the query still needs its own
+    filter on play_year/play_date.
+
+    SQLite reads every column of a UNION ALL subquery, even the ones the outer query never uses,
+    so a union over whole partitions reads whole rows. Listing the columns a query needs keeps
+    the union narrow and lets each partition answer from a covering index.
+
+    Args:
+        *columns (str): Columns the query uses, all of them if none are given.
+        year (int): Only this year is queried.
+        start (str): First day of the period, 'YYYY-MM-DD' (or just the year).
+        end (str): Last day of the period, 'YYYY-MM-DD' (or just the year).
+        session: Session the query will run in, defaults to the request's history_session.
+
+    Returns:
+        StreamingHistory, or an alias of it over the partitions.
+    '''
+    if not Config.HISTORY_PARTITIONED:
+        return StreamingHistory
+
+    first = year or (int(str(start)[:4]) if start else None)
+    last = year or (int(str(end)[:4]) if end else None)
+    years = partition_years((session or history_session).connection())
+    tables = [partition_table(y) for y in years if (first is None or y >= first) and (last is None or y <= last)]
+    if first is None and last is None:
+        tables.insert(0, StreamingHistory.__table__) # plays without a year
+    if not tables: # nothing stored in the period, the (empty) base table answers it
+        tables = [StreamingHistory.__table__]
+
+    if len(tables) == 1:
+        return aliased(StreamingHistory, tables[0], adapt_on_names=True)
+    columns = dict.fromkeys(columns) # each column once, however often it was asked for
+    branches = [select(*[table.c[name] for name in columns]) if columns else select(table) for table in tables]
+    return aliased(StreamingHistory, union_all(*branches).subquery('history'), adapt_on_names=True)
+
+def create_partition(connection, year):
+    '''Create the partition of a year if it doesn't exist yet and return its table.'''
+    table = partition_table(year)
+    table.create(connection, checkfirst=True)
+    return table
+
+def partition_history(bind):
+    '''
+    Move the plays of the single streaming_history table into the year partitions, in one transaction.
+    Run by init_db when the partitioned mode is on; ids are kept, so record links stay valid.
+    '''
+    columns = ', '.join(column.name for column in StreamingHistory.__table__.columns)
+    with bind.connect() as connection, connection.begin():
+        years = connection.exec_driver_sql(
+            'SELECT DISTINCT play_year FROM streaming_history WHERE play_year IS NOT NULL'
+        ).scalars().all()
+        for year in years:
+            table = create_partition(connection, year)
+            moved = connection.exec_driver_sql(
+                f'INSERT INTO {table.name} ({columns}) SELECT {columns} FROM streaming_history WHERE play_year = ? ON CONFLICT DO NOTHING',
+                (year,)
+            ).rowcount
+            logging.info(f'Moved {moved} plays of {year} to {table.name}.')
+        connection.exec_driver_sql('DELETE FROM streaming_history WHERE play_year IS NOT NULL')
+
+def next_history_id(connection):
+    '''Next free play id over streaming_history and all partitions, ids are unique across them.'''
+    tables = ['streaming_history'] + [partition_table(year).name for year in partition_years(connection)]
+    return 1 + max(connection.exec_driver_sql(f'SELECT coalesce(max(id), 0) FROM {name}').scalar() for name in tables)
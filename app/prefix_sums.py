@@ -0,0 +1,169 @@
+'''
+Prefix-sum index of the daily rollups, for top tracks/artists over any window of days.
+
+For every track (DailyTrackPlays) and artist (DailyArtistPlays) the index holds the running
+totals of play_count and ms_played over its days, flattened into arrays sorted by entity and day:
+    keys[i]      entity_id << DAY_BITS | day number (days since 1970-01-01) of the i-th rollup row
+    plays[i]     play_count of the rows before i (plays[0] = 0), ms_played[i] likewise
+The totals of entity e from day a to day b are plays[hi] - plays[lo], where lo and hi are the
+positions of (e, a) and (e, b) in keys: two binary searches, whatever the number of plays or days.
+They are vectorized over all the entities at once, so a top-K for a window is one numpy pass over
+the entities, never over the plays.
+
+The index is built from the rollup (one read in primary key order) once per data generation,
+right after an import or on first use, and saved next to the database (listening_history.db ->
+listening_history.track_prefix.<generation>.npy), read memory-mapped like the history snapshot
+(app/snapshots.py). Enabled with Config.PREFIX_SUMS.
+'''
+import os
+import glob
+import logging
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import DailyTrackPlays, DailyArtistPlays
+from app.summaries import data_generation
+
+DAY_BITS = 17 # day numbers up to 131071, the year 2328
+LAST_DAY = (1 << DAY_BITS) - 1
+
+# Rollup and key column of each kind of entity
+PREFIX_KINDS = {
+    'track': (DailyTrackPlays, 'track_id'),
+    'artist': (DailyArtistPlays, 'artist_id'),
+}
+
+PrefixSums = namedtuple('PrefixSums', ['keys', 'plays', 'ms_played', 'entities'])
+# Rows of the top-K, with the fields of the SQL rows they replace in get_top_tracks/get_top_artists
+TrackTotals = namedtuple('TrackTotals', ['track_id', 'play_count', 'total_ms_played'])
+ArtistTotals = namedtuple('ArtistTotals', ['artist_id', 'total_ms_played', 'total_plays'])
+
+_indexes = {} # (database, kind, generation) -> PrefixSums
+_indexes_lock = threading.Lock()
+
+
+def day_number(day):
+    '''Days since 1970-01-01 of a YYYY-MM-DD day.'''
+    return int(np.datetime64(day, 'D').astype(np.int64))
+
+def prefix_path(bind, kind, generation):
+    '''Path of an index file of a database engine, None for an in-memory database.'''
+    database = bind.url.database
+    if not database or database == ':memory:':
+        return None
+    return f'{os.path.splitext(database)[0]}.{kind}_prefix.{generation}.npy'
+
+def build_prefix_sums(bind, kind):
+    '''
+    The index of one kind of entity as one (3, rows + 1) int64 array: keys (padded with the
+    largest key), running play counts, running listening time.
+    '''
+    rollup, key = PREFIX_KINDS[kind]
+    with Session(bind) as session:
+        rows = session.execute(
+            select(getattr(rollup, key), rollup.play_date, rollup.play_count, rollup.ms_played)
+            .order_by(getattr(rollup, key), rollup.play_date) # the rollup's primary key, no sort
+        ).all()
+
+    count = len(rows)
+    ids, days, plays, ms_played = zip(*rows) if rows else ((), (), (), ())
+    index = np.zeros((3, count + 1), dtype=np.int64)
+    index[0, :count] = (np.array(ids, dtype=np.int64) << DAY_BITS) | np.array(days, dtype='datetime64[D]').astype(np.int64)
+    index[0, count] = np.iinfo(np.int64).max
+    np.cumsum(np.array(plays, dtype=np.int64), out=index[1, 1:])
+    np.cumsum(np.array(ms_played, dtype=np.int64), out=index[2, 1:])
+    return index
+
+def write_prefix_sums(bind, generation):
+    '''
+    Build and save the indexes of a database for a data generation; files of older generations
+    are removed. Written to a temporary file first and renamed, readers never map a half written one.
+    '''
+    for kind in PREFIX_KINDS:
+        path = prefix_path(bind, kind, generation)
+        if path is None:
+            return
+        index = build_prefix_sums(bind, kind)
+        temporary = f'{path}.{os.getpid()}.tmp' # several workers may rebuild the same index at once
+        with open(temporary, 'wb') as file:
+            np.save(file, index)
+        os.replace(temporary, path)
+        for old in glob.glob(prefix_path(bind, kind, '*')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except FileNotFoundError: # removed by another worker
+                    pass
+        logging.info(f'Wrote the {kind} prefix sums {path} ({index.shape[1] - 1} rollup rows).')
+
+def load_prefix_sums(session, kind):
+    '''The index of one kind of entity for the session's database and its current data generation.'''
+    bind = session.get_bind()
+    generation = data_generation(session)
+    cache_key = (str(bind.url), kind, generation)
+    with _indexes_lock:
+        if cache_key not in _indexes:
+            path = prefix_path(bind, kind, generation)
+            if path is None:
+                index = build_prefix_sums(bind, kind)
+            else:
+                if not os.path.exists(path):
+                    write_prefix_sums(bind, generation)
+                index = np.load(path, mmap_mode='r')
+            keys = index[0]
+            for old in [key for key in _indexes if key[:2] == cache_key[:2]]: # an older generation
+                del _indexes[old]
+            _indexes[cache_key] = PrefixSums(keys, index[1], index[2], np.unique(keys[:-1] >> DAY_BITS))
+        return _indexes[cache_key]
+
+def window_totals(index, first_day=0, last_day=LAST_DAY, entity_ids=None):
+    '''
+    Plays and listening time of every entity from first_day to last_day (day numbers, both included).
+
+    Returns:
+        tuple: (entity ids, play counts, ms played), numpy arrays of the same length
+    '''
+    entities = index.entities if entity_ids is None else np.intersect1d(index.entities, np.asarray(entity_ids, dtype=np.int64))
+    keys = entities << DAY_BITS
+    low = np.searchsorted(index.keys, keys | first_day, side='left')
+    high = np.searchsorted(index.keys, keys | last_day, side='right')
+    return entities, index.plays[high] - index.plays[low], index.ms_played[high] - index.ms_played[low]
+
+def top_in_window(session, kind, sort_by, limit, period, entity_ids=None, min_ms_played=0):
+    '''
+    Top-K tracks or artists of a period, from the index.
+
+    Args:
+        session: Session of the history database.
+        kind (str): 'track' or 'artist'.
+        sort_by (str): 'play_count' or 'total_ms_played'.
+        limit (int): Number of rows.
+        period (Period): Window of days, see app.utils.period_utils.
+        entity_ids (list): Only these tracks/artists, if given.
+        min_ms_played (int): Only the ones listened to at least this long in the window.
+
+    Returns:
+        list: TrackTotals or ArtistTotals, by sort_by descending (then by id).
+    '''
+    first_day = day_number(period.start) if period.start else 0
+    last_day = day_number(period.end) if period.end else LAST_DAY
+    if last_day < first_day or limit < 1:
+        return []
+    entities, plays, ms_played = window_totals(load_prefix_sums(session, kind), first_day, last_day, entity_ids)
+
+    keep = (plays > 0) & (ms_played >= min_ms_played)
+    entities, plays, ms_played = entities[keep], plays[keep], ms_played[keep]
+    metric = plays if sort_by == 'play_count' else ms_played
+    if limit < len(metric): # the top rows first, only those are sorted
+        top = np.argpartition(-metric, limit - 1)[:limit]
+        entities, plays, ms_played, metric = entities[top], plays[top], ms_played[top], metric[top]
+    order = np.lexsort((entities, -metric))[:limit]
+
+    if kind == 'track':
+        return [TrackTotals(*row) for row in zip(entities[order].tolist(), plays[order].tolist(), ms_played[order].tolist())]
+    return [ArtistTotals(*row) for row in zip(entities[order].tolist(), ms_played[order].tolist(), plays[order].tolist())]
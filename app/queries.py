@@ -0,0 +1,198 @@
+'''
+Declarative analytics queries, served by /db/history/query.
+
+A query names its dimensions (what to group by), metrics (what to count), filters and an
+optional top-K, e.g. `dimensions=weekday,hour&metrics=plays,ms_played&year=2021`. It is
+compiled into one SQL aggregation:
+    - on a daily rollup (DailyPlays, DailyTrackPlays, DailyArtistPlays) when the rollup holds
+      every dimension, metric and filter of the query, so it reads days x entities instead of plays
+      (the artist and track rollups only when the query is about artists or tracks, they have no episodes)
+    - on the plays otherwise (history_source, only the columns the query uses)
+Artist and track names are joined onto the (already limited) aggregate in the same statement.
+
+Results are cached per database, data generation and normalized query, like the whole-history
+summary (app/summaries.py): the same question is answered once until the next import.
+'''
+import json
+import hashlib
+
+from sqlalchemy import Integer, case, cast, distinct, func, select
+
+from app.models import Artist, Track, DailyPlays, DailyTrackPlays, DailyArtistPlays
+from app.partitions import history_source
+from app.shards import history_session
+from app.summaries import data_generation
+from app.utils.period_utils import ALL_TIME, Period, in_period
+from app.utils.search_utils import matching_ids, name_matches
+from app.utils.utils import cache
+
+DIMENSIONS = ('hour', 'weekday', 'day', 'month', 'year', 'artist', 'track', 'platform', 'reason_end')
+METRICS = ('plays', 'ms_played', 'skips', 'distinct_tracks')
+FILTERS = ('artist', 'track', 'platform', 'reason_end', 'skipped')
+QUERY_LIMIT = 1000 # default number of rows
+QUERY_LIMIT_MAX = 10_000
+
+# Rollups by preference: (table, dimensions, metrics, filters) it can answer, and the dimensions/filters
+# one of which the query needs to use it: a rollup of artists or tracks leaves out the plays without one
+ROLLUPS = [
+    (DailyPlays, {'day', 'month', 'year'}, {'plays', 'ms_played'}, set(), set()),
+    (DailyArtistPlays, {'day', 'month', 'year', 'artist'}, {'plays', 'ms_played'}, {'artist'}, {'artist'}),
+    (DailyTrackPlays, {'day', 'month', 'year', 'track'}, {'plays', 'ms_played', 'distinct_tracks'}, {'artist', 'track'}, {'artist', 'track'}),
+]
+
+# Columns of the plays behind each dimension, metric and filter
+HISTORY_COLUMNS = {
+    'hour': ['play_hour'], 'weekday': ['play_weekday'], 'day': ['play_date'], 'month': ['play_date'],
+    'year': ['play_year'], 'artist': ['artist_id'], 'track': ['track_id'], 'platform': ['platform'],
+    'reason_end': ['reason_end'], 'plays': ['id'], 'ms_played': ['ms_played'], 'skips': ['skipped'],
+    'distinct_tracks': ['track_id'], 'skipped': ['skipped'],
+}
+
+
+def _names(value, allowed, kind):
+    '''Comma separated names of a query argument, checked against the allowed ones.'''
+    names = [name.strip() for name in value.split(',') if name.strip()] if value else []
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f'Invalid {kind} {", ".join(unknown)}, expected some of {", ".join(allowed)}')
+    return list(dict.fromkeys(names))
+
+def parse_query(args, period):
+    '''
+    The normalized query of /db/history/query's arguments, see get_history_query.
+
+    Args:
+        args: Request arguments.
+        period (Period): Period of the query, from app.utils.period_utils.request_period.
+
+    Returns:
+        dict: dimensions, metrics, filters, period, sort, limit
+
+    Raises:
+        ValueError: on an invalid argument, with the message for the client.
+    '''
+    dimensions = _names(args.get('dimensions'), DIMENSIONS, 'dimensions')
+    metrics = _names(args.get('metrics'), METRICS, 'metrics') or ['plays', 'ms_played']
+    sort = args.get('sort')
+    if sort and sort not in metrics:
+        raise ValueError(f'Invalid sort {sort}, expected one of the metrics {", ".join(metrics)}')
+    filters = {name: args[name] for name in FILTERS if args.get(name)}
+    if 'skipped' in filters:
+        if filters['skipped'] not in ('true', 'false'):
+            raise ValueError('Invalid skipped, expected true or false')
+        filters['skipped'] = filters['skipped'] == 'true'
+    limit = max(1, min(args.get('limit', QUERY_LIMIT, type=int), QUERY_LIMIT_MAX))
+    return {
+        'dimensions': dimensions,
+        'metrics': sorted(metrics, key=METRICS.index),
+        'filters': dict(sorted(filters.items())),
+        'period': list(period),
+        'sort': sort,
+        'limit': limit,
+    }
+
+def _rollup_for(query):
+    '''The first rollup that answers the query, None if only the plays do.'''
+    used = set(query['dimensions']) | set(query['filters'])
+    for table, dimensions, metrics, filters, entities in ROLLUPS:
+        if (set(query['dimensions']) <= dimensions and set(query['metrics']) <= metrics
+                and set(query['filters']) <= filters and (not entities or used & entities)):
+            return table
+    return None
+
+def _dimension_column(source, name):
+    '''Column of a dimension in a rollup or the plays, labeled with the dimension name.'''
+    if name == 'month':
+        column = func.substr(source.play_date, 1, 7) # 'YYYY-MM'
+    elif name == 'year' and not hasattr(source, 'play_year'): # rollups only have the day
+        column = cast(func.substr(source.play_date, 1, 4), Integer)
+    else:
+        column = getattr(source, {
+            'hour': 'play_hour', 'weekday': 'play_weekday', 'day': 'play_date', 'year': 'play_year',
+            'artist': 'artist_id', 'track': 'track_id', 'platform': 'platform', 'reason_end': 'reason_end',
+        }[name])
+    return column.label(name)
+
+def _metric_column(source, name):
+    '''Aggregate of a metric over a rollup or the plays.'''
+    if name == 'plays':
+        return func.sum(source.play_count) if hasattr(source, 'play_count') else func.count(source.id)
+    if name == 'ms_played':
+        return func.sum(source.ms_played)
+    if name == 'skips':
+        return func.count(case((source.skipped == True, 1)))
+    return func.count(distinct(source.track_id)) # distinct_tracks
+
+def compile_query(query):
+    '''
+    The SQL statement of a normalized query (see parse_query): one aggregation over a rollup
+    or the plays, top-K applied, artist/track names joined onto the result.
+    '''
+    rollup = _rollup_for(query)
+    filters = query['filters']
+    period = query['period']
+    if rollup is not None:
+        source = rollup
+    else:
+        columns = {'id'} | {column for name in query['dimensions'] + query['metrics'] + list(filters) for column in HISTORY_COLUMNS[name]}
+        if Period(*period) != ALL_TIME:
+            columns.add('play_date')
+        source = history_source(*sorted(columns), start=period[0], end=period[1])
+    # only the requested ones: the plays of a partitioned history have only the columns the query uses
+    metrics = {name: _metric_column(source, name) for name in query['metrics']}
+
+    dimensions = [_dimension_column(source, name) for name in query['dimensions']]
+    conditions = in_period(source.play_date, Period(*period))
+    # plays without an artist/track form no group, as in the rollups
+    conditions += [getattr(source, f'{name}_id').isnot(None) for name in ('artist', 'track') if name in query['dimensions']]
+    if 'artist' in filters:
+        if hasattr(source, 'artist_id'):
+            conditions.append(source.artist_id.in_(matching_ids(Artist, filters['artist'])))
+        else: # the track rollup
+            conditions.append(source.track_id.in_(select(Track.id).where(Track.artist_id.in_(name_matches(Artist, filters['artist'])))))
+    if 'track' in filters:
+        conditions.append(source.track_id.in_(matching_ids(Track, filters['track'])))
+    for name in ('platform', 'reason_end'):
+        if name in filters:
+            conditions.append(getattr(source, name) == filters[name])
+    if 'skipped' in filters:
+        conditions.append(source.skipped == filters['skipped'])
+
+    aggregate = select(*dimensions, *[metrics[name].label(name) for name in query['metrics']]).where(*conditions)
+    if dimensions:
+        aggregate = aggregate.group_by(*dimensions)
+    order = [dimension.name for dimension in dimensions]
+    if query['sort']:
+        order = [metrics[query['sort']].desc()] + order
+    cube = aggregate.order_by(*order).limit(query['limit']).subquery('cube')
+
+    # names onto the result, in the same statement
+    columns, joins = [], []
+    for name in query['dimensions']:
+        if name == 'artist':
+            columns += [Artist.name.label('artist'), cube.c.artist.label('artist_id')]
+            joins.append((Artist, Artist.id == cube.c.artist))
+        elif name == 'track':
+            columns += [Track.name.label('track'), Track.uri.label('track_uri')]
+            joins.append((Track, Track.id == cube.c.track))
+        else:
+            columns.append(cube.c[name])
+    statement = select(*columns, *[cube.c[name] for name in query['metrics']]).select_from(cube)
+    for table, on in joins:
+        statement = statement.outerjoin(table, on)
+    # the subquery's order isn't kept through the joins, order again
+    sort = [cube.c[query['sort']].desc()] if query['sort'] else []
+    return statement.order_by(*sort, *[cube.c[name] for name in query['dimensions']])
+
+def run_query(query):
+    '''
+    Rows of a normalized query as dicts, from the cache while the data generation is current.
+    '''
+    session = history_session
+    shape = hashlib.sha256(json.dumps(query, sort_keys=True).encode()).hexdigest()[:32]
+    cache_key = f'history_query_{session.get_bind().url.database}_{data_generation(session)}_{shape}'
+    rows = cache.get(cache_key)
+    if rows is None:
+        rows = [dict(row._mapping) for row in session.execute(compile_query(query))]
+        cache.set(cache_key, rows, timeout=0) # versioned by the generation, never stale
+    return rows
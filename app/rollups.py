@@ -0,0 +1,65 @@
+'''
+Incremental maintenance of the daily rollup tables (DailyPlays, DailyTrackPlays, DailyArtistPlays).
+
+Plays are only ever added, with ids above every stored one (autoincrement, or next_history_id
+with year partitions). RollupState keeps the id of the last play already counted, so an update
+aggregates just the plays added since and adds them onto the stored days with an upsert. An
+import that fails half way is caught up by the next update, nothing is counted twice.
+'''
+import logging
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from app.models import DailyPlays, DailyTrackPlays, DailyArtistPlays, RollupState
+from app.partitions import history_source
+
+
+def _add_counts(session, rollup, history, keys, first_id, last_id):
+    '''Add the plays with first_id < id <= last_id to a rollup, grouped by its key columns.'''
+    key_columns = [getattr(history, key) for key in keys]
+    new_plays = select(
+        *key_columns, func.count(history.id), func.sum(history.ms_played)
+    ).where(
+        history.id > first_id, history.id <= last_id, *[column.isnot(None) for column in key_columns]
+    ).group_by(*key_columns)
+
+    statement = insert(rollup).from_select(keys + ['play_count', 'ms_played'], new_plays)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={
+            'play_count': rollup.play_count + statement.excluded.play_count,
+            'ms_played': rollup.ms_played + statement.excluded.ms_played,
+        },
+    )
+    session.execute(statement)
+
+def update_rollups(bind):
+    '''
+    Count the plays added since the last update into the daily rollups, in one transaction.
+    Run after every import, and by the migration that introduced the rollups.
+
+    Args:
+        bind: Engine or connection of the history database.
+
+    Returns:
+        int: Number of plays counted.
+    '''
+    with Session(bind) as session, session.begin():
+        state = session.get(RollupState, 1) or RollupState(id=1, last_history_id=0)
+        first_id = state.last_history_id
+        history = history_source('id', 'track_id', 'artist_id', 'play_date', 'ms_played', session=session)
+        last_id, count = session.execute(
+            select(func.max(history.id), func.count(history.id)).where(history.id > first_id)
+        ).one()
+        if not count:
+            return 0
+
+        _add_counts(session, DailyPlays, history, ['play_date'], first_id, last_id)
+        _add_counts(session, DailyTrackPlays, history, ['track_id', 'play_date'], first_id, last_id)
+        _add_counts(session, DailyArtistPlays, history, ['artist_id', 'play_date'], first_id, last_id)
+        state.last_history_id = last_id
+        session.add(state)
+    logging.info(f'Added {count} plays to the daily rollups.')
+    return count
@@ -0,0 +1,87 @@
+'''
+Per-user history shards.
+
+Every account has its own history database (see app.database.user_db_path). The db blueprint
+resolves the account of each request - the `account_id` argument (Spotify id or custom id) or
+the logged in user - and history_session then points at that account's database for the
+rest of the request. Requests without an account use the shared database, as before.
+
+Histories imported before the databases were split are in the shared database, their plays
+carry the Spotify id of their owner as username. Until the first import into the owner's own
+database, the owner reads the shared database; every other account reads its own, empty one.
+'''
+from flask import g, has_app_context, jsonify, request, session
+from sqlalchemy import or_
+from werkzeug.local import LocalProxy
+
+from app.database import db_session, get_user_db
+from app.models import User, ImportedFile
+
+_accounts_with_history = set() # accounts whose database holds an import, it never loses it
+_shared_history_owners = {} # account -> whether the shared database holds its plays, nothing is imported there any more
+
+
+def resolve_account(account_id):
+    '''Return the spotify_user_id of an account given by Spotify id or custom id, None if unknown.'''
+    user = db_session.query(User).filter(
+        or_(User.spotify_user_id == account_id, User.custom_id == account_id)
+    ).first()
+    return user.spotify_user_id if user else None
+
+def route_history_shard():
+    '''
+    before_request of the db blueprint: pick the shard of the request's account.
+    The shard is only opened when a query uses history_session, see current_history_session.
+    '''
+    account_id = request.args.get('account_id') or session.get('account_id')
+    if not account_id:
+        return
+    spotify_user_id = resolve_account(account_id)
+    if not spotify_user_id:
+        return jsonify({'error': f'Account {account_id} not found'}), 404
+    g.history_account = spotify_user_id
+
+def release_history_shard(exception=None):
+    '''
+    teardown_request of the db blueprint: give the request's connection back to its pool.
+    The session the request used is kept on g, the shard isn't looked up (or reopened, if evicted) again.
+    '''
+    g.pop('history_session', db_session).remove()
+
+def current_history_account():
+    '''spotify_user_id whose shard the current request reads, None for the shared database.'''
+    return g.get('history_account') if has_app_context() else None
+
+def has_imported_history(spotify_user_id):
+    '''True once an import stored a file in the database of an account.'''
+    if spotify_user_id not in _accounts_with_history:
+        if get_user_db(spotify_user_id).query(ImportedFile.id).first() is None:
+            return False
+        _accounts_with_history.add(spotify_user_id)
+    return True
+
+def owns_shared_history(spotify_user_id):
+    '''True if the shared database holds plays of the account, imported before the per-user databases.'''
+    if spotify_user_id not in _shared_history_owners:
+        from app.partitions import history_source # imports history_session from here
+
+        history = history_source('username', session=db_session)
+        plays = db_session.query(history.username).filter(history.username == spotify_user_id)
+        _shared_history_owners[spotify_user_id] = plays.first() is not None
+    return _shared_history_owners[spotify_user_id]
+
+def current_history_session():
+    '''
+    Scoped session of the current request's shard, db_session outside of a routed request
+    and for the owner of the shared history until their first import. Picked once per request.
+    '''
+    account = current_history_account()
+    if not account:
+        return db_session
+    if 'history_session' not in g:
+        shared = not has_imported_history(account) and owns_shared_history(account)
+        g.history_session = db_session if shared else get_user_db(account)
+    return g.history_session
+
+# Use in place of db_session for everything read from the streaming history
+history_session = LocalProxy(current_history_session)
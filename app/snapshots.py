@@ -0,0 +1,133 @@
+'''
+Columnar snapshots of the streaming history, for the 'columnar' analytics backend
+(Config.ANALYTICS_BACKEND, see app/utils/analytics_utils.py).
+
+A snapshot is an Arrow IPC file next to the database (listening_history.db ->
+listening_history.arrow) holding the numeric/short columns the trend endpoints aggregate.
+It is read memory-mapped: the DataFrame columns are views of the mapped file, so opening it
+costs no parsing and the OS page cache is shared by all workers.
+
+A snapshot belongs to a data generation (app/summaries.py), kept in the file's schema metadata.
+It is rewritten after every import with the columnar backend on, and on first use whenever its
+generation isn't the database's current one (an import with the backend off, a new database).
+Loaded snapshots are kept per file and generation.
+'''
+import os
+import logging
+import threading
+from contextlib import closing
+
+import pandas as pd
+import pyarrow as pa
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.partitions import history_source
+from app.shards import history_session
+from app.summaries import data_generation
+
+# Columns of the snapshot and their Arrow types; nullable ones stay nullable (no NaN floats)
+SNAPSHOT_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('ts_ms', pa.int64()),
+    ('play_date', pa.string()),
+    ('play_year', pa.int16()),
+    ('play_month', pa.int8()),
+    ('play_hour', pa.int8()),
+    ('play_weekday', pa.int8()),
+    ('ms_played', pa.int64()),
+    ('track_id', pa.int64()),
+    ('artist_id', pa.int64()),
+    ('album_id', pa.int64()),
+    ('skipped', pa.bool_()),
+    ('platform', pa.string()),
+    ('reason_end', pa.string()),
+])
+SNAPSHOT_BATCH_SIZE = 100_000  # rows fetched from SQLite per record batch while writing
+
+_snapshots = {}  # path -> (generation, DataFrame)
+_snapshots_lock = threading.Lock()
+
+
+def snapshot_path(bind):
+    '''Path of the snapshot of a database engine, None for an in-memory database.'''
+    database = bind.url.database
+    if not database or database == ':memory:':
+        return None
+    return os.path.splitext(database)[0] + '.arrow'
+
+def snapshot_generation(path):
+    '''Data generation a snapshot file was written for, None if there is no (readable) file.'''
+    try:
+        with pa.memory_map(path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return None
+    return int(metadata[b'generation']) if b'generation' in metadata else None
+
+def write_snapshot(bind, generation=None):
+    '''
+    Write the snapshot of a database from its streaming history (all partitions), batch by batch.
+    Written to a temporary file first and renamed, so readers never map a half written file.
+
+    Args:
+        bind: Engine of the database.
+        generation (int): Data generation of the plays, the database's current one by default.
+
+    Returns:
+        str: Path of the snapshot, None if the database has no file.
+    '''
+    path = snapshot_path(bind)
+    if path is None:
+        return None
+
+    with Session(bind) as session:
+        generation = data_generation(session) if generation is None else generation
+        schema = SNAPSHOT_SCHEMA.with_metadata({'generation': str(generation)})
+        history = history_source(*SNAPSHOT_SCHEMA.names, session=session)
+        query = select(*[getattr(history, name) for name in SNAPSHOT_SCHEMA.names])
+        temporary = f'{path}.{os.getpid()}.tmp' # several workers may rebuild a stale snapshot at once
+        # DBAPI cursor: rows come as plain tuples, the ORM result rows would double the write time
+        with closing(session.connection().connection.cursor()) as cursor, \
+                pa.OSFile(temporary, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+            cursor.execute(str(query.compile(bind)))
+            rows = 0
+            while batch := cursor.fetchmany(SNAPSHOT_BATCH_SIZE):
+                columns = zip(*batch)
+                writer.write_batch(pa.record_batch(
+                    [pa.array(values).cast(field.type) for values, field in zip(columns, SNAPSHOT_SCHEMA)], # skipped is 0/1 in SQLite
+                    schema=schema,
+                ))
+                rows += len(batch)
+    os.replace(temporary, path)
+    logging.info(f'Wrote the history snapshot {path} ({rows} plays, generation {generation}).')
+    return path
+
+def load_snapshot(bind):
+    '''
+    The snapshot of a database as a DataFrame of Arrow backed columns (memory-mapped, zero copy).
+    Written first if the database has none of its current data generation, e.g. right after
+    switching the backend on or after an import with the backend off.
+    '''
+    path = snapshot_path(bind)
+    if path is None:
+        raise ValueError(f'{bind.url} has no file to keep a history snapshot next to')
+    with Session(bind) as session:
+        generation = data_generation(session)
+
+    with _snapshots_lock:
+        cached = _snapshots.get(path)
+        if cached and cached[0] == generation:
+            return cached[1]
+        if snapshot_generation(path) != generation:
+            write_snapshot(bind, generation)
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+        frame = table.to_pandas(types_mapper=pd.ArrowDtype)
+        _snapshots[path] = (generation, frame)
+        return frame
+
+def history_snapshot():
+    '''Snapshot of the current request's history database, see app.shards.'''
+    return load_snapshot(history_session.get_bind())
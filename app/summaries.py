@@ -0,0 +1,117 @@
+'''
+History summary: totals, skips, unique tracks, platform, end reason, hour and weekday breakdowns,
+everything the overview dashboard (/db/history/dashboard) and the summary endpoints show.
+
+The history only changes on import, and every import bumps the database's data generation
+(DataGeneration). The summary is computed once per generation and period - one grouped scan of the
+overview index plus a count over the track rollup, or the same grouping of the history snapshot with
+the columnar backend - and cached under the database, its generation and the period, so the summary
+endpoints read one tiny row per request until the next import.
+A summary of an older generation is never served: its key is never asked for again.
+'''
+import logging
+
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import Session
+
+from app.config import Config
+from app.models import DataGeneration, DailyTrackPlays
+from app.partitions import history_source
+from app.shards import history_session
+from app.utils import analytics_utils as analytics
+from app.utils.period_utils import ALL_TIME, in_period
+from app.utils.utils import cache
+
+
+def data_generation(session):
+    '''Current data generation of the session's database, 0 before the first import.'''
+    return session.scalar(select(DataGeneration.generation).where(DataGeneration.id == 1)) or 0
+
+def bump_generation(bind):
+    '''Start a new data generation, run once an import has committed its plays.'''
+    with Session(bind) as session, session.begin():
+        state = session.get(DataGeneration, 1) or DataGeneration(id=1, generation=0)
+        state.generation = generation = state.generation + 1
+        session.add(state)
+    logging.info(f'History data generation is now {generation}.')
+    return generation
+
+def compute_summary(session, period=ALL_TIME):
+    '''
+    Compute the summary of a period in one scan of the history, grouped by (platform, reason_end,
+    play_hour, play_weekday): every breakdown adds up these groups.
+
+    Returns:
+        dict: total_ms_played, total_plays, skipped_plays, unique_tracks,
+              platforms [(platform, play_count, total_ms_played)], end_reasons [(reason_end, count)],
+              hourly [(hour, play_count, total_ms_played)], weekly [(weekday, play_count, total_ms_played)]
+    '''
+    dated = ['play_date'] if period != ALL_TIME else []
+    history = history_source('id', 'platform', 'reason_end', 'play_hour', 'play_weekday', 'skipped', 'ms_played', *dated,
+                             start=period.start, end=period.end, session=session)
+    groups = session.execute(
+        select(
+            history.platform,
+            history.reason_end,
+            history.play_hour,
+            history.play_weekday,
+            func.count(history.id),
+            func.count(history.platform),
+            func.count(history.reason_end),
+            func.count(case((history.skipped == True, 1))),
+            func.coalesce(func.sum(history.ms_played), 0),
+        ).where(*in_period(history.play_date, period)
+        ).group_by(history.platform, history.reason_end, history.play_hour, history.play_weekday)
+    ).all()
+
+    # the track rollup has one row per track and day, the plays themselves aren't read again
+    unique_tracks = session.scalar(
+        select(func.count(func.distinct(DailyTrackPlays.track_id))).where(*in_period(DailyTrackPlays.play_date, period))
+    )
+    return summarize(groups, unique_tracks)
+
+def summarize(groups, unique_tracks):
+    '''
+    The summary from the grouped plays of compute_summary's scan, or of the columnar backend's
+    (app.utils.analytics_utils.summary_groups).
+
+    Args:
+        groups (list): (platform, reason_end, hour, weekday, plays, plays with a platform,
+                       plays with an end reason, skipped plays, ms played) per group.
+        unique_tracks (int): Number of distinct tracks played.
+    '''
+    platforms, end_reasons, hours, weekdays = {}, {}, {}, {}
+    summary = {'total_ms_played': 0, 'total_plays': 0, 'skipped_plays': 0}
+    for platform, reason_end, hour, weekday, plays, platform_plays, reason_plays, skipped, ms_played in groups:
+        summary['total_ms_played'] += ms_played
+        summary['total_plays'] += plays
+        summary['skipped_plays'] += skipped
+        platform_count, platform_ms = platforms.get(platform, (0, 0))
+        platforms[platform] = (platform_count + platform_plays, platform_ms + ms_played)
+        end_reasons[reason_end] = end_reasons.get(reason_end, 0) + reason_plays
+        for totals, key in ((hours, hour), (weekdays, weekday)):
+            count, ms = totals.get(key, (0, 0))
+            totals[key] = (count + plays, ms + ms_played)
+
+    summary['platforms'] = [(platform, count, ms) for platform, (count, ms) in platforms.items()]
+    summary['end_reasons'] = list(end_reasons.items())
+    summary['hourly'] = [(hour, count, ms) for hour, (count, ms) in sorted(hours.items()) if hour is not None]
+    summary['weekly'] = [(weekday, count, ms) for weekday, (count, ms) in sorted(weekdays.items()) if weekday is not None]
+    summary['unique_tracks'] = unique_tracks
+    return summary
+
+def history_summary(period=ALL_TIME):
+    '''Summary of the current request's history database, from the cache while its generation is current.'''
+    session = history_session
+    cache_key = f'history_summary_{session.get_bind().url.database}_{data_generation(session)}'
+    if period != ALL_TIME:
+        cache_key += f'_{period.start}_{period.end}'
+    summary = cache.get(cache_key)
+    if summary is None:
+        if Config.ANALYTICS_BACKEND == 'columnar':
+            from app.snapshots import history_snapshot # imports data_generation from here
+            summary = summarize(*analytics.summary_groups(history_snapshot(), period))
+        else:
+            summary = compute_summary(session, period)
+        cache.set(cache_key, summary, timeout=0) # versioned by the generation, never stale
+    return summary
@@ -0,0 +1,116 @@
+'''
+Columnar analytics backend: the trend/top/summary aggregations of the db blueprint computed with
+vectorized pandas operations on the history snapshot (app/snapshots.py) instead of SQL.
+Enabled with Config.ANALYTICS_BACKEND = 'columnar'; compare both with `python -m benchmarks.bench_analytics`.
+
+Every function takes the snapshot DataFrame and returns rows with the same fields as the SQL
+query it replaces (named tuples of plain Python values), so the endpoints build their
+responses from either one the same way.
+'''
+from collections import namedtuple
+
+import pandas as pd
+
+from app.utils.period_utils import ALL_TIME
+
+
+def _rows(frame):
+    '''Rows of a DataFrame as named tuples, pd.NA as None, so they go straight to jsonify.'''
+    Row = namedtuple('Row', frame.columns)
+    columns = [frame[column].tolist() for column in frame.columns]
+    return [Row(*(None if value is pd.NA else value for value in values)) for values in zip(*columns)]
+
+def _totals(frame, key, label, **aggregations):
+    '''Plays and listening time per value of `key` (NULL keys form a group, as in SQL), ascending.'''
+    totals = frame.groupby(key, dropna=False, sort=True).agg(
+        play_count=('id', 'size'), total_ms_played=('ms_played', 'sum'), **aggregations
+    )
+    return totals.reset_index().rename(columns={key: label})
+
+def _in_period(frame, period, columns):
+    '''The plays of the period (an app.utils.period_utils.Period), only the given columns if filtered.'''
+    if period.start is None and period.after is None:
+        return frame
+    frame = frame[columns] # filtering copies, only the columns used
+    if period.start:
+        frame = frame[frame['play_date'] >= period.start]
+    if period.after:
+        frame = frame[frame['play_date'] < period.after]
+    return frame
+
+def _top(totals, sort_by, limit):
+    '''The `limit` first rows of an aggregate by `sort_by`, descending.'''
+    return totals.sort_values(sort_by, ascending=False, kind='stable').head(limit)
+
+def hourly_trends(frame, period=ALL_TIME):
+    '''(hour, play_count, total_ms_played) per hour of the day, of the period.'''
+    plays = _in_period(frame, period, ['id', 'play_date', 'play_hour', 'ms_played'])
+    return _rows(_totals(plays, 'play_hour', 'hour'))
+
+def weekly_trends(frame, period=ALL_TIME):
+    '''(day_of_week, play_count, total_ms_played) per weekday, 0 = Sunday, of the period.'''
+    plays = _in_period(frame, period, ['id', 'play_date', 'play_weekday', 'ms_played'])
+    return _rows(_totals(plays, 'play_weekday', 'day_of_week'))
+
+def daily_trends(frame, period=ALL_TIME):
+    '''(day, play_count, total_ms_played) per day of the period.'''
+    plays = _in_period(frame, period, ['id', 'play_date', 'ms_played'])
+    return _rows(_totals(plays, 'play_date', 'day'))
+
+def summary_groups(frame, period=ALL_TIME):
+    '''
+    The grouped plays of the history summary (see app.summaries.compute_summary) of the period:
+    (platform, reason_end, hour, weekday, plays, plays with a platform, plays with an end reason,
+    skipped plays, ms played) per group, and the number of distinct tracks.
+    '''
+    plays = _in_period(frame, period, ['id', 'play_date', 'platform', 'reason_end', 'play_hour', 'play_weekday',
+                                       'skipped', 'ms_played', 'track_id'])
+    groups = plays.groupby(['platform', 'reason_end', 'play_hour', 'play_weekday'], dropna=False, sort=True).agg(
+        plays=('id', 'size'), platform_plays=('platform', 'count'), reason_plays=('reason_end', 'count'),
+        skipped_plays=('skipped', 'sum'), ms_played=('ms_played', 'sum'),
+    )
+    return _rows(groups.reset_index()), int(plays['track_id'].nunique())
+
+def top_tracks(frame, sort_by, limit, period=ALL_TIME, month=None, track_ids=None):
+    '''
+    (track_id, play_count, total_ms_played) of the top tracks, see get_top_tracks.
+
+    Args:
+        frame: History snapshot.
+        sort_by (str): 'play_count' or 'total_ms_played'.
+        limit (int): Number of tracks.
+        period (Period): Only the plays of this period.
+        month (int): Only the plays of this month (1-12) of every year, if given.
+        track_ids (list): Only these tracks, if given (the tracks of the artists filtered on).
+    '''
+    columns = ['id', 'track_id', 'ms_played']
+    mask = frame['track_id'].notna()
+    if period.start:
+        mask &= frame['play_date'] >= period.start
+    if period.after:
+        mask &= frame['play_date'] < period.after
+    if month:
+        mask &= frame['play_month'] == month
+    if track_ids is not None:
+        mask &= frame['track_id'].isin(track_ids)
+    return _rows(_top(_totals(frame.loc[mask.fillna(False), columns], 'track_id', 'track_id'), sort_by, limit))
+
+def top_artists(frame, limit, min_playtime_ms, period=ALL_TIME):
+    '''(artist_id, total_ms_played, total_plays) of the top artists of the period with at least min_playtime_ms, plays without an artist left out.'''
+    frame = _in_period(frame, period, ['id', 'artist_id', 'play_date', 'ms_played'])
+    totals = frame.groupby('artist_id').agg(
+        total_ms_played=('ms_played', 'sum'), total_plays=('id', 'size')
+    ).reset_index()
+    return _rows(_top(totals[totals['total_ms_played'] >= min_playtime_ms], 'total_ms_played', limit))
+
+def artist_timelines(frame, artist_ids, period=ALL_TIME):
+    '''{artist_id: [(date, play_count, total_ms_played), ...]} per day of the period, in one pass over the snapshot.'''
+    frame = _in_period(frame, period, ['id', 'artist_id', 'play_date', 'ms_played'])
+    plays = frame.loc[frame['artist_id'].isin(artist_ids), ['id', 'artist_id', 'play_date', 'ms_played']]
+    totals = plays.groupby(['artist_id', 'play_date'], sort=True).agg(
+        play_count=('id', 'size'), total_ms_played=('ms_played', 'sum')
+    ).reset_index().rename(columns={'play_date': 'date'})
+    timelines = {artist_id: [] for artist_id in artist_ids}
+    for row in _rows(totals):
+        timelines[row.artist_id].append(row[1:])
+    return timelines
@@ -0,0 +1,629 @@
+import os, re, json, time, hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from operator import itemgetter
+from multiprocessing import Manager
+from queue import Empty
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.exc import IntegrityError
+
+from app.config import Config
+from app.database import engine
+from app.models import StreamingHistory, ImportedFile, Artist, Album, Track
+from app.partitions import create_partition, next_history_id
+from app.rollups import update_rollups
+
+history_table = StreamingHistory.__table__
+manifest_table = ImportedFile.__table__
+
+# Columns computed from 'ts' at import, see time_columns
+TIME_COLUMNS = ('ts_ms', 'play_date', 'play_year', 'play_month', 'play_hour', 'play_weekday')
+# Keys into the artists/albums/tracks tables, resolved by the writer, see resolve_dimensions
+DIMENSION_COLUMNS = ('artist_id', 'album_id', 'track_id')
+# Every column that comes straight from the export, in table order ('id' is generated by SQLite)
+HISTORY_COLUMNS = [
+    column.name for column in history_table.columns
+    if column.name != 'id' and column.name not in TIME_COLUMNS + DIMENSION_COLUMNS
+]
+# Fields of the export that are only stored in the dimension tables, read to resolve the DIMENSION_COLUMNS
+DIMENSION_FIELDS = tuple(StreamingHistory.DIMENSION_FIELDS)
+# Plays are inserted with a hand-written statement and plain tuples: SQLAlchemy's per-row
+# parameter processing costs more than SQLite itself on a bulk load
+INSERT_COLUMNS = HISTORY_COLUMNS + list(TIME_COLUMNS) + list(DIMENSION_COLUMNS)
+# ON CONFLICT DO NOTHING skips the plays already stored (uq_streaming_history_play_key) and nothing else:
+# unlike OR IGNORE, a NOT NULL or CHECK violation still fails the file instead of dropping the row
+INSERT_HISTORY_SQL = (f"INSERT INTO {history_table.name} ({', '.join(INSERT_COLUMNS)}) "
+                      f"VALUES ({', '.join('?' * len(INSERT_COLUMNS))}) ON CONFLICT DO NOTHING")
+_insert_values = itemgetter(*INSERT_COLUMNS)
+# Year partitions (Config.HISTORY_PARTITIONED) get the id too, it has to be unique across all of them
+PARTITION_INSERT_SQL = (f"INSERT INTO {{table}} (id, {', '.join(INSERT_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * (len(INSERT_COLUMNS) + 1))}) ON CONFLICT DO NOTHING")
+# Flags that are NOT NULL in the table but come as null in older exports
+BOOLEAN_COLUMNS = ('shuffle', 'skipped', 'offline', 'incognito_mode')
+
+# Pragmas used while a file is being loaded:
+#   synchronous = OFF    - no fsync per commit, an import can simply be re-run if the machine dies
+#   temp_store = MEMORY  - temporary b-trees (index building) stay in RAM
+#   cache_size = -65536  - 64 MiB page cache (negative value is in KiB)
+BULK_LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'temp_store': 'MEMORY',
+    'cache_size': '-65536',
+}
+
+# Failures that mark a single file as failed instead of aborting the whole import
+# (json.JSONDecodeError and UnicodeDecodeError are ValueErrors)
+FILE_ERRORS = (ValueError, OSError, IntegrityError)
+
+
+### Incremental JSON parser ###
+# region
+
+_json_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(file_path, buffer_size=None):
+    '''
+    Parse a file holding a single JSON array and yield its items one by one.
+    Only the read buffer and the item being decoded are kept in memory, so memory
+    stays flat no matter how big the file is (unlike json.load).
+
+    Args:
+        file_path (str): The path to the JSON file.
+        buffer_size (int): Characters read at a time, defaults to Config.INGEST_READ_BUFFER.
+
+    Yields:
+        The decoded items of the array, in order.
+
+    Raises:
+        json.JSONDecodeError: If the file is not a well-formed JSON array.
+    '''
+    buffer_size = buffer_size or Config.INGEST_READ_BUFFER
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer, position, eof = '', 0, False
+        # 'start' -> expecting '[', 'first' -> item or ']', 'item' -> item, 'next' -> ',' or ']', 'end' -> only whitespace
+        state = 'start'
+
+        while True:
+            position = _whitespace.match(buffer, position).end()
+            if position == len(buffer): # buffer exhausted, read the next piece of the file
+                if eof:
+                    if state == 'end':
+                        return
+                    raise json.JSONDecodeError('Unexpected end of file', buffer, position)
+                chunk = f.read(buffer_size)
+                buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+                continue
+
+            char = buffer[position]
+            if state == 'end':
+                raise json.JSONDecodeError('Extra data', buffer, position)
+            elif state == 'start':
+                if char != '[':
+                    raise json.JSONDecodeError("Expecting '['", buffer, position)
+                position, state = position + 1, 'first'
+            elif state == 'next':
+                if char == ']':
+                    position, state = position + 1, 'end'
+                    continue
+                if char != ',':
+                    raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                position, state = position + 1, 'item'
+            elif state == 'first' and char == ']':
+                position, state = position + 1, 'end'
+            else:
+                try:
+                    item, end = _json_decoder.raw_decode(buffer, position)
+                    following = _whitespace.match(buffer, end).end()
+                    complete = eof or (following < len(buffer) and buffer[following] in ',]')
+                except json.JSONDecodeError:
+                    complete = False
+                if not complete: # item may continue past the buffer (a cut number still decodes), read more first
+                    if eof:
+                        raise json.JSONDecodeError('Unterminated item', buffer, position)
+                    chunk = f.read(buffer_size)
+                    buffer, position, eof = buffer[position:] + chunk, 0, not chunk
+                    continue
+                yield item
+                position, state = end, 'next'
+
+# endregion
+
+
+### Bulk insert engine ###
+# region
+
+_epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_millisecond = timedelta(milliseconds=1)
+
+def time_columns(ts):
+    '''
+    Derive the typed time columns of a play from its exported timestamp.
+
+    Args:
+        ts (str): UTC timestamp as exported, e.g. '2021-03-04T12:34:56Z'.
+
+    Returns:
+        dict: Values for the TIME_COLUMNS.
+
+    Raises:
+        ValueError: If ts is missing or not a timestamp, so the file fails like any other bad record.
+    '''
+    if not isinstance(ts, str):
+        raise ValueError(f'Invalid ts {ts!r}, expected a timestamp like 2021-03-04T12:34:56Z')
+    played_at = datetime.fromisoformat(ts.replace('Z', '+00:00'))
+    return {
+        'ts_ms': (played_at - _epoch) // _millisecond,
+        'play_date': played_at.date().isoformat(),
+        'play_year': played_at.year,
+        'play_month': played_at.month,
+        'play_hour': played_at.hour,
+        'play_weekday': played_at.isoweekday() % 7, # Sunday = 0, like SQLite's strftime('%w')
+    }
+
+def normalize_record(record):
+    '''
+    Turn a raw record of the Spotify export into a row for the streaming_history table.
+
+    Args:
+        record (dict): Single record from a Streaming_History_Audio_*.json file.
+
+    Returns:
+        dict: Row with the columns of HISTORY_COLUMNS, the DIMENSION_FIELDS and the TIME_COLUMNS derived from 'ts'.
+
+    Raises:
+        ValueError: If the record is not an object or has no valid 'ts'.
+    '''
+    if not isinstance(record, dict):
+        raise ValueError(f'Invalid record {record!r}, expected an object')
+    row = {column: record.get(column) for column in HISTORY_COLUMNS + list(DIMENSION_FIELDS)}
+    for column in BOOLEAN_COLUMNS:
+        row[column] = bool(row[column])
+    row.update(time_columns(row['ts']))
+    return row
+
+def iter_chunks(iterable, size):
+    '''Yield lists of at most `size` items from any iterable, without materializing it.'''
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def ingest_stats(rows_read, rows_inserted, seconds):
+    '''Build the report returned by the ingestion functions.'''
+    return {
+        'rows_read': rows_read,
+        'rows_inserted': rows_inserted,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows_read / seconds) if seconds > 0 else rows_read,
+    }
+
+@contextmanager
+def bulk_load_connection(bind=None):
+    '''
+    Open a connection tuned for bulk loading, with one transaction around the whole block.
+    On SQLite the BULK_LOAD_PRAGMAS are applied for the duration and restored afterwards.
+
+    Args:
+        bind: Engine to connect to, defaults to the main database engine.
+
+    Yields:
+        Connection: Connection inside an open transaction, committed on exit and rolled back on error.
+    '''
+    bind = bind or engine
+    with bind.connect() as connection:
+        previous = {}
+        if bind.dialect.name == 'sqlite': # pragmas can't be changed inside a transaction, so set them first
+            for name, value in BULK_LOAD_PRAGMAS.items():
+                previous[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+                connection.exec_driver_sql(f'PRAGMA {name} = {value}')
+            connection.commit()
+        try:
+            with connection.begin():
+                yield connection
+        finally:
+            for name, value in previous.items():
+                connection.exec_driver_sql(f'PRAGMA {name} = {value}')
+            connection.commit()
+
+def _dimension_ids(connection, table, key_columns, rows_by_key, ids):
+    '''
+    Make sure every key has a row in a dimension table and cache its id.
+
+    Args:
+        connection: Connection with an open transaction.
+        table: artists, albums or tracks table.
+        key_columns (tuple): Columns forming the unique key of the table.
+        rows_by_key (dict): Key tuple -> row to insert if the key doesn't exist yet.
+        ids (dict): Key tuple -> id, the cache of this import, filled in place.
+    '''
+    missing = [key for key in rows_by_key if key not in ids]
+    if not missing:
+        return
+    connection.execute(table.insert().prefix_with('OR IGNORE'), [rows_by_key[key] for key in missing])
+    columns = [table.c[name] for name in key_columns]
+    key = columns[0] if len(columns) == 1 else tuple_(*columns)
+    for batch in iter_chunks(missing, 500): # stay far below SQLite's bound parameter limit
+        values = [row_key[0] for row_key in batch] if len(columns) == 1 else batch
+        for row in connection.execute(select(table.c.id, *columns).where(key.in_(values))):
+            ids[tuple(row[1:])] = row[0]
+
+def resolve_dimensions(rows, connection, ids):
+    '''
+    Fill artist_id, album_id and track_id of a chunk of rows, adding new artists, albums and tracks on the way.
+
+    Args:
+        rows (list): Rows produced by normalize_record, updated in place.
+        connection: Connection with an open transaction.
+        ids (dict): Per-import cache, {'artists': {}, 'albums': {}, 'tracks': {}} at the start.
+    '''
+    artists = {}
+    for row in rows:
+        if name := row['master_metadata_album_artist_name']:
+            artists.setdefault((name,), {'name': name})
+    _dimension_ids(connection, Artist.__table__, ('name',), artists, ids['artists'])
+
+    albums = {}
+    for row in rows:
+        name = row['master_metadata_album_artist_name']
+        row['artist_id'] = ids['artists'][(name,)] if name else None
+        if row['artist_id'] and (album := row['master_metadata_album_album_name']):
+            albums.setdefault((row['artist_id'], album), {'artist_id': row['artist_id'], 'name': album})
+    _dimension_ids(connection, Album.__table__, ('artist_id', 'name'), albums, ids['albums'])
+
+    tracks = {}
+    for row in rows:
+        album = row['master_metadata_album_album_name']
+        row['album_id'] = ids['albums'][(row['artist_id'], album)] if row['artist_id'] and album else None
+        if uri := row['spotify_track_uri']: # the first name seen for a uri is kept
+            tracks.setdefault((uri,), {'uri': uri, 'name': row['master_metadata_track_name'],
+                                       'artist_id': row['artist_id'], 'album_id': row['album_id']})
+    _dimension_ids(connection, Track.__table__, ('uri',), tracks, ids['tracks'])
+
+    for row in rows:
+        uri = row['spotify_track_uri']
+        row['track_id'] = ids['tracks'][(uri,)] if uri else None
+
+def insert_into_partitions(rows, connection, partitions):
+    '''
+    Insert a chunk of rows into the year partitions, creating the ones that don't exist yet.
+
+    Args:
+        rows (list): Rows with their dimension ids resolved.
+        connection: Connection with an open transaction.
+        partitions (dict): Per-import state, {'next_id': None, 'tables': {}} at the start.
+
+    Returns:
+        int: Number of inserted rows.
+    '''
+    if partitions['next_id'] is None:
+        partitions['next_id'] = next_history_id(connection)
+    by_year = {}
+    for row in rows:
+        by_year.setdefault(row['play_year'], []).append(row)
+
+    inserted = 0
+    for year, year_rows in by_year.items():
+        if year not in partitions['tables']:
+            partitions['tables'][year] = PARTITION_INSERT_SQL.format(table=create_partition(connection, year).name)
+        first_id = partitions['next_id']
+        partitions['next_id'] += len(year_rows) # ids of ignored duplicates are simply skipped
+        values = [(first_id + offset,) + _insert_values(row) for offset, row in enumerate(year_rows)]
+        inserted += connection.exec_driver_sql(partitions['tables'][year], values).rowcount
+    return inserted
+
+def bulk_insert_history(rows, connection, chunk_size=None, progress=None):
+    '''
+    Insert normalized rows into streaming_history with one executemany per chunk.
+    Skips the ORM unit of work entirely, so no StreamingHistory objects are created.
+    Plays that are already stored (same natural key) are ignored. Artist, album and track ids
+    are resolved chunk by chunk, see resolve_dimensions. With Config.HISTORY_PARTITIONED the rows
+    go to the year partitions instead, see insert_into_partitions.
+
+    Args:
+        rows (iterable): Rows produced by normalize_record, can be a generator.
+        connection: Connection with an open transaction, see bulk_load_connection.
+        chunk_size (int): Rows per executemany call, defaults to Config.INGEST_CHUNK_SIZE.
+        progress: Optional progress listener, its rows_stored(read, inserted) is called after every chunk.
+
+    Returns:
+        dict: Rows read and inserted, elapsed seconds and rows per second.
+    '''
+    chunk_size = chunk_size or Config.INGEST_CHUNK_SIZE
+    started = time.perf_counter()
+    read = inserted = 0
+    ids = {'artists': {}, 'albums': {}, 'tracks': {}}
+    partitions = {'next_id': None, 'tables': {}}
+    for chunk in iter_chunks(rows, chunk_size):
+        resolve_dimensions(chunk, connection, ids)
+        if Config.HISTORY_PARTITIONED:
+            chunk_inserted = insert_into_partitions(chunk, connection, partitions)
+        else:
+            chunk_inserted = connection.exec_driver_sql(INSERT_HISTORY_SQL, [_insert_values(row) for row in chunk]).rowcount
+        read += len(chunk)
+        inserted += chunk_inserted
+        if progress:
+            progress.rows_stored(len(chunk), chunk_inserted)
+    return ingest_stats(read, inserted, time.perf_counter() - started)
+
+# endregion
+
+
+### Store json file to db ###
+# region
+
+def store_streaming_history(data, bind=None, chunk_size=None):
+    '''
+    Store streaming history data in the database, in a single transaction.
+
+    Args:
+        data (list): List of streaming history records.
+        bind: Engine to store into, defaults to the main database engine.
+        chunk_size (int): Rows per executemany call, defaults to Config.INGEST_CHUNK_SIZE.
+
+    Returns:
+        dict: Rows read and inserted, elapsed seconds and rows per second.
+    '''
+    with bulk_load_connection(bind) as connection:
+        return bulk_insert_history(map(normalize_record, data), connection, chunk_size)
+
+def iter_history_rows(file_path):
+    '''
+    Read an export file and yield normalized rows. With Config.INGEST_STREAM_JSON the file
+    is parsed incrementally, otherwise it is loaded whole with json.load.
+
+    Args:
+        file_path (str): The path to the JSON file to read.
+
+    Yields:
+        dict: Rows produced by normalize_record.
+    '''
+    if Config.INGEST_STREAM_JSON:
+        records = iter_json_array(file_path)
+    else:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            records = json.load(f)
+    for record in records:
+        yield normalize_record(record)
+
+def file_fingerprint(file_path):
+    '''
+    Identify an export file by name, size and content hash, for the import manifest.
+
+    Returns:
+        dict: 'file_name', 'size' and 'sha256' of the file.
+    '''
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while block := f.read(1024 * 1024):
+            sha256.update(block)
+    return {
+        'file_name': os.path.basename(file_path),
+        'size': os.path.getsize(file_path),
+        'sha256': sha256.hexdigest(),
+    }
+
+def is_imported(fingerprint, bind=None):
+    '''Check the manifest for a file with the same name, size and content hash.'''
+    with (bind or engine).connect() as connection:
+        return connection.execute(
+            select(manifest_table.c.id).filter_by(**fingerprint).limit(1)
+        ).first() is not None
+
+def process_json_file(file_path, bind=None, rows=None, fingerprint=None, progress=None):
+    '''
+    Process a single JSON file and store the data in the database.
+    Files listed in the import manifest are skipped, and the manifest entry is written
+    in the same transaction as the rows.
+
+    Args:
+        file_path (str): The path to the JSON file to process.
+        bind: Engine to store into, defaults to the main database engine.
+        rows (iterable): Rows of the file when they were already parsed elsewhere (parallel import).
+        fingerprint (dict): Result of file_fingerprint if the caller already computed it.
+        progress: Optional progress listener (see app.utils.job_utils.ImportJob), told about
+            stored chunks and about the file being finished.
+
+    Returns:
+        bool: True if the process is successful (or the file was already imported), False otherwise.
+    '''
+    success = _store_json_file(file_path, bind, rows, fingerprint, progress)
+    if progress:
+        progress.file_finished(os.path.basename(file_path), success)
+    return success
+
+def _store_json_file(file_path, bind, rows, fingerprint, progress):
+    '''Body of process_json_file, without the progress bookkeeping.'''
+    file_name = os.path.basename(file_path)
+    try:
+        fingerprint = fingerprint or file_fingerprint(file_path)
+        if is_imported(fingerprint, bind):
+            logging.info(f"{file_name} is unchanged since the last import, skipped.")
+            return True
+
+        rows = iter_history_rows(file_path) if rows is None else rows
+        with bulk_load_connection(bind) as connection: # a parse error halfway through rolls back the whole file
+            stats = bulk_insert_history(rows, connection, progress=progress)
+            connection.execute(manifest_table.insert(), {
+                **fingerprint,
+                'rows_read': stats['rows_read'],
+                'rows_inserted': stats['rows_inserted'],
+            })
+        logging.info(f"Data from {file_name} stored successfully: {stats['rows_inserted']} new of "
+                     f"{stats['rows_read']} rows, {stats['rows_per_second']} rows/s.")
+        return True
+    except FILE_ERRORS as e:
+        logging.error(f"Error processing {file_name}: {e}")
+        return False
+
+def list_export_files(json_directory):
+    '''Paths of the Streaming_History_Audio_{year}.json files of an export directory, oldest year first.'''
+    return [
+        os.path.join(json_directory, file_name)
+        for file_name in sorted(os.listdir(json_directory))
+        if file_name.startswith("Streaming_History_Audio_") and file_name.endswith(".json")
+    ]
+
+def read_json_and_store_data(json_directory, bind=None, workers=None, progress=None):
+    '''
+    Process every Streaming_History_Audio_*.json file of an export directory and store the data in the database.
+    Files that are in the import manifest already are skipped without being parsed.
+
+    Args:
+        json_directory (str): The path to the directory with the exported JSON files.
+        bind: Engine to store into, defaults to the main database engine.
+        workers (int): Parse processes, defaults to Config.INGEST_WORKERS (1 = serial, 0 = one per core).
+        progress: Optional progress listener, see process_json_file.
+
+    Returns:
+        bool: True if every file was stored successfully, False otherwise.
+    '''
+    files = []
+    for file_path in list_export_files(json_directory):
+        fingerprint = file_fingerprint(file_path)
+        if is_imported(fingerprint, bind):
+            logging.info(f"{fingerprint['file_name']} is unchanged since the last import, skipped.")
+            if progress:
+                progress.file_finished(fingerprint['file_name'], True)
+        else:
+            files.append((file_path, fingerprint))
+
+    workers = Config.INGEST_WORKERS if workers is None else workers
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    try:
+        if workers > 1:
+            success = import_files_parallel(files, bind, workers, progress)
+        else:
+            success = True
+            for file_path, fingerprint in files:
+                if not process_json_file(file_path, bind, fingerprint=fingerprint, progress=progress):
+                    success = False
+    finally:
+        if files: # even if the import was cut short, the files committed before are in the history
+            refresh_derived_data(bind or engine)
+    return success
+
+def refresh_derived_data(bind):
+    '''
+    Bring everything derived from the plays up to date after an import: rollups, planner
+    statistics, the history snapshot, the data generation and the prefix sums.
+    '''
+    update_rollups(bind)
+    analyze_history(bind)
+    from app.summaries import bump_generation # imports the flask cache, not needed by parse workers
+    generation = bump_generation(bind) # cached summaries are recomputed from the complete import
+    if Config.ANALYTICS_BACKEND == 'columnar': # otherwise rebuilt on first use, see app.snapshots.load_snapshot
+        from app.snapshots import write_snapshot
+        write_snapshot(bind, generation)
+    if Config.PREFIX_SUMS:
+        from app.prefix_sums import write_prefix_sums
+        write_prefix_sums(bind, generation) # ready before the first top-K request of the generation
+
+def analyze_history(bind=None):
+    '''
+    Refresh the planner statistics after an import, so SQLite keeps choosing the right index
+    of app.models.HISTORY_INDEXES as the table grows. A full ANALYZE, the sampled one
+    (analysis_limit) gives estimates noisy enough to flip plans between runs.
+    '''
+    bind = bind or engine
+    if bind.dialect.name != 'sqlite':
+        return
+    with bind.connect() as connection:
+        connection.exec_driver_sql('ANALYZE')
+        connection.commit()
+
+# endregion
+
+
+### Parallel import ###
+# region
+
+def _parse_into_queue(file_path, queue, chunk_size):
+    '''
+    Process pool task: decode and normalize one file and hand the rows to the writer in chunks.
+    Always ends with a ('done', None) or ('error', exception) message.
+    '''
+    try:
+        for chunk in iter_chunks(iter_history_rows(file_path), chunk_size):
+            queue.put(('rows', chunk))
+    except Exception as e: # reported by the writer as a failed file
+        queue.put(('error', e))
+    else:
+        queue.put(('done', None))
+
+def _next_message(queue, future):
+    '''Wait for the next message of a parse task, failing instead of hanging if its process died.'''
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if future.done() and queue.empty():
+                raise future.exception() or RuntimeError('Parse worker exited without finishing its file')
+
+def _drain_queue(queue, future):
+    '''
+    Yield the rows a parse task puts on its queue, re-raising its error if parsing failed.
+    If the writer stops early, closing the generator discards the rest so the task never blocks on a full queue.
+    '''
+    finished = False
+    try:
+        while True:
+            kind, payload = _next_message(queue, future)
+            if kind == 'rows':
+                yield from payload
+                continue
+            finished = True
+            if kind == 'error':
+                raise payload
+            return
+    finally:
+        try:
+            while not finished:
+                finished = _next_message(queue, future)[0] != 'rows'
+        except Exception: # the task failed or its process died, nothing is left to unblock
+            pass
+
+def import_files_parallel(files, bind=None, workers=None, progress=None):
+    '''
+    Import export files with decoding and normalization spread over a process pool.
+    A single writer (this process) stores the files one by one, in order, each in its own
+    transaction, so SQLite only ever sees one writer. Every file gets a bounded queue, which
+    caps how far the workers can get ahead of the writer and keeps memory flat.
+
+    Args:
+        files (list): (file path, fingerprint) pairs of the export files to import.
+        bind: Engine to store into, defaults to the main database engine.
+        workers (int): Number of parse processes, defaults to one per core.
+        progress: Optional progress listener, see process_json_file.
+
+    Returns:
+        bool: True if every file was stored successfully, False otherwise.
+    '''
+    success = True
+    # the manager shuts down first, so if the writer crashes the workers blocked on its queues fail instead of hanging
+    with ProcessPoolExecutor(max_workers=workers) as pool, Manager() as manager:
+        tasks = []
+        for file_path, fingerprint in files: # tasks start in this order, so the file the writer waits for is always running
+            queue = manager.Queue(maxsize=Config.INGEST_QUEUE_SIZE)
+            future = pool.submit(_parse_into_queue, file_path, queue, Config.INGEST_CHUNK_SIZE)
+            tasks.append((file_path, fingerprint, queue, future))
+
+        for file_path, fingerprint, queue, future in tasks:
+            rows = _drain_queue(queue, future)
+            try:
+                if not process_json_file(file_path, bind, rows, fingerprint, progress):
+                    success = False
+            except Exception as e: # a failure of the parse task itself fails its file only, like FILE_ERRORS
+                file_name = os.path.basename(file_path)
+                logging.error(f"Error processing {file_name}: {e}")
+                if progress:
+                    progress.file_finished(file_name, False)
+                success = False
+            finally:
+                rows.close()
+    return success
+
+# endregion
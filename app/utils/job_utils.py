@@ -0,0 +1,164 @@
+import os, time, uuid, shutil, zipfile
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Config
+from app.utils.ingest_utils import read_json_and_store_data
+
+# One import at a time: SQLite takes a single writer anyway, and a queued job
+# costs nothing but the spooled upload on disk.
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-import')
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+class ImportJob:
+    '''
+    Progress of one background import. Written by the import thread through the
+    progress hooks of app.utils.ingest_utils, read by the status endpoint.
+    '''
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.directory = os.path.join(Config.IMPORT_UPLOAD_DIR, self.id)
+        self.state = 'queued' # queued -> running -> done | failed
+        self.error = None
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = []
+        self.rows_read = 0
+        self.rows_inserted = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._file_rows = [0, 0] # rows of the file being stored, taken back if it gets rolled back
+        self._lock = threading.Lock()
+
+    # progress hooks
+    def rows_stored(self, rows_read, rows_inserted):
+        with self._lock:
+            self.rows_read += rows_read
+            self.rows_inserted += rows_inserted
+            self._file_rows[0] += rows_read
+            self._file_rows[1] += rows_inserted
+
+    def file_finished(self, file_name, success):
+        with self._lock:
+            self.files_done += 1
+            if not success:
+                self.files_failed.append(file_name)
+                self.rows_read -= self._file_rows[0]
+                self.rows_inserted -= self._file_rows[1]
+            self._file_rows = [0, 0]
+
+    def start(self):
+        with self._lock:
+            self.state, self.started_at = 'running', time.time()
+
+    def finish(self, state, error=None):
+        with self._lock:
+            self.state, self.error = state, error
+            self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+            return {
+                'job_id': self.id,
+                'state': self.state,
+                'error': self.error,
+                'files_total': self.files_total,
+                'files_done': self.files_done,
+                'files_failed': list(self.files_failed),
+                'rows_read': self.rows_read,
+                'rows_inserted': self.rows_inserted,
+                'elapsed_seconds': round(elapsed, 3),
+                'rows_per_second': round(self.rows_read / elapsed) if elapsed > 0 else 0,
+            }
+
+    def __repr__(self) -> str:
+        return f'<ImportJob {self.id} - {self.state}, {self.files_done}/{self.files_total} files>'
+
+
+def create_import_job():
+    '''Register a new job and create its spool directory. Only the newest Config.IMPORT_JOBS_KEPT jobs are kept.'''
+    job = ImportJob()
+    os.makedirs(job.directory, exist_ok=True)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        finished = [key for key, old in _jobs.items() if old.finished_at]
+        for key in finished[:max(0, len(_jobs) - Config.IMPORT_JOBS_KEPT)]:
+            del _jobs[key]
+    return job
+
+def get_import_job(job_id):
+    '''Return the job with this id, or None if it doesn't exist (anymore).'''
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def discard_import_job(job):
+    '''Forget a job that was never started and delete its spool directory.'''
+    with _jobs_lock:
+        _jobs.pop(job.id, None)
+    shutil.rmtree(job.directory, ignore_errors=True)
+
+def extract_export(zip_path, target_directory):
+    '''
+    Extract the Streaming_History_Audio_*.json files of a Spotify export ZIP.
+    Folders inside the archive are flattened, every other file is ignored. A name already taken
+    by a file of another folder gets a number (Streaming_History_Audio_2021_2.json), so no file
+    overwrites another.
+
+    Args:
+        zip_path (str): The path to the uploaded ZIP.
+        target_directory (str): Where to put the JSON files.
+
+    Returns:
+        int: Number of extracted files.
+    '''
+    extracted = set()
+    with zipfile.ZipFile(zip_path) as archive:
+        for member in archive.infolist():
+            file_name = os.path.basename(member.filename) # never trust paths from the archive
+            if not (file_name.startswith("Streaming_History_Audio_") and file_name.endswith(".json")):
+                continue
+            stem, number = file_name.removesuffix('.json'), 1
+            while file_name in extracted:
+                number += 1
+                file_name = f'{stem}_{number}.json'
+            if number > 1:
+                logging.warning(f'{member.filename} has the name of another file of the archive, extracted as {file_name}')
+            with archive.open(member) as source, open(os.path.join(target_directory, file_name), 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+            extracted.add(file_name)
+    return len(extracted)
+
+def run_import_job(job, zip_path, bind=None):
+    '''
+    Extract the uploaded export and import it, recording progress on the job.
+    The spool directory is removed when the job is over, whatever the outcome.
+    '''
+    job.start()
+    try:
+        export_directory = os.path.join(job.directory, 'export')
+        os.makedirs(export_directory, exist_ok=True)
+        job.files_total = extract_export(zip_path, export_directory)
+        os.remove(zip_path)
+        if not job.files_total:
+            job.finish('failed', 'No Streaming_History_Audio_*.json files in the archive')
+            return
+
+        read_json_and_store_data(export_directory, bind, progress=job)
+        job.finish('done')
+        logging.info(f'Import job {job.id} finished: {job.to_dict()}')
+    except Exception as e:
+        logging.exception(f'Import job {job.id} failed')
+        job.finish('failed', str(e))
+    finally:
+        shutil.rmtree(job.directory, ignore_errors=True)
+
+def start_import_job(job, zip_path, bind=None):
+    '''Queue the import of an uploaded export ZIP on the background worker.'''
+    _executor.submit(run_import_job, job, zip_path, bind)
@@ -0,0 +1,93 @@
+'''
+Date periods of the analytics endpoints (start/end, year, month, date arguments).
+
+A period is a half-open range of days, [start, after), compared against an indexed column:
+play_date of the plays and of the daily rollups ('YYYY-MM-DD' strings sort like the dates), or
+ts_ms as epoch milliseconds. Unlike year/month/day extracted from a timestamp, a range lets SQLite
+read just the period from the index, and with year partitions the period also picks the partitions
+(history_source(start=period.start, end=period.end)).
+'''
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+from flask import request
+
+# start: first day, end: last day, after: day after the last one ('YYYY-MM-DD', None when open)
+Period = namedtuple('Period', ['start', 'end', 'after'])
+
+ALL_TIME = Period(None, None, None)
+
+
+def _day(value):
+    '''Parse a YYYY-MM-DD argument.'''
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError('Invalid date format. Use YYYY-MM-DD') from None
+
+def request_period(month_of_every_year=False):
+    '''
+    The period asked for by the request's arguments, all optional:
+        start: first day to include (YYYY-MM-DD)
+        end: last day to include (YYYY-MM-DD)
+        year: only this year; with month, only this month of it
+        month: only with year, a month of every year is no range of days
+        date: only this day (YYYY-MM-DD)
+    Given together, the period is the days they have in common.
+
+    Args:
+        month_of_every_year (bool): Accept a month without a year, for the endpoints filtering
+            on it themselves; the period leaves it out.
+
+    Returns:
+        Period
+
+    Raises:
+        ValueError: on a malformed argument, with the message for the client.
+    '''
+    start = request.args.get('start', type=str)
+    end = request.args.get('end', type=str)
+    year = request.args.get('year', type=int)
+    month = request.args.get('month', type=int)
+    day = request.args.get('date', type=str)
+
+    first = _day(start) if start else None
+    after = _day(end) + timedelta(days=1) if end else None
+    if month and not 1 <= month <= 12:
+        raise ValueError('Invalid month, expected 1-12')
+    if month and not year and not month_of_every_year:
+        raise ValueError('Invalid month, month requires year')
+    ranges = []
+    if year:
+        if month:
+            ranges.append((date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)))
+        else:
+            ranges.append((date(year, 1, 1), date(year + 1, 1, 1)))
+    if day:
+        ranges.append((_day(day), _day(day) + timedelta(days=1)))
+    for range_first, range_after in ranges:
+        first = max(first, range_first) if first else range_first
+        after = min(after, range_after) if after else range_after
+
+    if first and after and after <= first: # nothing in common, an empty period
+        after = first
+    return Period(
+        first.isoformat() if first else None,
+        (after - timedelta(days=1)).isoformat() if after else None,
+        after.isoformat() if after else None,
+    )
+
+def in_period(column, period):
+    '''Conditions keeping a 'YYYY-MM-DD' column (play_date) within the period: start <= column < after.'''
+    conditions = []
+    if period.start:
+        conditions.append(column >= period.start)
+    if period.after:
+        conditions.append(column < period.after)
+    return conditions
+
+def period_ms(period):
+    '''The period as epoch milliseconds, (first ms or None, first ms after it or None), for ts_ms.'''
+    def ms(day):
+        return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000) if day else None
+    return ms(period.start), ms(period.after)
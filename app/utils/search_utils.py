@@ -0,0 +1,72 @@
+'''
+Name search over the artists/albums/tracks tables, answered by their trigram FTS5 indexes
+(<table>_fts, created and kept up to date by app.models.name_search_ddl).
+
+The trigram tokenizer matches any substring of 3+ characters, case-insensitively, straight
+from the index. Shorter queries have no trigram to look up; they still work, FTS5 scans its
+(small) index then.
+'''
+from sqlalchemy import column, func, select, table
+
+from app.config import Config
+from app.models import Artist, Album, Track
+from app.shards import history_session
+
+# Searchable dimensions by the name used in the API
+SEARCH_DIMENSIONS = {'artist': Artist, 'album': Album, 'track': Track}
+
+
+def name_index(dimension):
+    '''Lightweight table of a dimension's FTS index; rowid is the dimension id.'''
+    return table(f'{dimension.__tablename__}_fts', column('rowid'), column('name'), column('rank'))
+
+def name_matches(dimension, name):
+    '''
+    Select of the ids whose name contains `name`. Same matches as `dimension.name.ilike('%name%')`,
+    but from the trigram index instead of a scan of the dimension table.
+    '''
+    index = name_index(dimension)
+    return select(index.c.rowid).where(index.c.name.like(f'%{name}%'))
+
+def matching_ids(dimension, name):
+    '''
+    Ids of the artists/albums/tracks whose name contains `name`, for an IN filter on the history.
+    A subquery of the name index (name_matches) normally; with
+    year partitions the ids are looked up first, SQLite only pushes plain values down into the
+    branches of the partition union.
+    '''
+    ids = name_matches(dimension, name)
+    if Config.HISTORY_PARTITIONED:
+        return history_session.scalars(ids).all()
+    return ids
+
+def _phrase(query):
+    '''FTS5 string literal of the query, so operators and quotes in it are searched for as text.'''
+    return '"' + query.replace('"', '""') + '"'
+
+def search_names(session, dimension, query, limit=20, offset=0):
+    '''
+    Ranked page of the names containing `query`.
+    Queries of 3+ characters are ranked by bm25 (closer, shorter names first), shorter ones
+    by name length.
+
+    Args:
+        session: Session of the database to search.
+        dimension: Artist, Album or Track.
+        query (str): Text to search for.
+        limit (int): Page size.
+        offset (int): Number of matches to skip.
+
+    Returns:
+        tuple: (total number of matches, [(id, name), ...] of the page)
+    '''
+    index = name_index(dimension)
+    if len(query) >= 3:
+        condition, order = index.c.name.op('MATCH')(_phrase(query)), [index.c.rank]
+    else:
+        condition, order = index.c.name.like(f'%{query}%'), [func.length(index.c.name)]
+    total = session.scalar(select(func.count()).select_from(index).where(condition))
+    page = session.execute(
+        select(index.c.rowid, index.c.name).where(condition).order_by(*order, index.c.rowid).limit(limit).offset(offset)
+    ).all()
+    return total, page
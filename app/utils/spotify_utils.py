@@ -1,4 +1,12 @@
-from app.utils.utils import *
+import logging
+
+from sqlalchemy.dialects.sqlite import insert
+
+from app.database import db_session
+from app.utils.utils import cache, cache_results, get_user_id, process_track
+from app.models import TrackMetadata
+
+SPOTIFY_TRACKS_BATCH = 50 # most ids the tracks endpoint takes per call
 
 
 def get_play_history(sp, limit=50):
@@ -193,3 +201,38 @@ def select_saved_tracks(sp, year = None):
         cache_results(cache_key, results)
     
     return results
+
+def get_track_metadata(uris, spotify_client):
+    '''
+    Album image and album url of tracks, from the track_metadata table of the main database.
+    Tracks not stored yet are fetched with the batch tracks endpoint, 50 per call, and stored,
+    so they are never asked for again.
+
+    Args:
+        uris: Spotify track uris ('spotify:track:<id>').
+        spotify_client: Callable returning an authenticated Spotipy client, only called if something is missing.
+
+    Returns:
+        dict: uri -> {'album_image_url': ..., 'spotify_url': ...}, None values for tracks Spotify doesn't know.
+    '''
+    uris = list(dict.fromkeys(uris))
+    stored = db_session.query(TrackMetadata).filter(TrackMetadata.uri.in_(uris)).all()
+    metadata = {track.uri: {'album_image_url': track.album_image_url, 'spotify_url': track.spotify_url} for track in stored}
+
+    missing = [uri for uri in uris if uri not in metadata]
+    if missing:
+        sp = spotify_client()
+        for start in range(0, len(missing), SPOTIFY_TRACKS_BATCH):
+            batch = missing[start:start + SPOTIFY_TRACKS_BATCH]
+            tracks = sp.tracks([uri.replace('spotify:track:', '') for uri in batch])['tracks']
+            for uri, track in zip(batch, tracks): # same order as asked, None for unknown ids
+                album = track['album'] if track else {}
+                images = album.get('images') or [{}]
+                metadata[uri] = {'album_image_url': images[0].get('url'), 'spotify_url': album.get('external_urls', {}).get('spotify')}
+        db_session.execute(
+            insert(TrackMetadata).on_conflict_do_nothing(), # another request may have stored some meanwhile
+            [{'uri': uri, **metadata[uri]} for uri in missing]
+        )
+        db_session.commit()
+        logging.info(f'Fetched the metadata of {len(missing)} tracks from Spotify.')
+    return metadata
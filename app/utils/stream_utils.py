@@ -0,0 +1,85 @@
+'''
+Streamed JSON responses: the body is written item by item while the query is still being read,
+so an endpoint never holds its whole result (or its serialized form) in memory, and the client
+gets the first bytes right away.
+
+Plain query rows (e.g. the play records) skip the per-object path altogether: the *_rows_response
+variants take the rows in chunks, as read from the database, and encode each chunk with orjson in
+one call.
+'''
+import orjson
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    '''True if the request asks for NDJSON, with ?format=ndjson or an Accept header.'''
+    if 'format' in request.args:
+        return request.args['format'] == 'ndjson'
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def ndjson_response(items, headers=None):
+    '''Stream items as newline delimited JSON, one object per line.'''
+    dumps = current_app.json.dumps
+
+    def generate():
+        for item in items:
+            yield dumps(item) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers=headers)
+
+def ndjson_rows_response(chunks, columns, headers=None):
+    '''
+    Stream rows as newline delimited JSON objects, {column: value} per line.
+
+    Args:
+        chunks: Iterable of lists of row tuples, e.g. Result.partitions().
+        columns (list): Names of the row's values, the keys of the objects.
+        headers (dict): Extra response headers.
+    '''
+    def generate():
+        for chunk in chunks:
+            yield b''.join(orjson.dumps(dict(zip(columns, row)), option=orjson.OPT_APPEND_NEWLINE) for row in chunk)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE, headers=headers)
+
+def json_response(items, key, headers=None, **fields):
+    '''
+    Stream `{key: [item, ...], **fields}` as chunked JSON.
+
+    Args:
+        items: Iterable of JSON serializable items, consumed while the response is sent.
+        key (str): Name of the array.
+        headers (dict): Extra response headers.
+        **fields: Values written after the array; a callable is called once the items are consumed,
+                  for values only known at the end (e.g. the cursor of the next page).
+    '''
+    dumps = current_app.json.dumps
+    return _json_object((dumps(item) for item in items), key, headers, fields)
+
+def json_rows_response(chunks, columns, key, headers=None, **fields):
+    '''
+    Stream `{key: [{column: value, ...} per row], **fields}` as chunked JSON, see ndjson_rows_response
+    for the arguments and json_response for `fields`.
+    '''
+    # orjson encodes a chunk as one array, its brackets are dropped to splice it into the streamed one
+    encoded = (orjson.dumps([dict(zip(columns, row)) for row in chunk])[1:-1] for chunk in chunks if chunk)
+    return _json_object(encoded, key, headers, fields)
+
+def _json_object(elements, key, headers, fields):
+    '''Response streaming {key: [elements], **fields}, the elements being encoded JSON already.'''
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{' + dumps(key) + ': ['
+        for number, element in enumerate(elements):
+            if number:
+                yield ','
+            yield element
+        yield ']'
+        for name, value in fields.items():
+            yield ', ' + dumps(name) + ': ' + dumps(value() if callable(value) else value)
+        yield '}\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/json', headers=headers)
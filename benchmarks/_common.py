@@ -0,0 +1,98 @@
+'''
+Shared helpers for the benchmark scripts.
+
+Importing this module points the app at a throwaway SQLite database (DATABASE_URL),
+so `import app...` never touches app/data. Run the scripts from the repository root:
+
+    python -m benchmarks.bench_ingest
+'''
+import os, json, random, tempfile, time
+from datetime import datetime, timedelta, timezone
+
+WORK_DIR = tempfile.mkdtemp(prefix='spotistat-bench-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(WORK_DIR, 'streaming_history.db')}")
+
+PLATFORMS = ['Android OS 11 API 30 (Xiaomi)', 'Windows 10 (10.0.19045; x64)', 'Linux [x86 0]', 'iOS 16.1 (iPhone14,5)']
+REASONS_END = ['trackdone', 'fwdbtn', 'endplay', 'backbtn', 'logout', 'unexpected-exit']
+
+
+def synthetic_records(count, seed=0, tracks=5000, artists=800, start=datetime(2014, 1, 1, tzinfo=timezone.utc)):
+    '''
+    Generate records shaped like the Spotify extended streaming history export.
+
+    Args:
+        count (int): Number of records to generate.
+        seed (int): Seed so every run produces the same data.
+        tracks (int): Number of distinct tracks.
+        artists (int): Number of distinct artists.
+        start (datetime): Timestamp of the first play.
+
+    Yields:
+        dict: One play, ordered by 'ts'.
+    '''
+    rng = random.Random(seed)
+    ts = start
+    for _ in range(count):
+        # back-to-back plays with the occasional break of a few hours between listening sessions
+        ts += timedelta(seconds=rng.randint(3_600, 43_200) if rng.random() < 0.05 else rng.randint(30, 400))
+        track = rng.randint(0, tracks - 1)
+        artist = track % artists
+        skipped = rng.random() < 0.2
+        yield {
+            'ts': ts.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'username': 'benchmark',
+            'platform': rng.choice(PLATFORMS),
+            'ms_played': rng.randint(1_000, 300_000),
+            'conn_country': 'UA',
+            'ip_addr_decrypted': '127.0.0.1',
+            'user_agent_decrypted': 'unknown',
+            'master_metadata_track_name': f'Track {track}',
+            'master_metadata_album_artist_name': f'Artist {artist}',
+            'master_metadata_album_album_name': f'Album {track // 10}',
+            'spotify_track_uri': f'spotify:track:{track:022d}',
+            'episode_name': None,
+            'episode_show_name': None,
+            'spotify_episode_uri': None,
+            'reason_start': 'trackdone',
+            'reason_end': 'fwdbtn' if skipped else rng.choice(REASONS_END),
+            'shuffle': rng.random() < 0.5,
+            'skipped': skipped if rng.random() < 0.9 else None,
+            'offline': False,
+            'offline_timestamp': int(ts.timestamp()),
+            'incognito_mode': False,
+        }
+
+def write_export(directory, count, seed=0):
+    '''
+    Write synthetic records as Streaming_History_Audio_{year}.json files, one per year like the real export.
+
+    Returns:
+        list: Paths of the written files.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    by_year = {}
+    for record in synthetic_records(count, seed):
+        by_year.setdefault(record['ts'][:4], []).append(record)
+
+    paths = []
+    for year, records in sorted(by_year.items()):
+        path = os.path.join(directory, f'Streaming_History_Audio_{year}.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=4)
+        paths.append(path)
+    return paths
+
+def fresh_engine(name):
+    '''Create an empty database with the app schema inside the benchmark work directory.'''
+    from sqlalchemy import create_engine
+    from app.database import init_db
+
+    bench_engine = create_engine(f"sqlite:///{os.path.join(WORK_DIR, name)}")
+    init_db(bench_engine)
+    return bench_engine
+
+def timed(function, *args, **kwargs):
+    '''Call function and return (result, elapsed seconds).'''
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - started
@@ -0,0 +1,63 @@
+'''
+Response time of the trend/top endpoints, SQL backend vs the columnar one
+(Config.ANALYTICS_BACKEND, pandas over the memory-mapped Arrow snapshot of app/snapshots.py).
+Also checks that both backends return the same data.
+
+    python -m benchmarks.bench_analytics [rows] [repeat]
+'''
+import os, sys
+
+from benchmarks._common import WORK_DIR, write_export, timed
+
+from app import create_app
+from app.config import Config
+from app.database import engine
+from app.snapshots import write_snapshot, load_snapshot
+from app.utils.ingest_utils import read_json_and_store_data
+import app.blueprints.db.utils as db_utils
+
+URLS = [
+    '/db/history/hourly-trends',
+    '/db/history/weekly-trends',
+    '/db/history/daily-trends',
+    '/db/history/daily-trends?start=2016-01-01&end=2016-12-31',
+    '/db/history/top-tracks?limit=10',
+    '/db/history/top-tracks?year=2016&sort_by=play_count',
+    '/db/history/top-tracks?artist=Artist 77',
+    '/db/history/artists/top?limit=10',
+]
+
+
+class OfflineSpotify:
+    '''Answers the album lookups of top-tracks without calling the Spotify API.'''
+    def tracks(self, track_ids):
+        return {'tracks': [{'album': {'images': [{'url': ''}], 'external_urls': {'spotify': ''}}} for _ in track_ids]}
+
+
+def main(rows=500_000, repeat=5):
+    write_export(os.path.join(WORK_DIR, 'export'), rows)
+    read_json_and_store_data(os.path.join(WORK_DIR, 'export'))
+    _, seconds = timed(write_snapshot, engine)
+    print(f'{rows} rows, snapshot written in {seconds:.2f}s')
+    _, seconds = timed(load_snapshot, engine)
+    print(f'snapshot mapped in {seconds * 1000:.1f}ms\n')
+
+    app = create_app()
+    app.config['TESTING'] = True
+    db_utils.get_spotify_client = OfflineSpotify
+    client = app.test_client()
+
+    for url in URLS:
+        results = {}
+        for backend in ('sql', 'columnar'):
+            Config.ANALYTICS_BACKEND = backend
+            response = client.get(url) # warm up: page cache, snapshot load
+            results[backend] = (response.get_json(), min(timed(client.get, url)[1] for _ in range(repeat)))
+        (sql, sql_seconds), (columnar, columnar_seconds) = results['sql'], results['columnar']
+        same = 'same' if sql == columnar else 'DIFFERENT'
+        print(f'{url:60} sql {sql_seconds * 1000:8.1f}ms  columnar {columnar_seconds * 1000:8.1f}ms'
+              f'  x{sql_seconds / columnar_seconds:5.2f}  {same}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
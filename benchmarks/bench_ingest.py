@@ -0,0 +1,39 @@
+'''
+Compare the old ORM import path (one StreamingHistory object + db_session.add per record)
+with the Core bulk-insert engine of app.utils.ingest_utils.
+
+    python -m benchmarks.bench_ingest [rows]
+'''
+import sys
+
+from benchmarks._common import synthetic_records, fresh_engine, timed
+
+from sqlalchemy.orm import Session
+
+from app.models import StreamingHistory
+from app.utils.ingest_utils import store_streaming_history
+
+
+def orm_insert(data, bind):
+    '''The import path as it was: ORM objects added one by one, single commit.'''
+    with Session(bind=bind) as session:
+        for record in data:
+            session.add(StreamingHistory(**{key: value for key, value in record.items() if hasattr(StreamingHistory, key)}))
+        session.commit()
+
+def main(rows=200_000):
+    data = list(synthetic_records(rows))
+    for record in data: # the ORM path can't insert null flags, give it clean input
+        record['skipped'] = bool(record['skipped'])
+
+    _, orm_seconds = timed(orm_insert, data, fresh_engine('orm.db'))
+    print(f'ORM add/commit      : {rows} rows in {orm_seconds:7.2f}s  ({rows / orm_seconds:9.0f} rows/s)')
+
+    for chunk_size in (1_000, 5_000, 20_000):
+        stats = store_streaming_history(data, bind=fresh_engine(f'bulk_{chunk_size}.db'), chunk_size=chunk_size)
+        print(f'bulk, chunk {chunk_size:>6}: {rows} rows in {stats["seconds"]:7.2f}s  ({stats["rows_per_second"]:9.0f} rows/s)'
+              f'  x{orm_seconds / stats["seconds"]:.1f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
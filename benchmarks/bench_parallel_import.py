@@ -0,0 +1,28 @@
+'''
+Import time of a multi-year export with a growing number of parse workers.
+Only the parsing is spread over processes, the SQLite writer stays single.
+
+    python -m benchmarks.bench_parallel_import [rows] [max_workers]
+'''
+import os, sys
+
+from benchmarks._common import WORK_DIR, write_export, fresh_engine, timed
+
+from app.utils.ingest_utils import read_json_and_store_data
+
+
+def main(rows=400_000, max_workers=os.cpu_count() or 1):
+    export_dir = os.path.join(WORK_DIR, 'export')
+    files = write_export(export_dir, rows)
+    print(f'{rows} rows in {len(files)} files, {os.cpu_count()} cores')
+
+    workers, baseline = 1, None
+    while workers <= max_workers:
+        _, seconds = timed(read_json_and_store_data, export_dir, fresh_engine(f'parallel_{workers}.db'), workers)
+        baseline = baseline or seconds
+        print(f'workers {workers:>2}: {seconds:6.2f}s  ({rows / seconds:8.0f} rows/s)  x{baseline / seconds:.2f}')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
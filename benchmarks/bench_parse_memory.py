@@ -0,0 +1,39 @@
+'''
+Peak Python memory of importing one export file, json.load vs the incremental parser.
+The json.load peak grows with the file, the incremental one stays flat.
+
+    python -m benchmarks.bench_parse_memory [rows ...]
+'''
+import os, sys, json, tracemalloc
+
+from benchmarks._common import WORK_DIR, synthetic_records, fresh_engine, timed
+
+from app.config import Config
+from app.utils.ingest_utils import process_json_file
+
+
+def peak_import_memory(file_path, stream):
+    '''Import file_path into a fresh database and return (peak traced bytes, seconds).'''
+    Config.INGEST_STREAM_JSON = stream
+    bind = fresh_engine(f'memory_{stream}_{os.path.basename(file_path)}.db')
+    tracemalloc.start()
+    _, seconds = timed(process_json_file, file_path, bind)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, seconds
+
+def main(*sizes):
+    for rows in sizes or (25_000, 100_000, 200_000):
+        file_path = os.path.join(WORK_DIR, f'Streaming_History_Audio_{rows}.json')
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(list(synthetic_records(rows)), f, indent=4)
+        size_mb = os.path.getsize(file_path) / 2**20
+
+        for stream in (False, True):
+            peak, seconds = peak_import_memory(file_path, stream)
+            print(f'{rows:>7} rows ({size_mb:6.1f} MB file)  {"incremental" if stream else "json.load  "}'
+                  f'  peak {peak / 2**20:7.1f} MB  {seconds:6.2f}s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
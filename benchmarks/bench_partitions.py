@@ -0,0 +1,63 @@
+'''
+Query time on a decade of history, one streaming_history table vs year partitions.
+A year query only reads its partition, an unfiltered one reads all of them.
+
+    python -m benchmarks.bench_partitions [rows] [repeat]
+'''
+import os, sys
+
+from benchmarks._common import WORK_DIR, write_export, fresh_engine, timed
+
+from sqlalchemy import func, desc
+from sqlalchemy.orm import Session
+
+from app.config import Config
+from app.partitions import history_source
+from app.utils.ingest_utils import read_json_and_store_data
+
+
+def top_tracks(session, year):
+    history = history_source('id', 'track_id', 'play_year', 'ms_played', year=year, session=session)
+    return session.query(
+        history.track_id, func.sum(history.ms_played).label('total_ms_played')
+    ).filter(history.play_year == year).group_by(history.track_id).order_by(desc('total_ms_played')).limit(10).all()
+
+def daily_trends(session, start, end):
+    history = history_source('id', 'play_date', 'ms_played', start=start, end=end, session=session)
+    return session.query(
+        history.play_date, func.count(history.id), func.sum(history.ms_played)
+    ).filter(history.play_date >= start, history.play_date <= end).group_by(history.play_date).all()
+
+def total_time(session):
+    history = history_source('ms_played', session=session)
+    return session.query(func.sum(history.ms_played)).scalar()
+
+QUERIES = [
+    ('top tracks of 2019', top_tracks, (2019,)),
+    ('daily trends 2019-03..2019-09', daily_trends, ('2019-03-01', '2019-09-30')),
+    ('daily trends 2018-10..2019-03', daily_trends, ('2018-10-01', '2019-03-31')),
+    ('total listening time', total_time, ()),
+]
+
+def main(rows=250_000, repeat=5):
+    export_dir = os.path.join(WORK_DIR, 'export')
+    files = write_export(export_dir, rows)
+    print(f'{rows} rows over {len(files)} years')
+
+    results = {}
+    for partitioned in (False, True):
+        Config.HISTORY_PARTITIONED = partitioned
+        bind = fresh_engine(f'partitioned_{partitioned}.db')
+        read_json_and_store_data(export_dir, bind)
+        with Session(bind) as session:
+            for name, query, args in QUERIES:
+                query(session, *args) # warm the page cache
+                results[name, partitioned] = min(timed(query, session, *args)[1] for _ in range(repeat))
+
+    for name, _, _ in QUERIES:
+        single, split = results[name, False], results[name, True]
+        print(f'{name:32} single table {single * 1000:8.1f}ms  partitioned {split * 1000:8.1f}ms  x{single / split:.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
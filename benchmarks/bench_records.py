@@ -0,0 +1,56 @@
+'''
+Serialization throughput of the record endpoints, in rows per second: the streamed rows of
+/db/history/<limit> (plain row tuples encoded with orjson, a chunk at a time), with every field
+and with a ?fields= projection, next to the path they replaced - ORM objects, to_dict per row
+and one jsonify of the whole list.
+
+    python -m benchmarks.bench_records [rows] [repeat]
+'''
+import os, sys
+
+from benchmarks._common import WORK_DIR, write_export, timed
+
+from flask import jsonify
+
+from app import create_app
+from app.database import db_session
+from app.models import StreamingHistory
+from app.utils.ingest_utils import read_json_and_store_data
+
+PROJECTION = 'ts,ms_played,master_metadata_track_name,master_metadata_album_artist_name'
+
+
+def to_dict_records(limit):
+    '''The previous path: full ORM objects, to_dict each, one jsonify.'''
+    records = db_session.query(StreamingHistory).order_by(StreamingHistory.id).limit(limit).all()
+    return jsonify([record.to_dict() for record in records]).get_data()
+
+def main(rows=200_000, repeat=3):
+    write_export(os.path.join(WORK_DIR, 'export'), rows)
+    read_json_and_store_data(os.path.join(WORK_DIR, 'export'))
+    print(f'{rows} rows')
+
+    app = create_app()
+    app.config['TESTING'] = True
+    client = app.test_client()
+
+    def streamed(url):
+        return client.get(url).get_data() # the body is only produced while it is read
+
+    with app.test_request_context():
+        cases = [
+            ('to_dict + jsonify', to_dict_records, rows),
+            ('streamed, all fields', streamed, f'/db/history/{rows}'),
+            ('streamed, ndjson', streamed, f'/db/history/{rows}?format=ndjson'),
+            (f'streamed, {PROJECTION.count(",") + 1} fields', streamed, f'/db/history/{rows}?fields={PROJECTION}'),
+        ]
+        baseline = None
+        for name, function, argument in cases:
+            body, _ = timed(function, argument) # warm the page cache
+            seconds = min(timed(function, argument)[1] for _ in range(repeat))
+            baseline = baseline or seconds
+            print(f'{name:24} {rows / seconds:12,.0f} rows/s  {len(body) / 2**20:7.1f} MiB  x{baseline / seconds:5.2f}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
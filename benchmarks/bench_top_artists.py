@@ -0,0 +1,64 @@
+'''
+Latency of /db/history/artists/top as `limit` grows. The timelines of the top artists come
+from one grouped query (routes.artist_timelines), so the number of queries per request stays
+the same for any limit and the time per returned timeline day stays flat; the per-artist loop
+it replaced is timed next to it.
+
+    python -m benchmarks.bench_top_artists [rows] [repeat]
+'''
+import os, sys
+
+from benchmarks._common import WORK_DIR, write_export, timed
+
+from app import create_app
+from sqlalchemy import event
+
+from app.database import db_session, engine
+from app.models import DailyArtistPlays
+from app.utils.ingest_utils import read_json_and_store_data
+from app.blueprints.db.routes import artist_timelines
+
+LIMITS = [10, 50, 200, 500]
+
+
+def timelines_per_artist(artist_ids):
+    '''The N+1 way: one timeline query per artist.'''
+    return {
+        artist_id: db_session.query(DailyArtistPlays.play_date, DailyArtistPlays.play_count, DailyArtistPlays.ms_played)
+        .filter(DailyArtistPlays.artist_id == artist_id)
+        .order_by(DailyArtistPlays.play_date)
+        .all()
+        for artist_id in artist_ids
+    }
+
+def main(rows=500_000, repeat=5):
+    write_export(os.path.join(WORK_DIR, 'export'), rows)
+    read_json_and_store_data(os.path.join(WORK_DIR, 'export'))
+    print(f'{rows} rows')
+
+    app = create_app()
+    app.config['TESTING'] = True
+    client = app.test_client()
+
+    statements = []
+    event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+    for limit in LIMITS:
+        url = f'/db/history/artists/top?limit={limit}&min_playtime=0'
+        client.get(url) # warm the page cache
+        statements.clear()
+        response = client.get(url)
+        queries = len(statements)
+        days = sum(len(artist['timeline_data']) for artist in response.get_json()['artists'])
+        endpoint = min(timed(client.get, url)[1] for _ in range(repeat))
+
+        artist_ids = [artist_id for artist_id, in db_session.query(DailyArtistPlays.artist_id).distinct().limit(limit)]
+        batched = min(timed(artist_timelines, artist_ids)[1] for _ in range(repeat))
+        per_artist = min(timed(timelines_per_artist, artist_ids)[1] for _ in range(repeat))
+        print(f'limit {limit:4}: {queries} queries, {days:6} timeline days, endpoint {endpoint * 1000:7.1f}ms'
+              f' ({endpoint / days * 1e6:4.1f}us/day)  timelines: one query {batched * 1000:7.1f}ms'
+              f'  one per artist {per_artist * 1000:7.1f}ms')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
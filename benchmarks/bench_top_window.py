@@ -0,0 +1,61 @@
+'''
+Latency of a top-K over a random window of days: the prefix-sum index (app/prefix_sums.py,
+two binary searches per entity) next to the SQL sum over the daily rollups it replaces, for
+tracks and artists. Every window's top-K is checked to hold the same totals on both paths.
+
+    python -m benchmarks.bench_top_window [rows] [windows]
+'''
+import os, sys, random
+from datetime import date, timedelta
+
+from benchmarks._common import WORK_DIR, write_export, timed
+
+from sqlalchemy import func
+
+from app.database import db_session
+from app.models import DailyTrackPlays, DailyArtistPlays
+from app.prefix_sums import day_number, load_prefix_sums, top_in_window
+from app.utils.ingest_utils import read_json_and_store_data
+from app.utils.period_utils import Period
+
+LIMIT = 50
+EPOCH = date(1970, 1, 1)
+
+
+def top_in_rollup(rollup, key, period):
+    '''The SQL path: sum the rollup's days of the window per entity, top by listening time.'''
+    return db_session.query(
+        getattr(rollup, key),
+        func.sum(rollup.ms_played).label('total_ms_played'),
+    ).filter(
+        rollup.play_date >= period.start, rollup.play_date <= period.end,
+    ).group_by(getattr(rollup, key)).order_by(func.sum(rollup.ms_played).desc()).limit(LIMIT).all()
+
+def random_period(first, last):
+    '''A window of days between first and last (YYYY-MM-DD).'''
+    start, end = sorted(random.sample(range(day_number(first), day_number(last) + 1), 2))
+    return Period(*[(EPOCH + timedelta(days=day)).isoformat() for day in (start, end, end + 1)])
+
+def main(rows=500_000, windows=50):
+    write_export(os.path.join(WORK_DIR, 'export'), rows)
+    read_json_and_store_data(os.path.join(WORK_DIR, 'export'))
+    first, last = db_session.query(func.min(DailyTrackPlays.play_date), func.max(DailyTrackPlays.play_date)).one()
+    print(f'{rows} rows, {windows} windows from {first} to {last}, top {LIMIT}')
+
+    random.seed(0)
+    periods = [random_period(first, last) for _ in range(windows)]
+    for kind, rollup, key in [('track', DailyTrackPlays, 'track_id'), ('artist', DailyArtistPlays, 'artist_id')]:
+        _, load = timed(load_prefix_sums, db_session, kind) # written by the import, mapped on first use
+        sql = prefix = 0
+        for period in periods:
+            expected, seconds = timed(top_in_rollup, rollup, key, period)
+            sql += seconds
+            top, seconds = timed(top_in_window, db_session, kind, 'total_ms_played', LIMIT, period)
+            prefix += seconds
+            assert [row.total_ms_played for row in top] == [row.total_ms_played for row in expected], period
+        print(f'{kind:6}: sql {sql / windows * 1000:7.2f}ms  prefix sums {prefix / windows * 1000:7.2f}ms'
+              f'  x{sql / prefix:6.1f}  (index mapped in {load * 1000:.1f}ms)')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
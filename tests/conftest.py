@@ -0,0 +1,140 @@
+'''
+Shared fixtures of the test suite.
+
+The app binds the shared database, the per-user data directory and the upload spool directory
+when it is imported (app.config, app.database), so they are pointed at a throwaway directory here,
+before anything of the app is imported. The history is a synthetic export (benchmarks._common)
+plus some podcast episodes, imported the way an upload is into two accounts: one stored in a
+single table, one in year partitions (Config.HISTORY_PARTITIONED). Tests taking the `client`
+fixture run once against each of them.
+
+    python -m pytest tests
+'''
+import os, json, tempfile
+
+TEST_DIR = tempfile.mkdtemp(prefix='spotistat-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(TEST_DIR, 'streaming_history.db')}"
+os.environ['USER_DATA_DIR'] = os.path.join(TEST_DIR, 'users')
+os.environ['IMPORT_UPLOAD_DIR'] = os.path.join(TEST_DIR, 'uploads')
+
+import pytest
+from sqlalchemy import create_engine
+
+from benchmarks._common import synthetic_records, write_export
+
+PLAYS = 30_000 # a bit over a year of plays, so there are two year partitions
+EPISODES = 300
+# Account of each storage mode, see the `client` fixture
+ACCOUNTS = {'plain': 'test-account-plain', 'partitioned': 'test-account-partitioned'}
+
+
+class OfflineSpotify:
+    '''Answers the album lookups of top-tracks without calling the Spotify API, counting the calls.'''
+    calls = 0
+
+    def tracks(self, track_ids):
+        OfflineSpotify.calls += 1
+        return {'tracks': [
+            {'album': {'images': [{'url': f'img/{track_id}'}], 'external_urls': {'spotify': f'album/{track_id}'}}}
+            for track_id in track_ids
+        ]}
+
+
+def episode_records(count):
+    '''Podcast plays: no track, artist or album, only episode fields.'''
+    template = next(synthetic_records(1, seed=1))
+    return [{
+        **template,
+        'ts': f'2014-{month:02d}-{day:02d}T{hour:02d}:30:00Z',
+        'master_metadata_track_name': None,
+        'master_metadata_album_artist_name': None,
+        'master_metadata_album_album_name': None,
+        'spotify_track_uri': None,
+        'episode_name': f'Episode {number}',
+        'episode_show_name': f'Show {number % 5}',
+        'spotify_episode_uri': f'spotify:episode:{number:022d}',
+        'ms_played': 600_000 + number,
+    } for number, (month, day, hour) in enumerate(
+        (1 + index % 12, 1 + index % 28, index % 24) for index in range(count)
+    )]
+
+def write_test_export(directory, plays=PLAYS, episodes=EPISODES):
+    '''Write the test export: the synthetic plays by year, the episodes in a file of their own.'''
+    paths = write_export(directory, plays)
+    if episodes:
+        path = os.path.join(directory, 'Streaming_History_Audio_2014_podcasts.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(episode_records(episodes), f)
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture(scope='session')
+def records():
+    '''Every record of the test export, the reference the tests check the database against.'''
+    return list(synthetic_records(PLAYS)) + episode_records(EPISODES)
+
+@pytest.fixture(scope='session')
+def export_dir():
+    directory = os.path.join(TEST_DIR, 'export')
+    write_test_export(directory)
+    return directory
+
+@pytest.fixture(scope='session')
+def flask_app():
+    from app import create_app
+    import app.blueprints.db.utils as db_utils
+
+    flask_app = create_app()
+    flask_app.config['TESTING'] = True
+    db_utils.get_spotify_client = OfflineSpotify
+    return flask_app
+
+@pytest.fixture(scope='session')
+def accounts(flask_app, export_dir):
+    '''Import the test export into the account of each mode, return ACCOUNTS.'''
+    from app.config import Config
+    from app.database import db_session, get_user_engine
+    from app.models import User
+    from app.utils.ingest_utils import read_json_and_store_data
+
+    for mode, account in ACCOUNTS.items():
+        db_session.merge(User(spotify_user_id=account, display_name=account))
+        db_session.commit()
+        previous, Config.HISTORY_PARTITIONED = Config.HISTORY_PARTITIONED, mode == 'partitioned'
+        try:
+            assert read_json_and_store_data(export_dir, get_user_engine(account))
+        finally:
+            Config.HISTORY_PARTITIONED = previous
+    return ACCOUNTS
+
+@pytest.fixture(params=list(ACCOUNTS))
+def mode(request):
+    return request.param
+
+@pytest.fixture
+def client(flask_app, accounts, mode, monkeypatch):
+    '''Test client whose requests read the account of the mode.'''
+    from app.config import Config
+
+    monkeypatch.setattr(Config, 'HISTORY_PARTITIONED', mode == 'partitioned')
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = accounts[mode]
+    return client
+
+@pytest.fixture
+def history_engine(client, accounts, mode):
+    '''Engine of the database the client reads.'''
+    from app.database import get_user_engine
+    return get_user_engine(accounts[mode])
+
+@pytest.fixture
+def fresh_engine(tmp_path):
+    '''An empty database with the app schema, in the test's own directory.'''
+    from app.database import init_db
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    init_db(engine)
+    yield engine
+    engine.dispose()
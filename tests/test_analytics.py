@@ -0,0 +1,154 @@
+'''Trend and top-K endpoints, answered the same by every analytics backend and for every kind of period.'''
+import json, os
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+
+from app.config import Config
+from app.blueprints.db.utils import DAYS_OF_WEEK
+from conftest import OfflineSpotify
+
+# Backend the endpoints answer from: Config.ANALYTICS_BACKEND, Config.PREFIX_SUMS
+BACKENDS = {'rollups': ('sql', False), 'prefix_sums': ('sql', True), 'columnar': ('columnar', False)}
+# Period arguments and the days they hold
+PERIODS = {
+    '': lambda day: True,
+    'year=2015': lambda day: day.startswith('2015'),
+    'year=2014&month=3': lambda day: day.startswith('2014-03'),
+    'start=2014-06-15&end=2015-01-10': lambda day: '2014-06-15' <= day <= '2015-01-10',
+    'date=2014-08-08': lambda day: day == '2014-08-08',
+}
+
+
+@pytest.fixture(params=list(BACKENDS))
+def backend(request, monkeypatch):
+    analytics_backend, prefix_sums = BACKENDS[request.param]
+    monkeypatch.setattr(Config, 'ANALYTICS_BACKEND', analytics_backend)
+    monkeypatch.setattr(Config, 'PREFIX_SUMS', prefix_sums)
+    return request.param
+
+def totals(records, key):
+    '''(play count, ms played) of the records by key, records with a None key left out.'''
+    groups = defaultdict(lambda: [0, 0])
+    for record in records:
+        value = key(record)
+        if value is not None:
+            groups[value][0] += 1
+            groups[value][1] += record['ms_played']
+    return groups
+
+def in_period(records, arguments):
+    return [record for record in records if PERIODS[arguments](record['ts'][:10])]
+
+@pytest.mark.parametrize('arguments', list(PERIODS))
+def test_trends_match_the_records(client, backend, records, arguments):
+    plays = in_period(records, arguments)
+    hourly = totals(plays, lambda record: int(record['ts'][11:13]))
+    assert client.get(f'/db/history/hourly-trends?{arguments}').get_json() == [
+        {'hour': hour, 'play_count': count, 'total_ms_played': ms_played} for hour, (count, ms_played) in sorted(hourly.items())
+    ]
+    weekly = totals(plays, lambda record: int(datetime.strptime(record['ts'][:10], '%Y-%m-%d').strftime('%w')))
+    assert client.get(f'/db/history/weekly-trends?{arguments}').get_json() == [
+        {'day_of_week': DAYS_OF_WEEK[day], 'play_count': count, 'total_ms_played': ms_played} for day, (count, ms_played) in sorted(weekly.items())
+    ]
+    daily = totals(plays, lambda record: record['ts'][:10])
+    assert client.get(f'/db/history/daily-trends?{arguments}').get_json() == [
+        {'day': day, 'play_count': count, 'total_ms_played': ms_played} for day, (count, ms_played) in sorted(daily.items())
+    ]
+
+@pytest.mark.parametrize('arguments', list(PERIODS) + ['month=7', 'year=2014&artist=Artist 5'])
+def test_top_tracks_match_the_records(client, backend, records, arguments):
+    if arguments == 'month=7': # July of every year
+        plays = [record for record in records if record['ts'][5:7] == '07']
+    elif arguments.endswith('artist=Artist 5'): # the artists whose name contains it
+        plays = [record for record in records if record['ts'].startswith('2014')
+                 and 'Artist 5' in (record['master_metadata_album_artist_name'] or '')]
+    else:
+        plays = in_period(records, arguments)
+    tracks = totals(plays, lambda record: record['master_metadata_track_name'])
+    expected = sorted(tracks.items(), key=lambda item: -item[1][1])[:10]
+
+    top = client.get(f'/db/history/top-tracks?limit=10&{arguments}').get_json()
+    assert [(track['track_name'], track['play_count'], track['total_ms_played']) for track in top] == [
+        (name, count, ms_played) for name, (count, ms_played) in expected
+    ]
+    assert [track['index'] for track in top] == list(range(len(expected)))
+
+@pytest.mark.parametrize('arguments', ['', 'year=2014&month=3', 'start=2014-06-15&end=2015-01-10'])
+def test_top_artists_match_the_records(client, backend, records, arguments):
+    plays = in_period(records, arguments)
+    artists = totals(plays, lambda record: record['master_metadata_album_artist_name'])
+    expected = [(name, count, ms_played) for name, (count, ms_played) in
+                sorted(artists.items(), key=lambda item: -item[1][1]) if ms_played >= 0.05 * 3_600_000][:5]
+
+    top = client.get(f'/db/history/artists/top?limit=5&min_playtime=0.05&{arguments}').get_json()['artists']
+    assert [(artist['artist_name'], artist['total_plays'], artist['total_ms_played']) for artist in top] == expected
+    for artist in top:
+        days = totals([record for record in plays if record['master_metadata_album_artist_name'] == artist['artist_name']],
+                      lambda record: record['ts'][:10])
+        assert artist['timeline_data'] == [
+            {'date': day, 'play_count': count, 'total_ms_played': ms_played} for day, (count, ms_played) in sorted(days.items())
+        ]
+
+def test_top_tracks_of_an_artist_are_the_tracks_by_the_artist(flask_app, tmp_path, monkeypatch):
+    from app.database import db_session, get_user_engine
+    from app.models import User
+    from app.utils.ingest_utils import read_json_and_store_data
+    from conftest import write_test_export
+
+    # a play of a track credited to a guest artist, the track stays the one of its first play's artist
+    paths = write_test_export(tmp_path / 'export', plays=500, episodes=0)
+    with open(paths[-1], encoding='utf-8') as f:
+        plays = json.load(f)
+    guest = {**plays[0], 'ts': '2015-12-31T23:59:59Z', 'master_metadata_album_artist_name': 'Guest'}
+    with open(paths[-1], 'w', encoding='utf-8') as f:
+        json.dump(plays + [guest], f)
+    db_session.merge(User(spotify_user_id='guest-artist', display_name='guest-artist'))
+    db_session.commit()
+    assert read_json_and_store_data(str(tmp_path / 'export'), get_user_engine('guest-artist'))
+
+    client = flask_app.test_client()
+    for artist in ('Guest', plays[0]['master_metadata_album_artist_name']):
+        url = f'/db/history/top-tracks?account_id=guest-artist&artist={artist}'
+        answers = []
+        for analytics_backend, prefix_sums in BACKENDS.values():
+            monkeypatch.setattr(Config, 'ANALYTICS_BACKEND', analytics_backend)
+            monkeypatch.setattr(Config, 'PREFIX_SUMS', prefix_sums)
+            answers.append(client.get(url).get_json())
+        assert answers[0] == answers[1] == answers[2]
+
+def test_a_month_needs_a_year_except_for_top_tracks(client):
+    for endpoint in ('hourly-trends', 'daily-trends', 'dashboard', 'query', 'artists/top'):
+        response = client.get(f'/db/history/{endpoint}?month=3')
+        assert response.status_code == 400 and response.get_json() == {'error': 'Invalid month, month requires year'}
+    assert client.get('/db/history/top-tracks?month=3').status_code == 200 # March of every year
+    assert client.get('/db/history/top-tracks?month=13').status_code == 400
+
+def test_nothing_above_the_minimum_playtime(client, backend):
+    assert client.get('/db/history/artists/top?min_playtime=100000').status_code == 404
+
+def test_album_metadata_is_fetched_once_per_track(client):
+    top = client.get('/db/history/top-tracks?limit=7&date=2015-02-02').get_json()
+    calls = OfflineSpotify.calls
+    assert client.get('/db/history/top-tracks?limit=7&date=2015-02-02').get_json() == top
+    assert OfflineSpotify.calls == calls # every track of the page is in the metadata table already
+    assert all(track['album_image_url'].startswith('img/') for track in top)
+
+def test_snapshot_follows_imports_made_with_another_backend(fresh_engine, tmp_path, monkeypatch):
+    from app.snapshots import load_snapshot, snapshot_path, snapshot_generation
+    from app.utils.ingest_utils import read_json_and_store_data
+    from conftest import write_test_export
+
+    paths = write_test_export(tmp_path / 'export', plays=3000, episodes=20)
+    for number, path in enumerate(paths): # one file per import, every other one with the columnar backend off
+        monkeypatch.setattr(Config, 'ANALYTICS_BACKEND', ('columnar', 'sql')[number % 2])
+        directory = tmp_path / f'import_{number}'
+        directory.mkdir()
+        os.replace(path, directory / os.path.basename(path))
+        assert read_json_and_store_data(str(directory), fresh_engine)
+        with fresh_engine.connect() as connection:
+            plays = connection.exec_driver_sql('SELECT count(*) FROM streaming_history').scalar()
+            generation = connection.exec_driver_sql('SELECT generation FROM data_generation').scalar()
+        assert len(load_snapshot(fresh_engine)) == plays
+        assert snapshot_generation(snapshot_path(fresh_engine)) == generation
@@ -0,0 +1,190 @@
+'''Import of export files: incremental parser, bulk insert, dimension keys, dedup, parallel and partitioned storage.'''
+import json, os
+
+import pytest
+from sqlalchemy import create_engine
+
+from app.config import Config
+from app.database import init_db
+import app.utils.ingest_utils as ingest_utils
+from app.utils.ingest_utils import iter_json_array, read_json_and_store_data, time_columns
+from conftest import write_test_export
+
+
+def rows(engine, sql):
+    with engine.connect() as connection:
+        return connection.exec_driver_sql(sql).all()
+
+def stored_plays(engine):
+    '''The plays of a database as comparable tuples, over the year partitions too.'''
+    tables = [name for name, in rows(engine, "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'streaming_history%'")]
+    return sorted(
+        play for table in tables for play in rows(engine, f'''
+            SELECT h.ts, h.ms_played, t.uri, a.name, h.spotify_episode_uri, h.play_date, h.play_hour
+            FROM {table} h LEFT JOIN tracks t ON t.id = h.track_id LEFT JOIN artists a ON a.id = h.artist_id''')
+    )
+
+
+@pytest.mark.parametrize('buffer_size', [1, 7, 64 * 1024])
+def test_iter_json_array_matches_json_load(tmp_path, buffer_size):
+    items = [{'a': '[,]"\\', 'b': [1, 2.5e10, None, True]}, [], {}, -12.75, 'x' * 100, {'nested': {'deep': [[{}]]}}]
+    path = tmp_path / 'items.json'
+    path.write_text(json.dumps(items, indent=2), encoding='utf-8')
+    assert list(iter_json_array(str(path), buffer_size)) == json.loads(path.read_text(encoding='utf-8'))
+
+@pytest.mark.parametrize('text', ['', '{}', '[1, 2', '[1 2]', '[1,]', '[1] 2', '[{"a": }]'])
+def test_iter_json_array_rejects_malformed_files(tmp_path, text):
+    path = tmp_path / 'bad.json'
+    path.write_text(text, encoding='utf-8')
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_json_array(str(path), 4))
+
+def test_time_columns():
+    columns = time_columns('2021-03-07T23:59:58Z')
+    assert columns == {
+        'ts_ms': 1615161598000, 'play_date': '2021-03-07', 'play_year': 2021, 'play_month': 3,
+        'play_hour': 23, 'play_weekday': 0, # a Sunday, as strftime('%w')
+    }
+
+def test_import_stores_every_play_with_its_dimensions(fresh_engine, tmp_path, records):
+    write_test_export(tmp_path / 'export')
+    assert read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+
+    expected = sorted(
+        (record['ts'], record['ms_played'], record['spotify_track_uri'], record['master_metadata_album_artist_name'],
+         record['spotify_episode_uri'], record['ts'][:10], int(record['ts'][11:13]))
+        for record in records
+    )
+    assert stored_plays(fresh_engine) == expected
+    assert rows(fresh_engine, 'SELECT count(*) FROM artists')[0][0] == len({r['master_metadata_album_artist_name'] for r in records} - {None})
+    assert rows(fresh_engine, 'SELECT count(*) FROM tracks')[0][0] == len({r['spotify_track_uri'] for r in records} - {None})
+    assert rows(fresh_engine, 'SELECT count(*) FROM imported_file')[0][0] == len(os.listdir(tmp_path / 'export'))
+
+def test_reimport_skips_unchanged_files_and_stores_only_new_plays(fresh_engine, tmp_path):
+    export = tmp_path / 'export'
+    paths = write_test_export(export, plays=2000, episodes=0)
+    assert read_json_and_store_data(str(export), fresh_engine)
+    before = stored_plays(fresh_engine)
+
+    assert read_json_and_store_data(str(export), fresh_engine) # unchanged: skipped by the manifest
+    assert stored_plays(fresh_engine) == before
+
+    # a newer export of the same year: the stored plays again plus a new tail
+    with open(paths[-1], encoding='utf-8') as f:
+        plays = json.load(f)
+    tail = [{**play, 'ts': play['ts'].replace(play['ts'][:4], '2031', 1)} for play in plays[:10]]
+    with open(paths[-1], 'w', encoding='utf-8') as f:
+        json.dump(plays + tail, f)
+    assert read_json_and_store_data(str(export), fresh_engine)
+    assert len(stored_plays(fresh_engine)) == len(before) + len(tail)
+    assert rows(fresh_engine, 'SELECT rows_read, rows_inserted FROM imported_file ORDER BY id DESC LIMIT 1')[0] == (len(plays) + 10, 10)
+
+def test_parallel_import_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'INGEST_CHUNK_SIZE', 500)
+    write_test_export(tmp_path / 'export', plays=6000, episodes=50)
+    engines = {}
+    for workers in (1, 3):
+        engines[workers] = create_engine(f"sqlite:///{tmp_path / f'history_{workers}.db'}")
+        init_db(engines[workers])
+        assert read_json_and_store_data(str(tmp_path / 'export'), engines[workers], workers=workers)
+    assert stored_plays(engines[3]) == stored_plays(engines[1])
+
+class FileResults:
+    '''Progress listener keeping the result of every file.'''
+    def __init__(self):
+        self.files = {}
+
+    def rows_stored(self, rows_read, rows_inserted):
+        pass
+
+    def file_finished(self, file_name, success):
+        self.files[file_name] = success
+
+def test_a_failed_parse_task_fails_only_its_file_in_a_parallel_import(fresh_engine, tmp_path, monkeypatch):
+    paths = write_test_export(tmp_path / 'export', plays=30_000, episodes=20)
+    normalize_record = ingest_utils.normalize_record
+    def crash_in_2014(record): # the pool forks after this, so the parse workers see it too
+        if record['ts'].startswith('2014') and record['spotify_track_uri']:
+            raise TypeError('not a FILE_ERRORS error')
+        return normalize_record(record)
+    monkeypatch.setattr(ingest_utils, 'normalize_record', crash_in_2014)
+
+    progress = FileResults()
+    assert not read_json_and_store_data(str(tmp_path / 'export'), fresh_engine, workers=2, progress=progress)
+    assert progress.files == {os.path.basename(path): not path.endswith('2014.json') for path in paths}
+    stored = len(stored_plays(fresh_engine))
+    assert stored > 20 and rows(fresh_engine, 'SELECT sum(play_count) FROM daily_plays')[0][0] == stored
+
+def test_partitioned_import_stores_plays_by_year(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'HISTORY_PARTITIONED', True)
+    engine = create_engine(f"sqlite:///{tmp_path / 'history.db'}")
+    init_db(engine)
+    write_test_export(tmp_path / 'export', plays=30_000, episodes=0)
+    assert read_json_and_store_data(str(tmp_path / 'export'), engine)
+
+    assert rows(engine, 'SELECT count(*) FROM streaming_history')[0][0] == 0
+    for year in (2014, 2015):
+        years = rows(engine, f'SELECT DISTINCT play_year FROM streaming_history_{year}')
+        assert years == [(year,)]
+    ids = [id for table in ('streaming_history_2014', 'streaming_history_2015') for id, in rows(engine, f'SELECT id FROM {table}')]
+    assert len(ids) == len(set(ids)) == 30_000
+
+def test_rollups_match_the_plays_after_incremental_imports(fresh_engine, tmp_path):
+    paths = write_test_export(tmp_path / 'export', plays=20_000, episodes=40)
+    for number, path in enumerate(paths): # one file per import, each one adds onto the rollups
+        directory = tmp_path / f'import_{number}'
+        directory.mkdir()
+        os.replace(path, directory / os.path.basename(path))
+        assert read_json_and_store_data(str(directory), fresh_engine)
+
+    assert rows(fresh_engine, 'SELECT track_id, play_date, play_count, ms_played FROM daily_track_plays ORDER BY 1, 2') == rows(fresh_engine, '''
+        SELECT track_id, play_date, count(*), sum(ms_played) FROM streaming_history
+        WHERE track_id IS NOT NULL GROUP BY 1, 2 ORDER BY 1, 2''')
+    assert rows(fresh_engine, 'SELECT play_date, play_count, ms_played FROM daily_plays ORDER BY 1') == rows(fresh_engine, '''
+        SELECT play_date, count(*), sum(ms_played) FROM streaming_history GROUP BY 1 ORDER BY 1''')
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_a_play_breaking_a_constraint_fails_its_file(fresh_engine, tmp_path, monkeypatch, partitioned):
+    monkeypatch.setattr(Config, 'HISTORY_PARTITIONED', partitioned)
+    paths = write_test_export(tmp_path / 'export', plays=500, episodes=0)
+    with open(paths[0], encoding='utf-8') as f:
+        plays = json.load(f)
+    plays[100]['ms_played'] = None # NOT NULL
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        json.dump(plays + plays[:50], f) # a re-exported head, skipped as already stored
+
+    assert not read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+    assert stored_plays(fresh_engine) == [] # not dropped silently: the whole file is rolled back
+
+    plays[100]['ms_played'] = 0
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        json.dump(plays + plays[:50], f)
+    assert read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+    assert len(stored_plays(fresh_engine)) == 500
+
+@pytest.mark.parametrize('bad_record', [{'ts': None}, {'ts': 'yesterday'}, {'ts': 1615161598}, 'a string'])
+def test_a_record_without_a_valid_ts_fails_only_its_file(fresh_engine, tmp_path, bad_record):
+    paths = write_test_export(tmp_path / 'export', plays=500, episodes=20)
+    with open(paths[0], encoding='utf-8') as f:
+        plays = json.load(f)
+    with open(paths[0], 'w', encoding='utf-8') as f:
+        json.dump(plays + [{**plays[0], **bad_record} if isinstance(bad_record, dict) else bad_record], f)
+
+    assert not read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+    assert len(stored_plays(fresh_engine)) == 20 # the episodes file, imported after the failed one
+    assert rows(fresh_engine, 'SELECT sum(play_count) FROM daily_plays')[0][0] == 20
+
+def test_derived_data_is_refreshed_when_an_import_is_cut_short(fresh_engine, tmp_path, monkeypatch):
+    write_test_export(tmp_path / 'export', plays=30_000, episodes=0)
+    process_json_file = ingest_utils.process_json_file
+    def crash_on_the_second_file(file_path, *args, **kwargs):
+        if file_path.endswith('2015.json'):
+            raise RuntimeError('out of memory')
+        return process_json_file(file_path, *args, **kwargs)
+    monkeypatch.setattr(ingest_utils, 'process_json_file', crash_on_the_second_file)
+
+    with pytest.raises(RuntimeError):
+        read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+    stored = len(stored_plays(fresh_engine))
+    assert stored and rows(fresh_engine, 'SELECT sum(play_count) FROM daily_plays')[0][0] == stored
+    assert rows(fresh_engine, 'SELECT generation FROM data_generation')[0][0] == 1
@@ -0,0 +1,96 @@
+'''Schema migrations of a database created by the first version of the app (app/migrations.py).'''
+import json, sqlite3
+
+from sqlalchemy import create_engine
+
+from app.database import init_db
+from app.migrations import DIMENSION_NAME_COLUMNS, MIGRATIONS
+from app.utils.ingest_utils import read_json_and_store_data
+
+# streaming_history as the first version of the app created it
+LEGACY_SCHEMA = '''
+CREATE TABLE streaming_history (
+    id INTEGER NOT NULL PRIMARY KEY, ts VARCHAR(50) NOT NULL, username VARCHAR(255) NOT NULL, platform VARCHAR(50),
+    ms_played INTEGER NOT NULL, conn_country VARCHAR(5), ip_addr_decrypted VARCHAR(50), user_agent_decrypted VARCHAR(255),
+    master_metadata_track_name VARCHAR(255), master_metadata_album_artist_name VARCHAR(255),
+    master_metadata_album_album_name VARCHAR(255), spotify_track_uri VARCHAR(255), episode_name VARCHAR(255),
+    episode_show_name VARCHAR(255), spotify_episode_uri VARCHAR(255), reason_start VARCHAR(50), reason_end VARCHAR(50),
+    shuffle BOOLEAN NOT NULL, skipped BOOLEAN NOT NULL, offline BOOLEAN NOT NULL, offline_timestamp INTEGER,
+    incognito_mode BOOLEAN NOT NULL
+);
+'''
+LEGACY_PLAYS = [
+    # ts, ms_played, track name, artist, album, track uri, episode uri
+    ('2020-02-29T23:59:59Z', 5000, 'Song', 'Band', 'Record', 'spotify:track:a', None),
+    ('2020-02-29T23:59:59Z', 5000, 'Song', 'Band', 'Record', 'spotify:track:a', None), # imported twice
+    ('2020-03-01T08:00:00Z', 7000, 'Other song', 'Band', 'Record', 'spotify:track:b', None),
+    ('2021-01-03T12:00:00Z', 9000, None, None, None, None, 'spotify:episode:c'),
+]
+
+
+def legacy_database(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(LEGACY_SCHEMA)
+    connection.executemany('''
+        INSERT INTO streaming_history (ts, username, ms_played, master_metadata_track_name, master_metadata_album_artist_name,
+            master_metadata_album_album_name, spotify_track_uri, spotify_episode_uri, shuffle, skipped, offline, incognito_mode)
+        VALUES (?, 'user', ?, ?, ?, ?, ?, ?, 0, 0, 0, 0)''', LEGACY_PLAYS)
+    connection.commit()
+    connection.close()
+
+def index_names(path):
+    connection = sqlite3.connect(path)
+    names = connection.execute("SELECT tbl_name, name FROM sqlite_master WHERE type = 'index' ORDER BY 1, 2").fetchall()
+    connection.close()
+    return names
+
+def test_legacy_database_is_migrated_to_the_current_schema(tmp_path):
+    path = tmp_path / 'legacy.db'
+    legacy_database(path)
+    engine = create_engine(f'sqlite:///{path}')
+    init_db(engine)
+    init_db(engine) # nothing left to apply the second time
+
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    assert connection.execute('''
+        SELECT h.ts_ms, h.play_date, h.play_hour, h.play_weekday, t.uri, t.name, a.name, al.name, h.spotify_episode_uri
+        FROM streaming_history h LEFT JOIN tracks t ON t.id = h.track_id LEFT JOIN artists a ON a.id = h.artist_id
+        LEFT JOIN albums al ON al.id = h.album_id ORDER BY h.id''').fetchall() == [
+        (1583020799000, '2020-02-29', 23, 6, 'spotify:track:a', 'Song', 'Band', 'Record', None),
+        (1583049600000, '2020-03-01', 8, 0, 'spotify:track:b', 'Other song', 'Band', 'Record', None),
+        (1609675200000, '2021-01-03', 12, 0, None, None, None, None, 'spotify:episode:c'),
+    ]
+    assert connection.execute('SELECT * FROM daily_plays ORDER BY play_date').fetchall() == [
+        ('2020-02-29', 1, 5000), ('2020-03-01', 1, 7000), ('2021-01-03', 1, 9000),
+    ]
+    assert connection.execute("SELECT rowid FROM artists_fts WHERE name MATCH 'Ban'").fetchall() == [(1,)]
+    # names and track uri only in the dimension tables, the file vacuumed after dropping them
+    columns = [row[1] for row in connection.execute('PRAGMA table_info(streaming_history)')]
+    assert 'track_id' in columns and not set(DIMENSION_NAME_COLUMNS) & set(columns)
+    assert connection.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    indexes = [row[1] for row in connection.execute('PRAGMA index_list(streaming_history)')]
+    assert 'uq_streaming_history_play_key' in indexes and 'uq_streaming_history_play' not in indexes
+    assert not [row for row in connection.execute('PRAGMA integrity_check') if row != ('ok',)]
+    connection.close()
+
+    # the same indexes as a database created with the current schema
+    init_db(create_engine(f"sqlite:///{tmp_path / 'fresh.db'}"))
+    assert index_names(path) == index_names(tmp_path / 'fresh.db')
+
+def test_plays_of_a_migrated_database_are_not_imported_again(tmp_path):
+    path = tmp_path / 'legacy.db'
+    legacy_database(path)
+    engine = create_engine(f'sqlite:///{path}')
+    init_db(engine)
+
+    export = tmp_path / 'export'
+    export.mkdir()
+    (export / 'Streaming_History_Audio_2020-2021.json').write_text(json.dumps([{
+        'ts': ts, 'username': 'user', 'ms_played': ms_played, 'master_metadata_track_name': track,
+        'master_metadata_album_artist_name': artist, 'master_metadata_album_album_name': album,
+        'spotify_track_uri': track_uri, 'spotify_episode_uri': episode_uri,
+    } for ts, ms_played, track, artist, album, track_uri, episode_uri in LEGACY_PLAYS]))
+    assert read_json_and_store_data(str(export), engine)
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql('SELECT rows_read, rows_inserted FROM imported_file').all() == [(4, 0)]
@@ -0,0 +1,37 @@
+'''The prefix-sum index of the daily rollups (app/prefix_sums.py), checked against summing the rollup rows.'''
+import os
+import random
+from collections import defaultdict
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models import DailyTrackPlays
+from app.prefix_sums import day_number, load_prefix_sums, prefix_path, window_totals
+from app.summaries import data_generation
+
+
+def test_window_totals_are_the_sums_of_the_rollup_rows(history_engine):
+    with Session(history_engine) as session:
+        rows = session.execute(select(DailyTrackPlays.track_id, DailyTrackPlays.play_date, DailyTrackPlays.play_count,
+                                      DailyTrackPlays.ms_played)).all()
+        index = load_prefix_sums(session, 'track')
+        assert os.path.exists(prefix_path(history_engine, 'track', data_generation(session)))
+
+    days = sorted({day_number(play_date) for _, play_date, _, _ in rows})
+    rng = random.Random(0)
+    for _ in range(20):
+        first, last = sorted(rng.sample(days, 2))
+        expected = defaultdict(lambda: [0, 0])
+        for track_id, play_date, play_count, ms_played in rows:
+            if first <= day_number(play_date) <= last:
+                expected[track_id][0] += play_count
+                expected[track_id][1] += ms_played
+        entities, plays, ms_played = window_totals(index, first, last)
+        found = {entity: [count, ms] for entity, count, ms in zip(entities.tolist(), plays.tolist(), ms_played.tolist()) if count}
+        assert found == expected
+
+    some = [1, 2, 3, 10**9]
+    entities, plays, _ = window_totals(index, entity_ids=some)
+    assert entities.tolist() == [1, 2, 3]
+    assert plays.tolist() == [sum(count for track_id, _, count, _ in rows if track_id == entity) for entity in (1, 2, 3)]
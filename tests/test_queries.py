@@ -0,0 +1,91 @@
+'''The declarative query endpoint (/db/history/query, app/queries.py), checked against the records.'''
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+
+from app.models import DailyPlays, DailyTrackPlays, DailyArtistPlays
+from app.queries import _rollup_for
+
+
+# Value of each dimension of a record, as the endpoint names it
+DIMENSION_VALUES = {
+    'hour': lambda record: int(record['ts'][11:13]),
+    'weekday': lambda record: int(datetime.strptime(record['ts'][:10], '%Y-%m-%d').strftime('%w')),
+    'day': lambda record: record['ts'][:10],
+    'month': lambda record: record['ts'][:7],
+    'year': lambda record: int(record['ts'][:4]),
+    'artist': lambda record: record['master_metadata_album_artist_name'],
+    'track': lambda record: record['master_metadata_track_name'],
+    'platform': lambda record: record['platform'],
+    'reason_end': lambda record: record['reason_end'],
+}
+
+def expected_rows(records, dimensions, metrics):
+    '''The rows of a query without filters and sort, aggregated in Python.'''
+    groups = defaultdict(list)
+    for record in records:
+        key = tuple(DIMENSION_VALUES[name](record) for name in dimensions)
+        if None not in key:
+            groups[key].append(record)
+    rows = []
+    for key, plays in groups.items():
+        values = {
+            'plays': len(plays),
+            'ms_played': sum(record['ms_played'] for record in plays),
+            'skips': sum(1 for record in plays if record['skipped']),
+            'distinct_tracks': len({record['spotify_track_uri'] for record in plays if record['spotify_track_uri']}),
+        }
+        rows.append({**dict(zip(dimensions, key)), **{name: values[name] for name in metrics}})
+    return sorted(rows, key=lambda row: tuple(row[name] for name in dimensions))
+
+def query_rows(client, url, dimensions):
+    response = client.get(url)
+    assert response.status_code == 200
+    rows = response.get_json()['rows']
+    for row in rows:
+        row.pop('artist_id', None)
+        row.pop('track_uri', None)
+    return sorted(rows, key=lambda row: tuple(row[name] for name in dimensions))
+
+@pytest.mark.parametrize('dimensions, metrics', [
+    ([], ['plays', 'ms_played', 'skips', 'distinct_tracks']),
+    (['year'], ['plays', 'ms_played']),                       # the daily rollup
+    (['year', 'artist'], ['plays']),                          # the artist rollup
+    (['track'], ['plays', 'ms_played', 'distinct_tracks']),   # the track rollup
+    (['weekday', 'hour'], ['plays', 'skips']),                # the plays
+    (['platform', 'reason_end'], ['ms_played', 'distinct_tracks']),
+    (['year'], ['plays', 'distinct_tracks']),                 # the plays: episodes count as plays
+    ([], ['distinct_tracks']),
+])
+@pytest.mark.filterwarnings('error::sqlalchemy.exc.SAWarning')
+def test_query_rows_match_the_records(client, records, dimensions, metrics):
+    url = f'/db/history/query?dimensions={",".join(dimensions)}&metrics={",".join(metrics)}&limit=10000'
+    assert query_rows(client, url, dimensions) == expected_rows(records, dimensions, metrics)
+
+def test_query_filters_period_and_top_k(client, records):
+    plays = [record for record in records if record['ts'].startswith('2014-05') and record['platform'].startswith('Linux')
+             and 'Artist 12' in (record['master_metadata_album_artist_name'] or '')]
+    expected = sorted(expected_rows(plays, ['artist'], ['plays', 'ms_played']), key=lambda row: (-row['ms_played'], row['artist']))
+    url = '/db/history/query?dimensions=artist&metrics=plays,ms_played&sort=ms_played&limit=3&year=2014&month=5&artist=Artist 12'
+    rows = client.get(url + '&platform=Linux [x86 0]').get_json()['rows']
+    assert [{key: row[key] for key in ('artist', 'plays', 'ms_played')} for row in rows] == expected[:3]
+
+    skipped = client.get('/db/history/query?metrics=plays&skipped=true').get_json()['rows']
+    assert skipped == [{'plays': sum(1 for record in records if record['skipped'])}]
+
+def test_query_picks_the_narrowest_source():
+    def query(dimensions, metrics, filters=()):
+        return {'dimensions': dimensions, 'metrics': metrics, 'filters': dict.fromkeys(filters, 'x')}
+    assert _rollup_for(query(['year'], ['plays'])) is DailyPlays
+    assert _rollup_for(query(['day'], ['ms_played'], ['artist'])) is DailyArtistPlays
+    assert _rollup_for(query(['track'], ['plays'], ['artist'])) is DailyTrackPlays
+    assert _rollup_for(query(['year'], ['plays', 'distinct_tracks'], ['track'])) is DailyTrackPlays
+    assert _rollup_for(query(['year'], ['plays', 'distinct_tracks'])) is None # the track rollup has no episodes
+    assert _rollup_for(query(['hour'], ['plays'])) is None
+    assert _rollup_for(query(['year'], ['skips'])) is None
+
+def test_invalid_queries_are_rejected(client):
+    assert client.get('/db/history/query?dimensions=colour').status_code == 400
+    assert client.get('/db/history/query?metrics=plays&sort=skips').status_code == 400
+    assert client.get('/db/history/query?skipped=maybe').status_code == 400
@@ -0,0 +1,96 @@
+'''
+Query plan regression tests for the /db endpoints.
+
+Every GET route of the db blueprint (and the POST routes of POST_URLS) is called against both test
+histories, the SQL it runs is captured and its EXPLAIN QUERY PLAN checked: a plain scan of
+streaming_history or of a year partition means a missing or unusable index of app.models.HISTORY_INDEXES.
+'''
+import re
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+
+# Values for the path parameters of the routes, by parameter name
+PATH_ARGS = {
+    'limit': '5',
+    'id': '5',
+    'artist_name': 'Artist 777',
+    'album_name': 'Album 123',
+    'track_id': '0000000000000000000007',
+    'job_id': 'unknown',
+}
+# Query string variants that take a different path through the query builders
+EXTRA_URLS = [
+    '/db/history/top-tracks?year=2014',
+    '/db/history/top-tracks?year=2014&month=3&sort_by=play_count',
+    '/db/history/top-tracks?date=2014-05-06',
+    '/db/history/top-tracks?artist=Artist 777',
+    '/db/history/played-tracks?limit_count=3',
+    '/db/history/daily-trends?start=2014-03-01&end=2015-02-01',
+    '/db/history/hourly-trends?year=2014&month=3',
+    '/db/history/weekly-trends?start=2014-03-01&end=2015-02-01',
+    '/db/history/artist/Artist 7/stats?year=2014',
+    '/db/history/query?dimensions=weekday,hour&metrics=plays,skips&year=2014',
+    '/db/history/query?dimensions=track&sort=plays&limit=10&artist=Artist 7',
+    '/db/history/query?dimensions=platform,reason_end&metrics=plays,skips,ms_played',
+    '/db/history/query?dimensions=hour',
+    '/db/history/dashboard?year=2014&month=3',
+    '/db/history/sessions?start=2014-03-01&end=2014-04-01&format=ndjson',
+    '/db/history/artist/Artist 7?limit=50&cursor=1000',
+    '/db/search?q=Artist 77',
+    '/db/search?q=um 12&type=album&offset=5',
+    '/db/search?q=7&type=track',
+]
+# POST routes reading the history, with their JSON body
+POST_URLS = {
+    '/db/history/tracks/stats?year=2014': {'tracks': ['0000000000000000000007', 'spotify:track:0000000000000000000012']},
+    '/db/history/artists/stats': {'artists': ['Artist 7', 'Artist 777']},
+}
+# Routes allowed to scan, with the reason
+ALLOWED_SCANS = {
+    '/db/history/<int:limit>': 'reads the first rows of the table, stops after LIMIT',
+}
+TABLE_SCAN = re.compile(r'^SCAN streaming_history(_\d{4})?$') # the table or one of its year partitions
+
+
+def route_urls(app):
+    '''(rule, url) of every GET route of the db blueprint, path parameters filled from PATH_ARGS, and of EXTRA_URLS.'''
+    urls = []
+    for rule in app.url_map.iter_rules():
+        if not rule.endpoint.startswith('database.') or 'GET' not in rule.methods:
+            continue
+        missing = rule.arguments - PATH_ARGS.keys()
+        assert not missing, f'{rule.rule}: no sample value for {sorted(missing)}, add it to PATH_ARGS'
+        urls.append((rule.rule, re.sub(r'<(?:\w+:)?(\w+)>', lambda match: PATH_ARGS[match.group(1)], rule.rule)))
+    return urls + [(url, url) for url in [*EXTRA_URLS, *POST_URLS]]
+
+ROUTES = route_urls(create_app())
+
+
+def captured_queries(client, engine, url):
+    '''Call a route and return the (statement, parameters) of the SELECTs it ran.'''
+    captured = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.post(url, json=POST_URLS[url]) if url in POST_URLS else client.get(url)
+        response.get_data() # streamed responses run their queries while the body is read
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code < 500, f'{url} failed with {response.status_code}'
+    return captured
+
+@pytest.mark.parametrize('rule, url', ROUTES, ids=[url for _, url in ROUTES])
+def test_no_full_table_scan(client, history_engine, rule, url):
+    queries = captured_queries(client, history_engine, url)
+    if rule in ALLOWED_SCANS:
+        return
+    with history_engine.connect() as connection:
+        for statement, parameters in queries:
+            plan = [row[3] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+            scans = [line for line in plan if TABLE_SCAN.match(line)]
+            assert not scans, f'full scan in {" ".join(statement.split())[:300]}\n' + '\n'.join(plan)
@@ -0,0 +1,57 @@
+'''Raw play records: keyset pagination, streamed JSON/NDJSON bodies and ?fields= projection.'''
+import json
+
+from app.models import StreamingHistory
+
+
+def pages(client, url):
+    '''Follow next_cursor from the first page to the last, return the pages.'''
+    pages, cursor = [], None
+    while True:
+        response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        page = response.get_json()
+        assert response.headers['X-Next-Cursor'] == (page['next_cursor'] or 'null')
+        pages.append(page['records'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return pages
+
+def test_pages_cover_every_play_once_in_id_order(client, records):
+    ids = [record['id'] for page in pages(client, '/db/history/997?fields=id') for record in page]
+    assert len(ids) == len(records) and ids == sorted(set(ids))
+
+def test_artist_pages_hold_the_plays_of_the_matching_artists(client, records):
+    fields = 'id,ts,master_metadata_album_artist_name,ms_played'
+    found = [record for page in pages(client, f'/db/history/artist/Artist 77?limit=100&fields={fields}') for record in page]
+    assert all(len(page) <= 100 for page in pages(client, '/db/history/artist/Artist 77?limit=100&fields=id'))
+    assert sorted((record['ts'], record['ms_played']) for record in found) == sorted(
+        (record['ts'], record['ms_played']) for record in records
+        if 'Artist 77' in (record['master_metadata_album_artist_name'] or '')
+    )
+    assert {record['master_metadata_album_artist_name'] for record in found} == {'Artist 77'} | {f'Artist 77{digit}' for digit in range(10)}
+    assert client.get('/db/history/artist/Nobody at all').status_code == 404
+
+def test_records_have_every_field_by_default_and_only_the_requested_ones_otherwise(client, records):
+    full = client.get('/db/history/3').get_json()['records']
+    assert [list(record) for record in full] == [list(StreamingHistory.RECORD_FIELDS)] * 3
+    assert {key: value for key, value in full[0].items() if key != 'id'} == {
+        **{key: value for key, value in records[0].items() if key in StreamingHistory.RECORD_FIELDS},
+        'skipped': bool(records[0]['skipped']),
+    }
+    assert client.get('/db/history/3?fields=ts,ms_played').get_json()['records'] == [
+        {'ts': record['ts'], 'ms_played': record['ms_played']} for record in records[:3]
+    ]
+    record = client.get(f'/db/history/record/{full[1]["id"]}?fields=ts,spotify_track_uri').get_json()
+    assert record == {'ts': records[1]['ts'], 'spotify_track_uri': records[1]['spotify_track_uri']}
+
+def test_ndjson_has_one_record_per_line(client):
+    response = client.get('/db/history/5?fields=id,ts&format=ndjson')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == client.get('/db/history/5?fields=id,ts').get_json()['records']
+
+def test_invalid_fields_and_cursors_are_rejected(client):
+    assert client.get('/db/history/5?fields=ts,password').status_code == 400
+    assert client.get('/db/history/5?cursor=abc').status_code == 400
+    assert client.get('/db/history/record/999999999').status_code == 404
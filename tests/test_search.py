@@ -0,0 +1,34 @@
+'''Name search of artists, albums and tracks (/db/search, app/utils/search_utils.py).'''
+from collections import Counter
+
+import pytest
+
+
+@pytest.mark.parametrize('kind, field, query', [
+    ('artist', 'master_metadata_album_artist_name', 'Artist 12'),
+    ('album', 'master_metadata_album_album_name', 'um 7'),
+    ('track', 'master_metadata_track_name', '99'), # shorter than a trigram
+])
+def test_search_finds_every_matching_name_with_its_plays(client, records, kind, field, query):
+    plays = Counter(record[field] for record in records if query in (record[field] or ''))
+    found, offset = [], 0
+    while True:
+        page = client.get(f'/db/search?type={kind}&q={query}&limit=50&offset={offset}').get_json()
+        found += page['items']
+        offset += 50
+        if offset >= page['total']:
+            break
+    assert len(found) == page['total'] and len({item['id'] for item in found}) == len(found)
+    # an album is one per name and artist, its plays are summed up by name
+    by_name = Counter()
+    for item in found:
+        by_name[item['name']] += item['plays']
+    assert +by_name == plays
+
+def test_closest_names_come_first(client):
+    items = client.get('/db/search?q=Artist 12&limit=3').get_json()['items']
+    assert items[0]['name'] == 'Artist 12'
+
+def test_invalid_searches_are_rejected(client):
+    assert client.get('/db/search?q=').status_code == 400
+    assert client.get('/db/search?q=abc&type=genre').status_code == 400
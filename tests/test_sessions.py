@@ -0,0 +1,63 @@
+'''Listening sessions: vectorized gap detection (session_bounds) and the paginated /history/sessions.'''
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app.blueprints.db.utils import session_bounds
+
+
+def reference_sessions(timestamps, gap_ms):
+    '''Sessions the plain way, one play at a time.'''
+    sessions = []
+    for ts in timestamps:
+        if sessions and ts - sessions[-1][1] <= gap_ms:
+            sessions[-1][1] = ts
+        else:
+            sessions.append([ts, ts])
+    return [tuple(session) for session in sessions]
+
+def ts_ms(ts):
+    return int(datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 50, 10_000])
+@pytest.mark.parametrize('limit', [1, 7, 1000])
+def test_session_bounds_match_the_plain_loop(chunk_size, limit):
+    rng = random.Random(chunk_size * limit)
+    timestamps, ts = [], 0
+    for _ in range(2000):
+        ts += rng.choice([0, 1_000, 60_000, 1_800_000, 1_800_001, 7_200_000])
+        timestamps.append(ts)
+    chunks = [timestamps[start:start + chunk_size] for start in range(0, len(timestamps), chunk_size)]
+
+    expected = reference_sessions(timestamps, 1_800_000)
+    sessions, next_start = session_bounds(chunks, 1_800_000, limit)
+    assert sessions == expected[:limit]
+    assert next_start == (expected[limit][0] if len(expected) > limit else None)
+
+def test_session_pages_add_up_to_the_sessions_of_the_period(client, records):
+    sessions, cursor = [], None
+    while True:
+        page = client.get('/db/history/sessions?start=2014-03-01&end=2014-04-30&limit=37' + (f'&cursor={cursor}' if cursor else '')).get_json()
+        sessions += page['sessions']
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    plays = [record for record in records if '2014-03-01' <= record['ts'][:10] <= '2014-04-30']
+    expected = reference_sessions(sorted(ts_ms(record['ts']) for record in plays), 30 * 60_000)
+    assert [(ts_ms(session['session_start']), ts_ms(session['session_end'])) for session in sessions] == expected
+    assert sum(session['total_tracks'] for session in sessions) == len(plays)
+    assert sum(session['total_ms_played'] for session in sessions) == sum(record['ms_played'] for record in plays)
+
+def test_session_tracks_are_the_plays_of_the_session(client, records):
+    session = client.get('/db/history/sessions?date=2014-03-02&limit=1').get_json()['sessions'][0]
+    plays = sorted((record for record in records if ts_ms(session['session_start']) <= ts_ms(record['ts']) <= ts_ms(session['session_end'])),
+                   key=lambda record: record['ts'])
+    assert session['tracks'] == [{
+        'track_name': record['master_metadata_track_name'],
+        'track_artist': record['master_metadata_album_artist_name'],
+        'track_uri': record['spotify_track_uri'],
+        'timestamp': record['ts'],
+        'ms_played': record['ms_played'],
+    } for record in plays]
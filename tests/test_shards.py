@@ -0,0 +1,105 @@
+'''Per-user databases: the engine registry (app/database.py) and the routing of requests to them (app/shards.py).'''
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import database
+from app.config import Config
+from app.database import db_session, get_user_db, get_user_engine, user_db_path
+from app.models import User
+from app.utils.ingest_utils import read_json_and_store_data
+from conftest import write_test_export
+
+
+def total_plays(client, arguments=''):
+    return client.get(f'/db/history/skip-stats{arguments}').get_json()['total_plays']
+
+def test_each_account_reads_its_own_database(flask_app, accounts, records):
+    custom = 'custom-name-of-the-plain-account'
+    db_session.query(User).filter_by(spotify_user_id=accounts['plain']).update({'custom_id': custom})
+    db_session.commit()
+    client = flask_app.test_client()
+
+    assert total_plays(client) == 0 # no account: the shared database, empty here
+    assert client.get(f'/db/history/skip-stats?account_id={custom}').get_json()['total_plays'] == len(records)
+    assert client.get(f'/db/history/skip-stats?account_id={accounts["plain"]}').get_json()['total_plays'] == len(records)
+    response = client.get('/db/history/skip-stats?account_id=nobody')
+    assert response.status_code == 404 and response.get_json() == {'error': 'Account nobody not found'}
+
+def test_user_engines_are_cached_and_least_recently_used_evicted(flask_app, monkeypatch):
+    monkeypatch.setattr(Config, 'USER_DB_MAX_OPEN', 2)
+    engine = get_user_engine('lru-a')
+    assert get_user_engine('lru-a') is engine and get_user_db('lru-a').get_bind() is engine
+    get_user_engine('lru-b')
+    get_user_engine('lru-a') # most recently used again
+    get_user_engine('lru-c')
+    assert list(database._user_dbs)[-2:] == ['lru-a', 'lru-c'] and 'lru-b' not in database._user_dbs
+    assert get_user_engine('lru-a') is engine
+
+def test_user_databases_use_the_configured_pragmas(flask_app):
+    with get_user_engine('pragmas').connect() as connection:
+        assert connection.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert connection.exec_driver_sql('PRAGMA busy_timeout').scalar() == Config.USER_DB_PRAGMAS['busy_timeout']
+    assert user_db_path('pragmas').startswith(Config.USER_DATA_DIRS[0])
+
+def test_a_slow_open_holds_up_only_its_own_account(flask_app, monkeypatch):
+    opened, release = [], threading.Event()
+    open_user_db = database._open_user_db
+    def open_slowly(spotify_user_id):
+        opened.append(spotify_user_id)
+        if spotify_user_id == 'slow-open':
+            assert release.wait(10)
+        return open_user_db(spotify_user_id)
+    monkeypatch.setattr(database, '_open_user_db', open_slowly)
+
+    with ThreadPoolExecutor(4) as pool:
+        slow = [pool.submit(get_user_engine, 'slow-open') for _ in range(3)]
+        assert pool.submit(get_user_engine, 'quick-open').result(timeout=10) is get_user_engine('quick-open')
+        assert not any(future.done() for future in slow)
+        release.set()
+        assert len({future.result(timeout=10) for future in slow}) == 1
+    assert opened.count('slow-open') == 1 and not database._opening_locks
+
+def test_check_history_needs_imported_plays(flask_app, accounts):
+    db_session.merge(User(spotify_user_id='no-import-yet', display_name='no-import-yet'))
+    db_session.commit()
+    client = flask_app.test_client()
+    get_user_engine('no-import-yet') # the database file exists, empty
+    assert client.get('/db/check_history?account_id=no-import-yet').status_code == 404
+    assert client.get(f'/db/check_history?account_id={accounts["plain"]}').status_code == 200
+    assert client.get('/db/check_history').status_code == 404 # no account
+
+def test_only_the_owner_reads_the_shared_history_until_their_first_import(flask_app, fresh_engine, tmp_path, monkeypatch):
+    from sqlalchemy.orm import scoped_session, sessionmaker
+    import app.shards as shards
+
+    # the shared database of an install from before the per-user databases, plays of the account 'benchmark'
+    write_test_export(tmp_path / 'export', plays=1000, episodes=0)
+    assert read_json_and_store_data(str(tmp_path / 'export'), fresh_engine)
+    shared = scoped_session(sessionmaker(bind=fresh_engine))
+    for account in ('benchmark', 'not-the-owner'):
+        shared.merge(User(spotify_user_id=account, display_name=account))
+    shared.commit()
+    monkeypatch.setattr(shards, 'db_session', shared)
+    client = flask_app.test_client()
+
+    assert client.get('/db/check_history?account_id=benchmark').status_code == 200
+    assert total_plays(client, '?account_id=benchmark') == 1000
+    assert client.get('/db/check_history?account_id=not-the-owner').status_code == 404
+    assert total_plays(client, '?account_id=not-the-owner') == 0
+
+    write_test_export(tmp_path / 'own', plays=200, episodes=0)
+    assert read_json_and_store_data(str(tmp_path / 'own'), get_user_engine('benchmark'))
+    assert total_plays(client, '?account_id=benchmark') == 200
+
+def test_teardown_does_not_reopen_an_evicted_database(flask_app, monkeypatch):
+    from flask import g
+    from app.shards import current_history_session, release_history_shard
+
+    monkeypatch.setattr(Config, 'USER_DB_MAX_OPEN', 1)
+    with flask_app.test_request_context():
+        g.history_account = 'evicted-mid-request'
+        current_history_session()
+        get_user_engine('opened-meanwhile') # evicts the database of the request
+        assert 'evicted-mid-request' not in database._user_dbs
+        release_history_shard()
+        assert 'evicted-mid-request' not in database._user_dbs
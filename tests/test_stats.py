@@ -0,0 +1,60 @@
+'''Track and artist statistics, one at a time and in batches (/history/track/<id>/stats, /history/tracks/stats, ...).'''
+from collections import Counter
+
+import pytest
+
+TRACK_URI_PREFIX = 'spotify:track:'
+
+
+def expected_stats(plays):
+    '''The fields of get_track_stats that follow from the plays alone.'''
+    hours = Counter(int(record['ts'][11:13]) for record in plays)
+    days = {}
+    for record in plays:
+        day = days.setdefault(record['ts'][:10], [0, 0])
+        day[0] += 1
+        day[1] += record['ms_played']
+    hour, hour_plays = max(hours.items(), key=lambda item: (item[1], -item[0]))
+    return {
+        'total_plays': len(plays),
+        'total_ms_played': sum(record['ms_played'] for record in plays),
+        'distinct_days_played': len(days),
+        'first_played': min(record['ts'] for record in plays).replace('T', ' ').rstrip('Z'),
+        'last_played': max(record['ts'] for record in plays).replace('T', ' ').rstrip('Z'),
+        'timeline_data': [{'date': day, 'play_count': count, 'total_ms_played': ms} for day, (count, ms) in sorted(days.items())],
+        'most_frequent_play_hour': hour,
+        'most_frequent_play_count': hour_plays,
+    }
+
+def subset(stats, fields):
+    return {field: stats[field] for field in fields}
+
+@pytest.mark.parametrize('arguments, days', [('', lambda day: True), ('year=2015', lambda day: day.startswith('2015'))])
+def test_track_stats_match_the_records(client, records, arguments, days):
+    uri = f'{TRACK_URI_PREFIX}{42:022d}'
+    expected = expected_stats([record for record in records if record['spotify_track_uri'] == uri and days(record['ts'][:10])])
+    stats = client.get(f'/db/history/track/{uri.removeprefix(TRACK_URI_PREFIX)}/stats?{arguments}').get_json()
+    assert subset(stats, expected) == expected
+    assert client.get(f'/db/history/track/{"9" * 22}/stats').status_code == 404
+
+def test_artist_stats_match_the_records(client, records):
+    expected = expected_stats([record for record in records if record['master_metadata_album_artist_name'] == 'Artist 7'])
+    del expected['most_frequent_play_hour'], expected['most_frequent_play_count'] # not part of the artist stats
+    stats = client.get('/db/history/artist/Artist 7/stats').get_json()
+    assert 'most_frequent_play_hour' not in stats and subset(stats, expected) == expected
+    assert client.get('/db/history/artist/Nobody/stats').status_code == 404
+
+def test_batches_are_the_single_stats(client):
+    tracks = [f'{TRACK_URI_PREFIX}{1:022d}', f'{2:022d}', f'{"9" * 22}']
+    batch = client.post('/db/history/tracks/stats?year=2014', json={'tracks': tracks}).get_json()
+    assert batch['tracks'] == [client.get(f'/db/history/track/{track[-22:]}/stats?year=2014').get_json() for track in tracks[:2]]
+    assert batch['not_found'] == tracks[2:]
+
+    artists = ['Artist 3', 'Artist 30', 'Nobody']
+    batch = client.post('/db/history/artists/stats', json={'artists': artists}).get_json()
+    assert batch['artists'] == [client.get(f'/db/history/artist/{artist}/stats').get_json() for artist in artists[:2]]
+    assert batch['not_found'] == ['Nobody']
+
+def test_batches_need_a_list_of_names(client):
+    assert client.post('/db/history/tracks/stats', json={'tracks': 'spotify:track:1'}).status_code == 400
+    assert client.post('/db/history/artists/stats', json={'artists': ['Artist 1'] * 1000}).status_code == 400
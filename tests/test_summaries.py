@@ -0,0 +1,46 @@
+'''The whole-history summary behind the overview endpoints and /history/dashboard (app/summaries.py).'''
+from collections import Counter
+
+import pytest
+
+from app.blueprints.db.utils import DASHBOARD_PANELS
+from app import summaries
+from app.config import Config
+from app.utils.utils import cache
+
+
+@pytest.mark.parametrize('backend', ['sql', 'columnar'])
+def test_overview_endpoints_match_the_records(client, records, monkeypatch, backend):
+    monkeypatch.setattr(Config, 'ANALYTICS_BACKEND', backend)
+    cache.clear() # both backends cache the summary under the same key
+    if backend == 'columnar': # not from SQL
+        monkeypatch.setattr(summaries, 'compute_summary', None)
+    total_ms = sum(record['ms_played'] for record in records)
+    skipped = sum(1 for record in records if record['skipped'])
+    assert client.get('/db/history/total-listening-time').get_json()['total_listening_ms'] == total_ms
+    assert client.get('/db/history/skip-stats').get_json() == {
+        'total_plays': len(records), 'skipped_tracks': skipped,
+        'skip_rate': skipped / len(records), 'skip_percentage': skipped / len(records) * 100,
+    }
+    assert client.get('/db/history/unique-tracks-count').get_json() == {
+        'unique_tracks_count': len({record['spotify_track_uri'] for record in records if record['spotify_track_uri']})
+    }
+    reasons = Counter(record['reason_end'] for record in records)
+    assert sorted((reason['reason_end'], reason['count']) for reason in client.get('/db/history/end-reasons').get_json()) == sorted(reasons.items())
+    platforms = {platform['platform']: platform['play_count'] for platform in client.get('/db/history/platform-stats').get_json()}
+    assert platforms['Linux'] == sum(1 for record in records if record['platform'].startswith('Linux'))
+    assert sum(platforms.values()) == len(records)
+
+@pytest.mark.parametrize('arguments', ['', 'year=2014&month=2', 'start=2014-12-20&end=2015-01-05'])
+def test_dashboard_panels_are_the_endpoints_of_the_same_name(client, arguments):
+    dashboard = client.get(f'/db/history/dashboard?{arguments}').get_json()
+    assert sorted(dashboard) == sorted(DASHBOARD_PANELS)
+    for panel in ('hourly-trends', 'weekly-trends'):
+        assert dashboard[panel] == client.get(f'/db/history/{panel}?{arguments}').get_json()
+    if not arguments: # the other endpoints are of the whole history
+        for panel in DASHBOARD_PANELS:
+            assert dashboard[panel] == client.get(f'/db/history/{panel}').get_json()
+
+def test_dashboard_of_some_panels(client):
+    assert sorted(client.get('/db/history/dashboard?panels=skip-stats,end-reasons').get_json()) == ['end-reasons', 'skip-stats']
+    assert client.get('/db/history/dashboard?panels=skip-stats,weather').status_code == 400
@@ -0,0 +1,87 @@
+'''Export uploads imported by a background job (/db/upload_history).'''
+import io, os, time, zipfile
+
+from app.database import db_session
+from app.models import User
+from conftest import write_test_export
+
+
+def export_zip(directory):
+    '''The export as Spotify ships it: the JSON files in a folder of the ZIP, next to other files.'''
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for path in write_test_export(directory, plays=3000, episodes=20):
+            archive.write(path, f'Spotify Extended Streaming History/{os.path.basename(path)}')
+        archive.writestr('Spotify Extended Streaming History/ReadMeFirst.pdf', b'%PDF')
+    return buffer.getvalue()
+
+def wait_for_job(client, status_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['state'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'import job still {job["state"]} after {timeout}s')
+
+def test_uploaded_export_is_imported_into_the_account(flask_app, tmp_path):
+    db_session.merge(User(spotify_user_id='uploader', display_name='uploader'))
+    db_session.commit()
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = 'uploader'
+
+    response = client.post('/db/upload_history', data=export_zip(tmp_path / 'export'), content_type='application/zip')
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert (job['state'], job['files_failed'], job['rows_read'], job['rows_inserted']) == ('done', [], 3020, 3020)
+    assert client.get('/db/history/skip-stats').get_json()['total_plays'] == 3020
+
+    # the same export again: every file is in the manifest already
+    response = client.post('/db/upload_history', data={'file': (io.BytesIO(export_zip(tmp_path / 'again')), 'export.zip')})
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert (job['state'], job['rows_inserted']) == ('done', 0)
+    assert client.get('/db/history/skip-stats').get_json()['total_plays'] == 3020
+
+def test_upload_goes_to_the_logged_in_account_only(flask_app, accounts, tmp_path):
+    client = flask_app.test_client()
+    data = export_zip(tmp_path / 'export')
+    assert client.post('/db/upload_history', data=data, content_type='application/zip').status_code == 401
+    url = f'/db/upload_history?account_id={accounts["plain"]}'
+    assert client.post(url, data=data, content_type='application/zip').status_code == 401
+
+    db_session.merge(User(spotify_user_id='careful-uploader', display_name='careful-uploader'))
+    db_session.commit()
+    with client.session_transaction() as session:
+        session['account_id'] = 'careful-uploader'
+    plays = client.get(f'/db/history/skip-stats?account_id={accounts["plain"]}').get_json()['total_plays']
+    response = client.post(url, data=data, content_type='application/zip')
+    assert wait_for_job(client, response.get_json()['status_url'])['rows_inserted'] == 3020
+    assert client.get('/db/history/skip-stats').get_json()['total_plays'] == 3020
+    assert client.get(f'/db/history/skip-stats?account_id={accounts["plain"]}').get_json()['total_plays'] == plays
+
+def test_files_of_the_same_name_in_different_folders_are_all_imported(flask_app, tmp_path):
+    db_session.merge(User(spotify_user_id='two-folders', display_name='two-folders'))
+    db_session.commit()
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = 'two-folders'
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for folder in ('first', 'second'):
+            for path in write_test_export(tmp_path / folder, plays=1000, episodes=0):
+                archive.write(path, f'{folder}/{os.path.basename(path)}')
+    response = client.post('/db/upload_history', data=buffer.getvalue(), content_type='application/zip')
+    job = wait_for_job(client, response.get_json()['status_url'])
+    assert (job['state'], job['files_total'], job['rows_read']) == ('done', 2 * len(os.listdir(tmp_path / 'first')), 2000)
+
+def test_upload_rejects_anything_but_a_zip(flask_app):
+    db_session.merge(User(spotify_user_id='zip-uploader', display_name='zip-uploader'))
+    db_session.commit()
+    client = flask_app.test_client()
+    with client.session_transaction() as session:
+        session['account_id'] = 'zip-uploader'
+    response = client.post('/db/upload_history', data=b'not a zip', content_type='application/zip')
+    assert response.status_code == 400
+    assert client.get('/db/upload_history/unknown').status_code == 404